@@ -0,0 +1,53 @@
+import resource
+import time
+from pathlib import Path
+
+from Indexer.Index import Index
+from Indexer.TieredIndex import TieredIndex
+
+
+def prepare_workspace(workspace_dir: str):
+    """Creates the index directories in workspace_dir and points the indexes at them instead of ./Indexer"""
+    workspace_path = Path(workspace_dir).resolve()
+
+    TieredIndex.local_store_dir = str(workspace_path.joinpath("Local_Store"))
+    TieredIndex.settings_directory = str(workspace_path.joinpath("Tiered_Indexes_Settings"))
+    Index.index_directory = str(workspace_path.joinpath("Tiered_Indexes"))
+    Index.partial_index_directory = str(workspace_path.joinpath("Partial_Tiered_Indexes"))
+    Index.settings_directory = str(workspace_path.joinpath("Tiered_Indexes_Settings"))
+
+    for directory in (TieredIndex.local_store_dir, Index.index_directory,
+                      Index.partial_index_directory, Index.settings_directory):
+        Path(directory).mkdir(parents=True, exist_ok=True)
+
+
+def peak_memory_kb() -> int:
+    """Peak resident memory of this process so far in kilobytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_build_benchmark(tiered_index: TieredIndex) -> {str: object}:
+    """Builds the tiered indexes, timing each build phase and measuring memory and the size of the index files"""
+    memory_before_kb = peak_memory_kb()
+    start_time = time.perf_counter()
+    tiered_index.build_tiered_indexes()
+    total_seconds = time.perf_counter() - start_time
+
+    # a sharded index keeps the files of each shard in the shard's own directory
+    index_directories = [tiered_index.index_directories["index_directory"] or Index.index_directory] + \
+        [shard.index_directories["index_directory"] for shard in getattr(tiered_index, "shards", [])]
+    index_file_sizes = {str(index_file.relative_to(Path(index_directories[0]).parent)): index_file.stat().st_size
+                        for index_directory in index_directories
+                        for index_file in Path(index_directory).iterdir() if index_file.is_file()}
+
+    return {
+        "total_seconds": total_seconds,
+        "phases": dict(tiered_index.build_phase_timings),
+        "docs": tiered_index.doc_id_counter,
+        "docs_per_second": tiered_index.doc_id_counter / total_seconds if total_seconds > 0 else 0.0,
+        "peak_memory_kb": peak_memory_kb(),
+        "peak_memory_before_build_kb": memory_before_kb,
+        "index_file_bytes": index_file_sizes,
+        "total_index_bytes": sum(index_file_sizes.values()),
+        "build_metrics": tiered_index.build_metrics.summary(),
+    }
@@ -0,0 +1,88 @@
+import itertools
+import json
+import random
+from pathlib import Path
+
+
+class CorpusGenerator:
+    """
+    Generates a synthetic local store of crawled pages in the same JSON format as Indexer/Local_Store,
+    with words drawn from a Zipf distribution so posting list lengths look like those of real text
+    """
+
+    def __init__(self,
+                 doc_count: int,
+                 vocabulary_size: int = 5000,
+                 words_per_doc: int = 300,
+                 links_per_doc: float = 8.0,
+                 host_count: int = 20,
+                 seed: int = 0):
+
+        self.doc_count: int = doc_count
+        self.vocabulary_size: int = vocabulary_size
+        self.words_per_doc: int = words_per_doc
+        self.links_per_doc: float = links_per_doc  # link density, average number of out links of a page
+        self.host_count: int = host_count
+        self.seed: int = seed
+
+        self.random = random.Random(seed)
+        self.vocabulary: [str] = [self.__make_word(i) for i in range(vocabulary_size)]
+        self.word_cum_weights: [float] = list(itertools.accumulate(1 / rank
+                                                                   for rank in range(1, vocabulary_size + 1)))
+        self.hosts: [str] = [f"www.site{i}.example.com" for i in range(host_count)]
+        self.urls: [str] = [f"https://{self.random.choice(self.hosts)}/page/{doc_number}"
+                            for doc_number in range(doc_count)]
+
+    def __make_word(self, word_number: int) -> str:
+        # spell out the word number in letters so the stemmer and tokenizer treat every word as a distinct term
+        letters = "bcdfghjklmnpqrstvwxz"
+        vowels = "aeiou"
+        word = ""
+        word_number += 1
+        while word_number > 0:
+            word_number, remainder = divmod(word_number, len(letters) * len(vowels))
+            consonant, vowel = divmod(remainder, len(vowels))
+            word += letters[consonant] + vowels[vowel]
+        return word
+
+    def words(self, count: int) -> [str]:
+        # mix in uniformly drawn words so pages differ enough not to be dropped as near duplicates
+        return [self.random.choice(self.vocabulary) if self.random.random() < 0.5 else zipf_word
+                for zipf_word in self.random.choices(self.vocabulary, cum_weights=self.word_cum_weights, k=count)]
+
+    def generate_page(self, doc_number: int) -> {str: str}:
+        title = " ".join(self.words(6))
+        header = " ".join(self.words(5))
+        paragraphs = "".join(
+            f"<p>{' '.join(self.words(self.words_per_doc // 4))} <b><span>{' '.join(self.words(3))}</span></b></p>"
+            for _ in range(4)
+        )
+        link_count = int(self.random.expovariate(1 / self.links_per_doc)) if self.links_per_doc > 0 else 0
+        links = "".join(f'<a href="{self.random.choice(self.urls)}">{" ".join(self.words(3))}</a> '
+                        for _ in range(link_count))
+        content = f"<html><head><title>{title}</title></head>" \
+                  f"<body><h1><span>{header}</span></h1>{paragraphs}<div>{links}</div></body></html>"
+        return {"url": self.urls[doc_number], "content": content, "encoding": "utf-8"}
+
+    def generate(self, local_store_dir: str, docs_per_directory: int = 1000):
+        """Writes the generated pages as JSON files into sub directories of local_store_dir"""
+        local_store_path = Path(local_store_dir)
+        for doc_number in range(self.doc_count):
+            directory_path = local_store_path.joinpath(f"batch_{doc_number // docs_per_directory}")
+            directory_path.mkdir(parents=True, exist_ok=True)
+            with open(directory_path.joinpath(f"{doc_number}.json"), mode="w") as f:
+                json.dump(self.generate_page(doc_number), f)
+
+    def generate_queries(self, query_count: int, max_query_words: int = 3) -> [str]:
+        """Generates a query workload whose words follow the same distribution as the corpus"""
+        return [" ".join(self.words(self.random.randint(1, max_query_words))) for _ in range(query_count)]
+
+    def settings(self) -> {str: object}:
+        return {
+            "doc_count": self.doc_count,
+            "vocabulary_size": self.vocabulary_size,
+            "words_per_doc": self.words_per_doc,
+            "links_per_doc": self.links_per_doc,
+            "host_count": self.host_count,
+            "seed": self.seed,
+        }
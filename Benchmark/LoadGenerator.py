@@ -0,0 +1,379 @@
+import argparse
+import gc
+import json
+import multiprocessing
+import random
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from typing import Optional
+
+from Benchmark.BuildBenchmark import prepare_workspace
+from Benchmark.CorpusGenerator import CorpusGenerator
+from Benchmark.QueryBenchmark import latency_summary, percentile
+from Indexer.TieredIndex import TieredIndex
+from Scorer import Scorer
+
+
+class LoadSession:
+    """A query searched for its first page and then paged through, like !Next in the driver, for pages pages"""
+
+    def __init__(self, query: str, pages: int = 1):
+        self.query: str = query
+        self.pages: int = pages
+
+
+def read_session_log(query_log_file: str) -> [LoadSession]:
+    """
+    Reads the sessions of a query log with a query per line, as text or as the json records of the slow query
+    log. A !Next line asks for the next page of the query before it, as typed in the driver
+    """
+    sessions: [LoadSession] = []
+    with open(query_log_file, mode="r") as f:
+        for line in f:
+            query = line.strip()
+            if query == "!Next":
+                if len(sessions) > 0:
+                    sessions[-1].pages += 1
+                continue
+            if query.startswith("{"):
+                try:
+                    query = str(json.loads(query).get("query", ""))
+                except (json.JSONDecodeError, AttributeError):
+                    pass
+            if len(query) > 0 and not query.startswith("!"):
+                sessions.append(LoadSession(query))
+    return sessions
+
+
+def synthetic_sessions(queries: [str],
+                       session_count: int,
+                       next_page_probability: float,
+                       max_pages: int,
+                       seed: int = 0) -> [LoadSession]:
+    """
+    Sessions of the queries drawn with zipf popularity, the first query the most popular, each asking for the
+    next page with next_page_probability after every page up to max_pages
+    """
+    rng = random.Random(seed)
+    query_weights = [1 / rank for rank in range(1, len(queries) + 1)]
+    sessions: [LoadSession] = []
+    for query in rng.choices(queries, weights=query_weights, k=session_count):
+        pages = 1
+        while pages < max_pages and rng.random() < next_page_probability:
+            pages += 1
+        sessions.append(LoadSession(query, pages))
+    return sessions
+
+
+class InProcessTarget:
+    """
+    Searches a tiered index opened before the load workers are forked, each worker with its own scorer, the way
+    the search server workers search it
+    """
+
+    # any error raised searching in process is recorded against its page, like the search server answers it
+    SEARCH_ERRORS = (Exception,)
+
+    def __init__(self, tiered_index: TieredIndex):
+        self.tiered_index: TieredIndex = tiered_index
+        self.scorer: Optional[Scorer] = None  # set in the workers
+
+    def start_worker(self):
+        self.scorer = Scorer(self.tiered_index)
+
+    def search(self, query: str, page: int, k_results: int, time_budget_ms: Optional[float]) -> {str: object}:
+        head_query_hits = self.scorer.stats["head_query_hits"]
+        phrase_cache_stats = self.tiered_index.phrase_cache_stats()
+        if page == 1:
+            self.scorer.new_search()
+            results = self.scorer.sprint_search(query, k_results, time_budget_ms=time_budget_ms)
+        else:  # the scorer carries on from the page before, like the driver
+            results = self.scorer.complete_search(query, k_results, time_budget_ms=time_budget_ms)
+        phrase_cache_stats = {counter: count - phrase_cache_stats[counter]
+                              for counter, count in self.tiered_index.phrase_cache_stats().items()}
+        return {
+            "results": len(results),
+            "partial": results.partial,
+            "head_query_hit": self.scorer.stats["head_query_hits"] > head_query_hits,
+            "phrase_cache_hits": phrase_cache_stats["hits"],
+            "phrase_cache_misses": phrase_cache_stats["misses"],
+        }
+
+
+class HttpTarget:
+    """Searches a search server at endpoint, which answers each page of a session on its own"""
+
+    SEARCH_ERRORS = (urllib.error.URLError, OSError, ValueError, KeyError)
+
+    def __init__(self, endpoint: str, timeout_s: float = 10.0):
+        self.endpoint: str = endpoint.rstrip("/")
+        self.timeout_s: float = timeout_s
+
+    def start_worker(self):
+        pass
+
+    def search(self, query: str, page: int, k_results: int, time_budget_ms: Optional[float]) -> {str: object}:
+        parameters = {"q": query, "k": k_results, "page": page}
+        if time_budget_ms is not None:
+            parameters["budget_ms"] = time_budget_ms
+        with urllib.request.urlopen(f"{self.endpoint}/search?{urllib.parse.urlencode(parameters)}",
+                                    timeout=self.timeout_s) as response:
+            response_dict = json.loads(response.read().decode("utf-8"))
+        return {
+            "results": len(response_dict["results"]),
+            "partial": response_dict["partial"],
+            "head_query_hit": response_dict.get("head_query_hit", False),
+            "phrase_cache_hits": response_dict.get("phrase_cache_hits", 0),
+            "phrase_cache_misses": response_dict.get("phrase_cache_misses", 0),
+        }
+
+
+def load_worker(target,
+                session_queue: multiprocessing.Queue,
+                record_queue: multiprocessing.Queue,
+                k_results: int,
+                time_budget_ms: Optional[float],
+                think_time_ms: float):
+    """
+    Runs the sessions taken from session_queue until it takes None, putting a record of each page searched.
+    Puts None once done, even if the worker fails, so the records are never waited for past its end
+    """
+    try:
+        target.start_worker()
+        while True:
+            session_item = session_queue.get()
+            if session_item is None:
+                break
+            session_number, session, scheduled_time = session_item
+            for page in range(1, session.pages + 1):
+                record = {"session": session_number, "page": page, "start": time.time(), "error": None,
+                          "scheduled": scheduled_time if page == 1 else None}
+                try:
+                    record.update(target.search(session.query, page, k_results, time_budget_ms))
+                except target.SEARCH_ERRORS as e:
+                    record["error"] = type(e).__name__
+                record["end"] = time.time()
+                record_queue.put(record)
+                if record["error"] is not None:
+                    break  # a user would not page through a failed search
+                if page < session.pages and think_time_ms > 0:
+                    time.sleep(think_time_ms / 1000)
+    finally:
+        record_queue.put(None)
+
+
+def run_load_test(target,
+                  sessions: [LoadSession],
+                  concurrency: int,
+                  arrival_rate: Optional[float] = None,
+                  k_results: int = 10,
+                  time_budget_ms: Optional[float] = None,
+                  think_time_ms: float = 0.0,
+                  interval_s: float = 1.0,
+                  seed: int = 0) -> {str: object}:
+    """
+    Runs the sessions from concurrency forked worker processes and summarizes the pages searched. With an
+    arrival_rate the sessions arrive as a poisson process of arrival_rate sessions per second and their first
+    pages are timed from their arrival, so the time they wait for a free worker counts. Without one every
+    worker starts the next session as soon as it finishes the last
+    """
+    context = multiprocessing.get_context("fork")
+    session_queue = context.Queue()
+    record_queue = context.Queue()
+    # objects loaded before forking are only read by the workers, like in the search server
+    gc.freeze()
+    workers = [context.Process(target=load_worker,
+                               args=(target, session_queue, record_queue, k_results, time_budget_ms, think_time_ms),
+                               daemon=True)
+               for _ in range(concurrency)]
+    for worker in workers:
+        worker.start()
+
+    rng = random.Random(seed)
+    start_time = time.time()
+    arrival_time = start_time
+    for session_number, session in enumerate(sessions):
+        scheduled_time = None
+        if arrival_rate is not None:
+            arrival_time += rng.expovariate(arrival_rate)
+            time.sleep(max(0.0, arrival_time - time.time()))
+            scheduled_time = arrival_time
+        session_queue.put((session_number, session, scheduled_time))
+    for _ in workers:
+        session_queue.put(None)
+
+    # the records are read before joining, since a worker exits only once its records are taken off the queue
+    records: [{str: object}] = []
+    workers_finished = 0
+    while workers_finished < len(workers):
+        record = record_queue.get()
+        if record is None:
+            workers_finished += 1
+        else:
+            records.append(record)
+    end_time = time.time()
+    # sessions left by workers that failed are never taken off the queue, so exiting must not wait to flush them
+    session_queue.cancel_join_thread()
+    for worker in workers:
+        worker.join()
+
+    load_test_results = {
+        "sessions": len(sessions),
+        "concurrency": concurrency,
+        "arrival_rate": arrival_rate,
+        "k_results": k_results,
+        "time_budget_ms": time_budget_ms,
+        "think_time_ms": think_time_ms,
+    }
+    load_test_results.update(summarize_records(records, end_time - start_time))
+    load_test_results["over_time"] = [
+        dict(interval_start_s=interval_number * interval_s,
+             **summarize_records([record for record in records
+                                  if int((record["end"] - start_time) // interval_s) == interval_number],
+                                 min(interval_s, end_time - start_time - interval_number * interval_s),
+                                 percentiles_only=True))
+        for interval_number in range(int((end_time - start_time) // interval_s) + 1)
+    ]
+    return load_test_results
+
+
+def summarize_records(records: [{str: object}], duration_s: float, percentiles_only: bool = False) -> {str: object}:
+    """Throughput, latency percentiles, error rate and cache hit ratios of the pages searched in duration_s"""
+    succeeded = [record for record in records if record["error"] is None]
+    first_pages = [record for record in succeeded if record["page"] == 1]
+    latencies_ms = sorted((record["end"] - record["start"]) * 1000 for record in succeeded)
+    phrase_cache_lookups = sum(record["phrase_cache_hits"] + record["phrase_cache_misses"] for record in succeeded)
+
+    summary = {
+        "requests": len(records),
+        "throughput_rps": len(succeeded) / duration_s if duration_s > 0 else 0.0,
+        "p50_ms": percentile(latencies_ms, 50),
+        "p99_ms": percentile(latencies_ms, 99),
+        "error_rate": (len(records) - len(succeeded)) / len(records) if len(records) > 0 else 0.0,
+        "head_query_hit_ratio":
+            sum(record["head_query_hit"] for record in first_pages) / len(first_pages) if len(first_pages) > 0 else 0.0,
+        "phrase_cache_hit_ratio":
+            sum(record["phrase_cache_hits"] for record in succeeded) / phrase_cache_lookups
+            if phrase_cache_lookups > 0 else 0.0,
+    }
+    if percentiles_only:
+        return summary
+
+    errors: {str: int} = {}
+    for record in records:
+        if record["error"] is not None:
+            errors[record["error"]] = errors.get(record["error"], 0) + 1
+    # first pages of sessions that arrived on schedule are timed from their arrival, counting the wait for a worker
+    response_times_ms = [(record["end"] - record["scheduled"]) * 1000 for record in first_pages
+                         if record["scheduled"] is not None]
+    summary.update({
+        "duration_s": duration_s,
+        "errors": errors,
+        "partial_rate": sum(record["partial"] for record in succeeded) / len(succeeded) if len(succeeded) > 0 else 0.0,
+        "first_page": latency_summary([(record["end"] - record["start"]) * 1000 for record in first_pages],
+                                      duration_s),
+        "next_pages": latency_summary([(record["end"] - record["start"]) * 1000 for record in succeeded
+                                       if record["page"] > 1], duration_s),
+    })
+    if len(response_times_ms) > 0:
+        summary["first_page_response"] = latency_summary(response_times_ms, duration_s)
+    return summary
+
+
+def print_load_test_results(load_test_results: {str: object}):
+    print(f"{'time s':>8} {'requests':>9} {'rps':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} "
+          f"{'head hits':>9} {'phrase hits':>11}")
+    for interval in load_test_results["over_time"]:
+        print(f"{interval['interval_start_s']:>8.1f} {interval['requests']:>9} {interval['throughput_rps']:>8.1f} "
+              f"{interval['p50_ms']:>8.2f} {interval['p99_ms']:>8.2f} {interval['error_rate']:>7.1%} "
+              f"{interval['head_query_hit_ratio']:>9.1%} {interval['phrase_cache_hit_ratio']:>11.1%}")
+    print(f"{load_test_results['requests']} requests of {load_test_results['sessions']} sessions in "
+          f"{load_test_results['duration_s']:.1f}s: {load_test_results['throughput_rps']:.1f} requests/s, "
+          f"p50 {load_test_results['p50_ms']:.2f}ms, p99 {load_test_results['p99_ms']:.2f}ms, "
+          f"{load_test_results['error_rate']:.1%} errors, {load_test_results['partial_rate']:.1%} partial")
+    if "first_page_response" in load_test_results:
+        print(f"First page response from arrival: p50 {load_test_results['first_page_response']['p50_ms']:.2f}ms, "
+              f"p99 {load_test_results['first_page_response']['p99_ms']:.2f}ms")
+
+
+def main(arguments: [str]):
+    parser = argparse.ArgumentParser(description="Replays a query log or synthetic search sessions against the "
+                                                 "tiered index at a set concurrency and arrival rate")
+    parser.add_argument("--query-log", default=None,
+                        help="query log to replay, a query per line with !Next lines paging through the query "
+                             "before, synthetic sessions are searched if not given")
+    parser.add_argument("--sessions", type=int, default=None,
+                        help="number of sessions searched, every session of the query log or 1000 synthetic ones "
+                             "by default")
+    parser.add_argument("--distinct-queries", type=int, default=200,
+                        help="number of distinct synthetic queries the sessions are drawn from")
+    parser.add_argument("--docs", type=int, default=1000,
+                        help="documents of the benchmark corpus, which the synthetic queries are drawn like")
+    parser.add_argument("--vocabulary", type=int, default=5000,
+                        help="distinct words of the benchmark corpus, which the synthetic queries are drawn from")
+    parser.add_argument("--next-page-probability", type=float, default=0.3,
+                        help="probability a synthetic session asks for the next page after each page")
+    parser.add_argument("--max-pages", type=int, default=5, help="most pages of a synthetic session")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the sessions and their arrivals")
+    parser.add_argument("--concurrency", type=int, default=4, help="number of sessions searched at once")
+    parser.add_argument("--arrival-rate", type=float, default=None,
+                        help="sessions started per second as a poisson process, as fast as the workers take them "
+                             "if not given")
+    parser.add_argument("--k-results", type=int, default=10, help="results requested per page")
+    parser.add_argument("--time-budget-ms", type=float, default=None, help="time budget of each search")
+    parser.add_argument("--think-time-ms", type=float, default=0.0, help="pause between the pages of a session")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds summarized in each line over time")
+    parser.add_argument("--endpoint", default=None,
+                        help="url of a running search server, like http://127.0.0.1:8080, instead of searching "
+                             "the indexes in process")
+    parser.add_argument("--workspace", default=None,
+                        help="benchmark workspace of the indexes searched in process instead of ./Indexer")
+    parser.add_argument("--data-directory", default=None,
+                        help="directory of the indexes searched in process, like an index generation")
+    parser.add_argument("--warm-up-mb", type=int, default=TieredIndex.WARM_UP_BUDGET >> 20,
+                        help="megabytes of the indexes searched in process read into the page cache first")
+    parser.add_argument("--max-n-grams", type=int, default=3)
+    parser.add_argument("--page-rank-iterations", type=int, default=5)
+    parser.add_argument("--output", default="./Benchmark/load_test_results.json",
+                        help="file the JSON results are written to")
+    args = parser.parse_args(arguments)
+
+    if args.query_log is not None:
+        sessions = read_session_log(args.query_log)
+        if args.sessions is not None:
+            sessions = sessions[:args.sessions]
+    else:
+        queries = CorpusGenerator(doc_count=args.docs, vocabulary_size=args.vocabulary, seed=args.seed) \
+            .generate_queries(args.distinct_queries)
+        sessions = synthetic_sessions(queries, args.sessions or 1000, args.next_page_probability, args.max_pages,
+                                      args.seed)
+    print(f"Replaying {len(sessions)} sessions of {sum(session.pages for session in sessions)} pages with "
+          f"{args.concurrency} workers")
+
+    run_arguments = dict(concurrency=args.concurrency, arrival_rate=args.arrival_rate, k_results=args.k_results,
+                         time_budget_ms=args.time_budget_ms, think_time_ms=args.think_time_ms,
+                         interval_s=args.interval, seed=args.seed)
+    if args.endpoint is not None:
+        load_test_results = run_load_test(HttpTarget(args.endpoint), sessions, **run_arguments)
+    else:
+        if args.workspace is not None:
+            prepare_workspace(args.workspace)
+        with TieredIndex(args.max_n_grams, args.page_rank_iterations,
+                         data_directory=args.data_directory) as tiered_index:
+            tiered_index.warm_up(args.warm_up_mb << 20)
+            load_test_results = run_load_test(InProcessTarget(tiered_index), sessions, **run_arguments)
+    load_test_results["target"] = args.endpoint or "in_process"
+
+    print_load_test_results(load_test_results)
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, mode="w") as f:
+        json.dump(load_test_results, f, indent=2)
+    print(f"Wrote load test results to {args.output}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
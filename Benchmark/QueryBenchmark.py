@@ -0,0 +1,74 @@
+import math
+import time
+
+from Scorer import Scorer
+
+
+def percentile(sorted_values: [float], percent: float) -> float:
+    """Nearest rank percentile of already sorted values"""
+    if len(sorted_values) == 0:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def latency_summary(latencies_ms: [float], total_seconds: float) -> {str: float}:
+    sorted_latencies = sorted(latencies_ms)
+    return {
+        "queries": len(sorted_latencies),
+        "mean_ms": sum(sorted_latencies) / len(sorted_latencies) if len(sorted_latencies) > 0 else 0.0,
+        "p50_ms": percentile(sorted_latencies, 50),
+        "p95_ms": percentile(sorted_latencies, 95),
+        "p99_ms": percentile(sorted_latencies, 99),
+        "max_ms": sorted_latencies[-1] if len(sorted_latencies) > 0 else 0.0,
+        "throughput_qps": len(sorted_latencies) / total_seconds if total_seconds > 0 else 0.0,
+    }
+
+
+def run_query_benchmark(scorer: Scorer, queries: [str], k_results: int = 10, fielded: bool = False) -> {str: object}:
+    """
+    Replays the queries the way the driver does, a first page sprint search followed by a next page complete
+    search, timing each call. If fielded is set each query is also searched with a first page fielded search
+    """
+    sprint_latencies_ms = []
+    complete_latencies_ms = []
+    fielded_latencies_ms = []
+    sprint_seconds = 0.0
+    complete_seconds = 0.0
+    fielded_seconds = 0.0
+    empty_results = 0
+
+    for query in queries:
+        scorer.new_search()
+
+        start_time = time.perf_counter()
+        results = scorer.sprint_search(query, k_results=k_results)
+        duration = time.perf_counter() - start_time
+        sprint_seconds += duration
+        sprint_latencies_ms.append(duration * 1000)
+        if len(results) == 0:
+            empty_results += 1
+
+        start_time = time.perf_counter()
+        scorer.complete_search(query, k_results=k_results)
+        duration = time.perf_counter() - start_time
+        complete_seconds += duration
+        complete_latencies_ms.append(duration * 1000)
+
+        if fielded:
+            scorer.new_search()
+            start_time = time.perf_counter()
+            scorer.fielded_search(query, k_results=k_results)
+            duration = time.perf_counter() - start_time
+            fielded_seconds += duration
+            fielded_latencies_ms.append(duration * 1000)
+
+    query_results = {
+        "sprint_search": latency_summary(sprint_latencies_ms, sprint_seconds),
+        "complete_search": latency_summary(complete_latencies_ms, complete_seconds),
+        "empty_results": empty_results,
+        "budget_exceeded": scorer.stats["budget_exceeded"],
+    }
+    if fielded:
+        query_results["fielded_search"] = latency_summary(fielded_latencies_ms, fielded_seconds)
+    return query_results
@@ -0,0 +1,109 @@
+import argparse
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+
+from Benchmark.BuildBenchmark import prepare_workspace, run_build_benchmark
+from Benchmark.CorpusGenerator import CorpusGenerator
+from Benchmark.QueryBenchmark import run_query_benchmark
+
+
+def main(arguments: [str]):
+    parser = argparse.ArgumentParser(description="Benchmarks building and searching the tiered index "
+                                                 "on a reproducible synthetic corpus")
+    parser.add_argument("--workspace", default="./Benchmark/Workspace",
+                        help="directory the synthetic local store and the indexes are written to")
+    parser.add_argument("--output", default="./Benchmark/benchmark_results.json",
+                        help="file the JSON results are written to")
+    parser.add_argument("--docs", type=int, default=1000, help="number of documents to generate")
+    parser.add_argument("--vocabulary", type=int, default=5000, help="number of distinct words")
+    parser.add_argument("--words-per-doc", type=int, default=300, help="words of body text in each document")
+    parser.add_argument("--links-per-doc", type=float, default=8.0, help="average out links of each document")
+    parser.add_argument("--queries", type=int, default=200, help="number of queries replayed")
+    parser.add_argument("--k-results", type=int, default=10, help="results requested per search")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the corpus and the queries")
+    parser.add_argument("--skip-generate", action="store_true", help="reuse the local store in the workspace")
+    parser.add_argument("--skip-build", action="store_true", help="reuse the indexes built in the workspace")
+    parser.add_argument("--pack", action="store_true",
+                        help="pack the local store into a doc store and build from it instead of the json files")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="build this many doc id range shards and search them in parallel worker processes")
+    parser.add_argument("--unigram-positions-only", action="store_true",
+                        help="build the positional tiers with single words only, matching n-grams from positions")
+    parser.add_argument("--fielded-postings", action="store_true",
+                        help="also build the fielded index scored with BM25F and time fielded searches of it")
+    args = parser.parse_args(arguments)
+
+    prepare_workspace(args.workspace)
+
+    # imported after the workspace is prepared, since the index directories are read when they are constructed
+    from Indexer.TieredIndex import TieredIndex
+    from Indexer.ShardedTieredIndex import ShardedTieredIndex
+    from Indexer.DocStore import DocStore, pack_local_store
+    from Scorer import Scorer
+    from ShardedScorer import ShardedScorer
+
+    corpus_generator = CorpusGenerator(doc_count=args.docs,
+                                       vocabulary_size=args.vocabulary,
+                                       words_per_doc=args.words_per_doc,
+                                       links_per_doc=args.links_per_doc,
+                                       seed=args.seed)
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python_version": platform.python_version(),
+        "corpus": corpus_generator.settings(),
+    }
+
+    if not args.skip_generate:
+        print(f"Generating {args.docs} documents in {TieredIndex.local_store_dir}...", end="")
+        start_time = time.perf_counter()
+        corpus_generator.generate(TieredIndex.local_store_dir)
+        results["generate_seconds"] = time.perf_counter() - start_time
+        print("Done")
+
+    doc_store_path = Path(TieredIndex.local_store_dir).joinpath(DocStore.file_name)
+    if args.pack:
+        start_time = time.perf_counter()
+        pack_local_store(TieredIndex.local_store_dir)
+        results["pack_seconds"] = time.perf_counter() - start_time
+    elif not args.skip_generate:
+        doc_store_path.unlink(missing_ok=True)  # a doc store packed by an earlier run would be read instead
+    results["doc_store"] = doc_store_path.is_file()
+
+    results["shards"] = args.shards
+    results["unigram_positions_only"] = args.unigram_positions_only
+    results["fielded_postings"] = args.fielded_postings
+    # a reused build keeps the mode it was built with
+    unigram_positions_only = None if args.skip_build else args.unigram_positions_only
+    fielded_postings = None if args.skip_build else args.fielded_postings
+    assert args.shards == 0 or not args.fielded_postings, f"Fielded postings are not built for sharded indexes"
+    if args.shards > 0:
+        tiered_index = ShardedTieredIndex(args.shards, max_n_grams=3, page_rank_iterations=5,
+                                          shards_directory=str(Path(args.workspace).joinpath("Shards")),
+                                          unigram_positions_only=unigram_positions_only)
+    else:
+        tiered_index = TieredIndex(max_n_grams=3, page_rank_iterations=5,
+                                   unigram_positions_only=unigram_positions_only,
+                                   fielded_postings=fielded_postings)
+    with tiered_index:
+        if not args.skip_build:
+            results["build"] = run_build_benchmark(tiered_index)
+
+        queries = corpus_generator.generate_queries(args.queries)
+        if args.shards > 0:
+            with ShardedScorer(tiered_index) as sharded_scorer:
+                results["queries"] = run_query_benchmark(sharded_scorer, queries, args.k_results)
+        else:
+            results["queries"] = run_query_benchmark(Scorer(tiered_index), queries, args.k_results,
+                                                     fielded=tiered_index.fielded_index is not None)
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, mode="w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote benchmark results to {args.output}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
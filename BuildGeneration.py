@@ -0,0 +1,71 @@
+import argparse
+import os
+import sys
+from typing import Optional
+
+from Indexer.IndexGenerations import IndexGenerations
+from Indexer.TieredIndex import TieredIndex
+from PrecomputeHeadQueries import precompute_head_queries, logged_query_counts
+
+
+def build_generation(index_generations: IndexGenerations,
+                     max_n_grams: int,
+                     page_rank_iterations: int,
+                     doc_id_ordering: Optional[str] = None,
+                     resume: bool = True,
+                     query_log_file: Optional[str] = None,
+                     top_queries: int = 1000,
+                     unigram_positions_only: bool = False,
+                     fielded_postings: bool = False) -> str:
+    """
+    Builds a new generation of index_generations from the local store, publishes it and reclaims the old generations.
+    If resume is set a generation left unpublished by an interrupted build is finished instead.
+    If a query log is given the posting lists of the terms queried most are written first in the indexes,
+    and the results of its top_queries most frequent queries are precomputed before the generation is published
+    """
+    generation = index_generations.unpublished_generation() if resume else None
+    if generation is None:
+        generation = index_generations.new_generation()
+    print(f"Building index generation {generation}")
+    with TieredIndex(max_n_grams, page_rank_iterations, doc_id_ordering,
+                     data_directory=index_generations.generation_directory(generation),
+                     unigram_positions_only=unigram_positions_only,
+                     fielded_postings=fielded_postings) as tiered_index:
+        if query_log_file is not None:
+            tiered_index.set_query_counts(logged_query_counts(query_log_file))
+        tiered_index.build_tiered_indexes(resume=resume)
+        if query_log_file is not None:
+            precompute_head_queries(tiered_index, query_log_file, top_queries)
+    index_generations.publish(generation)
+    print(f"Published index generation {generation}")
+    index_generations.reclaim()
+    return generation
+
+
+def main(arguments: [str]):
+    parser = argparse.ArgumentParser(description="Builds and publishes a new generation of the tiered indexes")
+    parser.add_argument("--generations", default=IndexGenerations.generations_directory,
+                        help="directory of the index generations")
+    parser.add_argument("--max-n-grams", type=int, default=3)
+    parser.add_argument("--page-rank-iterations", type=int, default=5)
+    parser.add_argument("--doc-id-ordering", choices=TieredIndex.DOC_ID_ORDERINGS, default=None)
+    parser.add_argument("--no-resume", action="store_true",
+                        help="start a new generation even if the last build was interrupted")
+    parser.add_argument("--query-log", default=None,
+                        help="query log to lay out the indexes by and precompute the most frequent queries from")
+    parser.add_argument("--top-queries", type=int, default=1000)
+    parser.add_argument("--unigram-positions-only", action="store_true",
+                        help="store positions of single words only and match n-grams from them when searched")
+    parser.add_argument("--fielded-postings", action="store_true",
+                        help="also build the fielded index, one posting per term and doc for all fields")
+    args = parser.parse_args(arguments)
+
+    index_generations = IndexGenerations(args.generations)
+    build_generation(index_generations, args.max_n_grams, args.page_rank_iterations, args.doc_id_ordering,
+                     resume=not args.no_resume, query_log_file=args.query_log, top_queries=args.top_queries,
+                     unigram_positions_only=args.unigram_positions_only, fielded_postings=args.fielded_postings)
+    print(f"Current generation: {index_generations.current_generation()} in {os.path.abspath(args.generations)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -5,29 +5,53 @@ import sys
 
 from Scorer import Scorer
 
+
+def print_result(tiered_index: TieredIndex, result_number: int, url: str, query: str):
+    """Prints the result url with its title and a snippet of the page with the query terms highlighted"""
+    print(f"\n{result_number}. {url}")
+    doc_id = tiered_index.doc_table.get_doc_id(url)
+    if doc_id is None or doc_id >= len(tiered_index.forward_index):
+        return
+    title = tiered_index.forward_index.get_title(doc_id)
+    if len(title) > 0:
+        print(f"   {title}")
+    snippet = tiered_index.forward_index.snippet(doc_id, query, highlight_start="\033[1m", highlight_end="\033[0m")
+    print(f"   {snippet}")
+
+
 if __name__ == "__main__":
     with TieredIndex(max_n_grams=3, page_rank_iterations=5) as tiered_index:
-        tiered_index.build_tiered_indexes()
+        tiered_index.build_tiered_indexes(resume=True)
+        tiered_index.warm_up()
 
         scorer: Scorer = Scorer(tiered_index)
 
         k_results = 10
+        time_budget_ms = 100
         query = None
 
         while True:
             print("-" * 80)
             scorer.new_search()
             if query is None:
-                print(f"SandySearch: Enter a search query. !Exit to exit")
+                print(f"SandySearch: Enter a search query. !Exit to exit, !Suggest followed by the start of a query "
+                      f"for suggestions")
                 query = input("SandySearch: ")
             if query == "!Exit":
                 break
+            if query.startswith("!Suggest"):
+                suggestions = tiered_index.autocomplete.complete(query[len("!Suggest "):])
+                print(f"Suggestions: {', '.join(suggestions) if len(suggestions) > 0 else 'none'}")
+                query = None
+                continue
             print(f"Searching...", end="")
             start_time = time.time()
-            results = scorer.sprint_search(query, k_results=k_results)
+            results = scorer.sprint_search(query, k_results=k_results, time_budget_ms=time_budget_ms)
             end_time = time.time()
             duration = round(end_time - start_time, 4)
             print(f"Top Results retrieved in {duration*1000}ms: ")
+            if results.partial:
+                print(f"Search stopped at the {time_budget_ms}ms time budget, showing the best results found so far.")
 
             if len(results) == 0:
                 print("It doesn't look like there were any good results found for your phrase.")
@@ -37,7 +61,7 @@ if __name__ == "__main__":
                 print("There weren't many relevant results from your search, try searching more general terms.")
 
             for i, url in enumerate(results, start=1):
-                print(f"\n{i}. {url}")
+                print_result(tiered_index, i, url, query)
             print()
             page_number = 2
             while True:
@@ -48,9 +72,11 @@ if __name__ == "__main__":
                 end_time = time.time()
                 duration = round(end_time - start_time, 4)
                 print(f"Found page {page_number} results in {duration*1000}ms")
+                results_query = query
 
                 print(f"Enter !Exit to exit, "
                       f"!Next to display next page results, "
+                      f"!Suggest followed by the start of a query for suggestions, "
                       f"or another search query to search for something else")
                 query = input("SandySearch: ")
                 if query != "!Next":
@@ -69,7 +95,7 @@ if __name__ == "__main__":
                     break
 
                 for i, url in enumerate(results, start=1):
-                    print(f"\n{i}. {url}")
+                    print_result(tiered_index, (page_number - 1) * k_results + i, url, results_query)
 
                 page_number += 1
                 print()
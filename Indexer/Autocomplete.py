@@ -0,0 +1,218 @@
+import heapq
+import re
+import struct
+from pathlib import Path
+from typing import Optional, Callable
+
+import Tokenizer
+from Indexer.Index import Index, MappedFile, publish_file
+
+
+class Autocomplete:
+    """
+    Completes the query being typed from the stemmed unigram to trigram terms of the complete index, ranked by doc
+    count. Terms are kept in a sorted array so the terms of a prefix are a contiguous range found by binary search.
+    Prefixes with more than SCAN_LIMIT terms have their TOP_K completions precomputed, the ranges of all other
+    prefixes are small enough to rank when queried.
+
+    File layout:
+        term bytes | term offsets | term doc counts | prefix bytes | prefix offsets | prefix completions | footer
+    term bytes:         utf-8 terms in sorted order, in the order the words are read
+    term offsets:       start of each term in the term bytes and the end of the last (uint64)
+    term doc counts:    doc count of each term (uint32)
+    prefix bytes:       utf-8 precomputed prefixes in sorted order
+    prefix offsets:     start of each prefix in the prefix bytes and the end of the last (uint64)
+    prefix completions: TOP_K term numbers of each prefix, by doc count, padded with NO_TERM (uint32)
+    footer:             offsets of the sections after the term bytes (uint64), term count (uint64),
+                        prefix count (uint64), top k (uint32), magic
+    """
+
+    TOP_K = 10  # completions precomputed for each prefix
+    SCAN_LIMIT = 64  # prefixes with more terms than this have their completions precomputed
+    NO_TERM = 0xFFFFFFFF
+    MAGIC = b"SANDYAC1"
+    FOOTER = struct.Struct("<QQQQQQQI8s")
+
+    def __enter__(self):
+        return self
+
+    def __init__(self, index_directory: Optional[str] = None, max_n_grams: int = 3):
+        self.max_n_grams: int = max_n_grams
+        self.index_path: Path = Path(index_directory or Index.index_directory)
+        assert self.index_path.is_dir(), f"Data path {self.index_path} not a directory"
+        self.autocomplete_file_name: str = "autocomplete.index"
+
+        self.autocomplete_file: Optional[MappedFile] = None
+        self.term_bytes: Optional[memoryview] = None
+        self.term_offsets: Optional[memoryview] = None
+        self.term_doc_counts: Optional[memoryview] = None
+        self.prefix_bytes: Optional[memoryview] = None
+        self.prefix_offsets: Optional[memoryview] = None
+        self.prefix_completions: Optional[memoryview] = None
+        self.term_count: int = 0
+        self.prefix_count: int = 0
+        self.top_k: int = 0
+
+        if Path(self.index_path.joinpath(self.autocomplete_file_name)).is_file():
+            self.__open_mmap()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__close_mmap()
+
+    def __len__(self):
+        return self.term_count
+
+    def build(self, document_term_counts: {str: int}):
+        """Writes the terms of document_term_counts with their doc counts and the completions of the heavy prefixes"""
+        self.__close_mmap()
+
+        # n-gram terms are indexed with their words from last to first, completions are shown in reading order
+        term_counts: {str: int} = {" ".join(reversed(term.split(" "))): count
+                                   for term, count in document_term_counts.items()}
+        terms = sorted(term_counts)  # code point order, the same as the order of the utf-8 bytes
+        counts = [min(term_counts[term], Autocomplete.NO_TERM) for term in terms]
+
+        def top_terms(start: int, end: int) -> [int]:
+            return heapq.nlargest(Autocomplete.TOP_K, range(start, end), key=lambda x: (counts[x], -x))
+
+        # split the range of each heavy prefix by the next character, keeping the ranges still too long to scan
+        prefix_completions: {str: [int]} = {}
+        heavy_ranges = [("", 0, len(terms))] if len(terms) > Autocomplete.SCAN_LIMIT else []
+        while len(heavy_ranges) > 0:
+            next_heavy_ranges = []
+            for prefix, start, end in heavy_ranges:
+                if len(prefix) > 0:
+                    prefix_completions[prefix] = top_terms(start, end)
+                if len(terms[start]) == len(prefix):  # the prefix is a term itself
+                    start += 1
+                while start < end:
+                    child_prefix = terms[start][:len(prefix) + 1]
+                    child_end = self.__bisect(terms.__getitem__, child_prefix + "\U0010FFFF", start, end)
+                    if child_end - start > Autocomplete.SCAN_LIMIT:
+                        next_heavy_ranges.append((child_prefix, start, child_end))
+                    start = child_end
+            heavy_ranges = next_heavy_ranges
+
+        prefixes = sorted(prefix_completions)
+        with publish_file(self.index_path.joinpath(self.autocomplete_file_name), mode="wb") as f:
+            self.__write_strings(f, terms)
+            term_offsets_offset = f.tell()
+            f.write(struct.pack(f"<{len(terms) + 1}Q", *self.__string_offsets(terms)))
+            term_doc_counts_offset = f.tell()
+            f.write(struct.pack(f"<{len(terms)}I", *counts))
+            f.write(b"\0" * (-f.tell() % 8))
+            prefix_bytes_offset = f.tell()
+            self.__write_strings(f, prefixes)
+            prefix_offsets_offset = f.tell()
+            f.write(struct.pack(f"<{len(prefixes) + 1}Q", *self.__string_offsets(prefixes)))
+            prefix_completions_offset = f.tell()
+            for prefix in prefixes:
+                completions = prefix_completions[prefix]
+                completions += [Autocomplete.NO_TERM] * (Autocomplete.TOP_K - len(completions))
+                f.write(struct.pack(f"<{Autocomplete.TOP_K}I", *completions))
+            f.write(Autocomplete.FOOTER.pack(term_offsets_offset, term_doc_counts_offset, prefix_bytes_offset,
+                                             prefix_offsets_offset, prefix_completions_offset,
+                                             len(terms), len(prefixes), Autocomplete.TOP_K, Autocomplete.MAGIC))
+        self.__open_mmap()
+
+    @staticmethod
+    def __write_strings(f, strings: [str]):
+        """Writes the utf-8 bytes of strings, padded so the offsets after them are aligned"""
+        for string in strings:
+            f.write(string.encode("utf-8"))
+        f.write(b"\0" * (-f.tell() % 8))
+
+    @staticmethod
+    def __string_offsets(strings: [str]) -> [int]:
+        offsets = [0]
+        for string in strings:
+            offsets.append(offsets[-1] + len(string.encode("utf-8")))
+        return offsets
+
+    def __open_mmap(self):
+        self.autocomplete_file = MappedFile(self.index_path.joinpath(self.autocomplete_file_name),
+                                            Autocomplete.FOOTER, Autocomplete.MAGIC)
+        term_offsets_offset, term_doc_counts_offset, prefix_bytes_offset, prefix_offsets_offset, \
+            prefix_completions_offset, self.term_count, self.prefix_count, self.top_k = self.autocomplete_file.footer
+        self.term_bytes = self.autocomplete_file.section(0, term_offsets_offset)
+        self.term_offsets = self.autocomplete_file.section(term_offsets_offset, term_doc_counts_offset, "Q")
+        self.term_doc_counts = self.autocomplete_file.section(term_doc_counts_offset, prefix_bytes_offset, "I")
+        self.prefix_bytes = self.autocomplete_file.section(prefix_bytes_offset, prefix_offsets_offset)
+        self.prefix_offsets = self.autocomplete_file.section(prefix_offsets_offset, prefix_completions_offset, "Q")
+        self.prefix_completions = self.autocomplete_file.section(
+            prefix_completions_offset, prefix_completions_offset + self.prefix_count * self.top_k * 4, "I")
+
+    def __close_mmap(self):
+        self.term_bytes = self.term_offsets = self.term_doc_counts = None
+        self.prefix_bytes = self.prefix_offsets = self.prefix_completions = None
+        if self.autocomplete_file is not None:
+            self.autocomplete_file.close()
+            self.autocomplete_file = None
+        self.term_count = 0
+        self.prefix_count = 0
+
+    def get_term(self, term_number: int) -> str:
+        return self.__term_bytes(term_number).decode("utf-8")
+
+    def __term_bytes(self, term_number: int) -> bytes:
+        return bytes(self.term_bytes[self.term_offsets[term_number]:self.term_offsets[term_number + 1]])
+
+    def __prefix_bytes(self, prefix_number: int) -> bytes:
+        return bytes(self.prefix_bytes[self.prefix_offsets[prefix_number]:self.prefix_offsets[prefix_number + 1]])
+
+    def complete(self, query: str, k_results: Optional[int] = None) -> [str]:
+        """
+        Returns up to k_results completions of the query being typed, by doc count. The last word of the query is
+        completed, or the next word if the query ends with a space, following the words typed before it.
+        Completed words are stemmed like the indexed terms
+        """
+        if self.autocomplete_file is None:
+            return []
+        k_results = k_results or Autocomplete.TOP_K
+
+        tokens = re.split(Tokenizer.token_split_pattern, query)
+        typed_words = [Tokenizer.stemmer.stem(re.sub(Tokenizer.token_filter_pattern, "", token).lower())
+                       for token in tokens[:-1]]
+        typed_words = [word for word in typed_words if len(word) > 0]
+        partial_word = re.sub(Tokenizer.token_filter_pattern, "", tokens[-1]).lower()
+        if len(typed_words) == 0 and len(partial_word) == 0:
+            return []
+
+        # only the words that fit in an n-gram term with the partial word are completed, the others are kept
+        context_words = typed_words[:max(0, len(typed_words) - (self.max_n_grams - 1))]
+        n_gram_words = typed_words[len(context_words):]
+
+        term_numbers = self.__complete_prefix(" ".join(n_gram_words + [partial_word]), k_results)
+        if len(term_numbers) == 0 and len(partial_word) > 0:
+            # a whole word can be longer than its stem, as in "learning" for "learn"
+            stemmed_word = Tokenizer.stemmer.stem(partial_word)
+            if stemmed_word != partial_word:
+                term_numbers = self.__complete_prefix(" ".join(n_gram_words + [stemmed_word]), k_results)
+
+        return [" ".join(context_words + [self.get_term(term_number)]) for term_number in term_numbers]
+
+    def __complete_prefix(self, prefix: str, k_results: int) -> [int]:
+        """Term numbers of the k_results terms starting with prefix with the highest doc counts"""
+        prefix_key = prefix.encode("utf-8")
+
+        if k_results <= self.top_k:
+            prefix_number = self.__bisect(self.__prefix_bytes, prefix_key, 0, self.prefix_count)
+            if prefix_number < self.prefix_count and self.__prefix_bytes(prefix_number) == prefix_key:
+                completions = self.prefix_completions[prefix_number * self.top_k:(prefix_number + 1) * self.top_k]
+                return [term_number for term_number in completions if term_number != Autocomplete.NO_TERM][:k_results]
+
+        # 0xff is never in utf-8, so it sorts after every term starting with the prefix
+        start = self.__bisect(self.__term_bytes, prefix_key, 0, self.term_count)
+        end = self.__bisect(self.__term_bytes, prefix_key + b"\xff", start, self.term_count)
+        return heapq.nlargest(k_results, range(start, end), key=lambda x: (self.term_doc_counts[x], -x))
+
+    @staticmethod
+    def __bisect(item_at: Callable[[int], object], item, start: int, end: int) -> int:
+        """Position of the first item from start to end not less than item"""
+        while start < end:
+            middle = (start + end) // 2
+            if item_at(middle) < item:
+                start = middle + 1
+            else:
+                end = middle
+        return start
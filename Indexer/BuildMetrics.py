@@ -0,0 +1,144 @@
+import json
+import resource
+import time
+from typing import Optional
+
+from Indexer.Index import Index
+
+
+class BuildMetrics:
+    """
+    Collects metrics while the tiered indexes are built: parse throughput over time, duplicates found, the spill
+    counts and sizes of each index, the bytes written and time spent per term size by each merge, and the memory
+    high water mark. A record is appended as a JSON line to the metrics file every report interval and at the end
+    of each build phase, with an estimate of the time left in the phase
+    """
+
+    def __init__(self, metrics_file: Optional[str], report_interval_seconds: float = 10.0):
+        self.metrics_file: Optional[str] = metrics_file
+        self.report_interval_seconds: float = report_interval_seconds
+
+        self.build_start_time: float = 0.0
+        self.phase: str = ""
+        self.phase_start_time: float = 0.0
+        self.last_report_time: float = 0.0
+
+        self.total_documents: int = 0  # documents in the local store, to estimate the time left parsing
+        self.documents_scanned: int = 0
+        self.documents_indexed: int = 0
+        self.exact_duplicates: int = 0
+        self.near_duplicates: int = 0
+        self.last_report_documents_scanned: int = 0
+
+        self.merges: {str: {str: object}} = {}
+        self.records: [{str: object}] = []
+
+    def start_build(self, total_documents: int, indexes: [Index]):
+        self.build_start_time = time.perf_counter()
+        self.total_documents = total_documents
+        self.documents_scanned = 0
+        self.documents_indexed = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        self.last_report_documents_scanned = 0
+        self.merges.clear()
+        self.records.clear()
+        if self.metrics_file is not None:
+            open(self.metrics_file, mode="w").close()  # start a new metrics file for this build
+        self.start_phase("parse", indexes)
+
+    def start_phase(self, phase: str, indexes: [Index]):
+        if self.phase != "" and self.phase_start_time > 0:
+            self.report(indexes, event="phase_end")
+        self.phase = phase
+        self.phase_start_time = time.perf_counter()
+        self.last_report_time = self.phase_start_time
+
+    def count_documents(self, indexes: [Index], documents_scanned: int, documents_indexed: int,
+                        exact_duplicates: int, near_duplicates: int):
+        """Updates the parse counts, reporting them if the report interval has passed since the last report"""
+        self.documents_scanned = documents_scanned
+        self.documents_indexed = documents_indexed
+        self.exact_duplicates = exact_duplicates
+        self.near_duplicates = near_duplicates
+        if time.perf_counter() - self.last_report_time >= self.report_interval_seconds:
+            self.report(indexes)
+
+    def merge_progress(self, index: Index, terms_merged: int, total_terms: int):
+        """Progress callback for Index.merge_index"""
+        if time.perf_counter() - self.last_report_time >= self.report_interval_seconds:
+            self.report([index], merge_progress=(terms_merged, total_terms))
+
+    def merge_finished(self, index: Index):
+        """Keeps the merge stats of the index, reported when its merge phase ends"""
+        self.merges[index.descriptor] = index.merge_stats
+
+    def finish_build(self, indexes: [Index]):
+        self.report(indexes, event="phase_end")
+        self.phase = "done"
+        self.phase_start_time = self.build_start_time
+        self.report(indexes, event="build_end")
+
+    def report(self, indexes: [Index], event: str = "progress", merge_progress: Optional[tuple] = None):
+        now = time.perf_counter()
+        phase_elapsed = now - self.phase_start_time
+        record = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "event": event,
+            "phase": self.phase,
+            "elapsed_seconds": round(now - self.build_start_time, 3),
+            "phase_elapsed_seconds": round(phase_elapsed, 3),
+            "memory_high_water_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "documents_scanned": self.documents_scanned,
+            "documents_indexed": self.documents_indexed,
+            "exact_duplicates": self.exact_duplicates,
+            "near_duplicates": self.near_duplicates,
+            "spills": {index.descriptor: {"count": len(index.spill_sizes),
+                                          "bytes": sum(index.spill_sizes),
+                                          "seconds": round(index.spill_seconds, 3)}
+                       for index in indexes},
+        }
+
+        if self.phase == "parse":
+            interval_seconds = now - self.last_report_time
+            record["docs_per_second"] = \
+                round(self.documents_scanned / phase_elapsed, 2) if phase_elapsed > 0 else 0.0
+            record["recent_docs_per_second"] = \
+                round((self.documents_scanned - self.last_report_documents_scanned) / interval_seconds, 2) \
+                if interval_seconds > 0 else 0.0
+            record["eta_seconds"] = self.__eta_seconds(self.documents_scanned, self.total_documents, phase_elapsed)
+            self.last_report_documents_scanned = self.documents_scanned
+
+        if merge_progress is not None:
+            terms_merged, total_terms = merge_progress
+            record["terms_merged"] = terms_merged
+            record["total_terms"] = total_terms
+            record["eta_seconds"] = self.__eta_seconds(terms_merged, total_terms, phase_elapsed)
+
+        if event == "phase_end" and self.phase.startswith("merge_"):
+            record["merge"] = self.merges.get(self.phase[len("merge_"):], {})
+        if event == "build_end":
+            record["merges"] = self.merges
+
+        self.last_report_time = now
+        self.records.append(record)
+        if self.metrics_file is not None:
+            with open(self.metrics_file, mode="a") as f:
+                f.write(f"{json.dumps(record)}\n")
+
+        if event == "progress":
+            progress = f"{record['docs_per_second']} docs/s" if "docs_per_second" in record \
+                else f"{record.get('terms_merged')}/{record.get('total_terms')} terms"
+            eta = f"{record['eta_seconds']}s" if record.get("eta_seconds") is not None else "unknown"
+            print(f"\n[{self.phase}] {record['elapsed_seconds']}s elapsed, {progress}, ETA {eta}, "
+                  f"memory high water {record['memory_high_water_kb']}KB")
+
+    @staticmethod
+    def __eta_seconds(done: int, total: int, elapsed_seconds: float) -> Optional[float]:
+        if done <= 0 or total <= done:
+            return None if done <= 0 else 0.0
+        return round(elapsed_seconds / done * (total - done), 1)
+
+    def summary(self) -> {str: object}:
+        """The last record of the build, holding the totals"""
+        return self.records[-1] if len(self.records) > 0 else {}
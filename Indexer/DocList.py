@@ -1,5 +1,6 @@
 # from sortedcontainers.sortedlist import SortedList
 import math
+from typing import Optional
 
 
 class PostingsList:
@@ -9,6 +10,7 @@ class PostingsList:
     # TODO method to sort postings by Page Rank/Hit Rank on request given dict of doc_id rankings
 
     delim = ','
+    block_delim = ';'
 
     def __init__(self, store_positions: bool, dump_data: str = None, raw_posting_data_list: [str] = None):
 
@@ -31,15 +33,25 @@ class PostingsList:
 
         self.postings_dict = {posting.doc_id: posting for posting in self.postings_list}
 
-    def compute_local_tf_idf(self, total_docs: int, copy_to_global: bool = False):
-        """Computes tf_idf for postings in THIS tiered index (local)"""
+    def compute_local_tf_idf(self, total_docs: int, copy_to_global: bool = False,
+                             document_frequency: Optional[int] = None):
+        """
+        Computes tf_idf for postings in THIS tiered index (local),
+        with document_frequency docs holding the term if given instead of the docs in this postings list
+        """
+        document_frequency = document_frequency or len(self.postings_dict)
         for posting in self.postings_list:
             posting.local_tf_idf_score = (1 + math.log10(posting.doc_term_frequency)) * math.log10(
-                total_docs / len(self.postings_dict))
+                total_docs / document_frequency)
             if copy_to_global:
                 posting.global_tf_idf_score = posting.local_tf_idf_score
 
-    def add_global_tf_idf(self, global_postings_list: 'PostingsList'):
+    def add_global_tf_idf(self, global_postings_list: Optional['PostingsList']):
+
+        if global_postings_list is None:  # the term is not in the complete index, like the n-grams it leaves out
+            for local_posting in self.postings_list:
+                local_posting.global_tf_idf_score = local_posting.local_tf_idf_score
+            return
 
         for local_posting in self.postings_list:
             # if global_postings_list is None or local_posting.doc_id not in global_postings_list.postings_dict:
@@ -57,6 +69,31 @@ class PostingsList:
                                           pos_list=pos_list if self.store_positions else None
                                           ))
 
+    @staticmethod
+    def match_phrase(word_postings_lists: ['PostingsList']) -> 'PostingsList':
+        """
+        Postings of the docs holding the words of the posting lists one right after the other, in the order of the
+        lists, with the position of the first word of each match. The posting lists must store positions
+        """
+        phrase_postings_list = PostingsList(store_positions=True)
+        for posting in min(word_postings_lists, key=len).postings_list:
+            word_postings = [word_postings_list.postings_dict.get(posting.doc_id)
+                             for word_postings_list in word_postings_lists]
+            if any(word_posting is None for word_posting in word_postings):
+                continue
+            next_word_positions = [set(word_posting.term_pos_list) for word_posting in word_postings[1:]]
+            phrase_positions = [pos for pos in word_postings[0].term_pos_list
+                                if all(pos + i in word_positions for i, word_positions in
+                                       enumerate(next_word_positions, start=1))]
+            if len(phrase_positions) > 0:
+                phrase_postings_list.create_posting(posting.doc_id, phrase_positions)
+                phrase_postings_list.postings_list[-1].page_rank = posting.page_rank
+
+        phrase_postings_list.postings_dict = {posting.doc_id: posting for posting in phrase_postings_list.postings_list}
+        phrase_postings_list.term_frequency = sum(posting.doc_term_frequency
+                                                  for posting in phrase_postings_list.postings_list)
+        return phrase_postings_list
+
     def get_doc_ids(self) -> [int]:
         return list(self.postings_dict.keys())
 
@@ -65,10 +102,86 @@ class PostingsList:
         dumped_postings_data = PostingsList.delim.join(posting.dump() for posting in self.postings_list)
         return f"{self.term_frequency}{PostingsList.delim}{dumped_postings_data}"
 
+    def dump_blocks(self, block_size: int, sort_weights: {str: float}) -> str:
+        """
+        Dumps the postings in their current order as blocks of block_size postings, one block per line, preceded
+        by a header line holding the term frequency and each block's max impact score, byte length and size,
+        so readers can stream only the leading blocks and know the best score left in the blocks not yet read
+        """
+        blocks_data = [PostingsList.delim.join(posting.dump() for posting in self.postings_list[i:i + block_size])
+                       for i in range(0, len(self.postings_list), block_size)]
+        block_headers = [
+            PostingsBlockHeader(
+                max_score=max(posting.impact_score(sort_weights) for posting in self.postings_list[i:i + block_size]),
+                byte_length=len(block_data) + 1,
+                postings_count=len(self.postings_list[i:i + block_size])
+            )
+            for i, block_data in zip(range(0, len(self.postings_list), block_size), blocks_data)
+        ]
+        dumped_headers = PostingsList.block_delim.join(block_header.dump() for block_header in block_headers)
+        dumped_blocks = "".join(f"{block_data}\n" for block_data in blocks_data)
+        return f"{self.term_frequency}{PostingsList.block_delim}{dumped_headers}\n{dumped_blocks}"
+
+    def dump_doc_id_blocks(self, block_size: int, sort_weights: {str: float}) -> str:
+        """
+        Dumps the postings in doc id order as blocks of block_size (doc id gap, impact score) entries, one block
+        per line, preceded by a header line of skip pointers holding each block's first doc id, byte length and
+        size, so intersections can jump straight to the block that may hold a doc id
+        """
+        doc_id_postings = sorted(self.postings_list, key=lambda x: x.doc_id)
+        blocks = [doc_id_postings[i:i + block_size] for i in range(0, len(doc_id_postings), block_size)]
+
+        blocks_data = []
+        for block in blocks:
+            previous_doc_id = block[0].doc_id
+            block_entries = []
+            for posting in block:
+                block_entries.append(f"{posting.doc_id - previous_doc_id}{Posting.delim}"
+                                     f"{round(posting.impact_score(sort_weights), 3)}")
+                previous_doc_id = posting.doc_id
+            blocks_data.append(PostingsList.delim.join(block_entries))
+
+        block_headers = [DocIdBlockHeader(first_doc_id=block[0].doc_id,
+                                          byte_length=len(block_data) + 1,
+                                          postings_count=len(block))
+                         for block, block_data in zip(blocks, blocks_data)]
+        dumped_headers = PostingsList.block_delim.join(block_header.dump() for block_header in block_headers)
+        dumped_blocks = "".join(f"{block_data}\n" for block_data in blocks_data)
+        return f"{len(doc_id_postings)}{PostingsList.block_delim}{dumped_headers}\n{dumped_blocks}"
+
+    @staticmethod
+    def parse_doc_id_block_headers(header_data: str) -> (int, ['DocIdBlockHeader']):
+        """Parses the document count and skip pointers from a header line written by dump_doc_id_blocks"""
+        data = header_data.split(PostingsList.block_delim)
+        return int(data[0]), [DocIdBlockHeader(header_data=block_header_data)
+                              for block_header_data in data[1:] if len(block_header_data) > 0]
+
+    @staticmethod
+    def parse_block_headers(header_data: str) -> (int, ['PostingsBlockHeader']):
+        """Parses the term frequency and block headers from a header line written by dump_blocks"""
+        data = header_data.split(PostingsList.block_delim)
+        return int(data[0]), [PostingsBlockHeader(header_data=block_header_data)
+                              for block_header_data in data[1:] if len(block_header_data) > 0]
+
     def dump_raw_postings(self):
         """Dumps only the raw postings to a string for storage in a partial index file, allowing later merging"""
         return PostingsList.delim.join(posting.dump() for posting in self.postings_list)
 
+    def remap_doc_ids(self, doc_id_map: [int]):
+        """Renumbers the doc ids of the postings, doc_id_map holding the new doc id at each old doc id"""
+        for posting in self.postings_list:
+            posting.doc_id = doc_id_map[posting.doc_id]
+        self.postings_dict = {posting.doc_id: posting for posting in self.postings_list}
+
+    def doc_id_gap_bits(self) -> int:
+        """Number of bits needed to store the doc ids as gamma coded gaps, smaller when doc ids are clustered"""
+        gap_bits = 0
+        previous_doc_id = -1
+        for doc_id in sorted(self.postings_dict):
+            gap_bits += 2 * (doc_id - previous_doc_id).bit_length() - 1
+            previous_doc_id = doc_id
+        return gap_bits
+
     def set_page_rankings(self, doc_page_rankings: [int]):
         for posting in self.postings_list:
             posting.page_rank = doc_page_rankings[posting.doc_id]
@@ -95,6 +208,57 @@ class PostingsList:
         return len(self.postings_dict)
 
 
+class PostingsBlockHeader:
+    delim = ':'
+
+    def __init__(self,
+                 max_score: float = 0.0,
+                 byte_length: int = 0,
+                 postings_count: int = 0,
+                 header_data: str = None):
+
+        self.max_score: float = max_score  # upper bound of the impact score of any posting in the block
+        self.byte_length: int = byte_length  # length of the block line in the index file, including the newline
+        self.postings_count: int = postings_count
+
+        if header_data is not None:
+            data = header_data.split(PostingsBlockHeader.delim)
+            self.max_score = float(data[0])
+            self.byte_length = int(data[1])
+            self.postings_count = int(data[2])
+
+    def dump(self) -> str:
+        # round the max score up so it stays an upper bound of the rounded scores stored in the postings
+        return f"{math.ceil(self.max_score * 1000) / 1000}{PostingsBlockHeader.delim}" \
+               f"{self.byte_length}{PostingsBlockHeader.delim}" \
+               f"{self.postings_count}"
+
+
+class DocIdBlockHeader:
+    delim = ':'
+
+    def __init__(self,
+                 first_doc_id: int = 0,
+                 byte_length: int = 0,
+                 postings_count: int = 0,
+                 header_data: str = None):
+
+        self.first_doc_id: int = first_doc_id  # skip pointer key, doc ids in the block are gaps from this doc id
+        self.byte_length: int = byte_length  # length of the block line in the doc id file, including the newline
+        self.postings_count: int = postings_count
+
+        if header_data is not None:
+            data = header_data.split(DocIdBlockHeader.delim)
+            self.first_doc_id = int(data[0])
+            self.byte_length = int(data[1])
+            self.postings_count = int(data[2])
+
+    def dump(self) -> str:
+        return f"{self.first_doc_id}{DocIdBlockHeader.delim}" \
+               f"{self.byte_length}{DocIdBlockHeader.delim}" \
+               f"{self.postings_count}"
+
+
 class Posting:
     delim = ':'
 
@@ -122,6 +286,12 @@ class Posting:
             if len(data) > 5:
                 self.term_pos_list = [int(pos) for pos in data[5:]]
 
+    def impact_score(self, sort_weights: {str: float}) -> float:
+        """Weighted score of the posting as used when scoring a query term, from the values as stored on disk"""
+        return sort_weights["page_rank"] * round(self.page_rank, 3) + \
+            sort_weights["global_tf_idf"] * round(self.global_tf_idf_score, 3) + \
+            sort_weights["local_tf_idf"] * round(self.local_tf_idf_score, 3)
+
     def dump(self) -> str:
         dump_str = \
             f"{self.doc_id}{Posting.delim}" \
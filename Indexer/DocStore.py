@@ -0,0 +1,199 @@
+import argparse
+import json
+import mmap
+import struct
+import sys
+import zlib
+from pathlib import Path
+from typing import Optional, Iterator, Tuple
+
+
+class DocStore:
+    """
+    Packs the crawled pages of the local store into a single append only file so a build reads one file
+    sequentially instead of opening and decoding thousands of small json files.
+
+    File layout:
+        magic | record | record | ... | offset table | footer
+    record:       payload length (uint32), flags (uint8), payload
+    payload:      url, newline, encoding, newline, content, utf-8 encoded and zlib compressed if flags has COMPRESSED
+    offset table: file offset of each record (uint64)
+    footer:       offset table offset (uint64), record count (uint64), magic
+    """
+
+    file_name = "local_store.docstore"  # name of the doc store in the local store directory
+    MAGIC = b"SANDYDS1"
+    RECORD_HEADER = struct.Struct("<IB")
+    OFFSET = struct.Struct("<Q")
+    FOOTER = struct.Struct("<QQ8s")
+    COMPRESSED = 1
+    payload_delim = b"\n"
+
+
+class DocStoreWriter:
+    """
+    Appends pages to a doc store file, creating it if it does not exist. The offset table and footer are
+    rewritten after the last record when the writer is closed, a writer that is not closed leaves the store unreadable
+    """
+
+    def __enter__(self):
+        return self
+
+    def __init__(self, doc_store_file: str, compress: bool = False):
+        self.doc_store_path: Path = Path(doc_store_file)
+        self.compress: bool = compress
+        self.record_offsets: [int] = []
+
+        if self.doc_store_path.is_file():
+            with DocStoreReader(doc_store_file) as doc_store_reader:
+                self.record_offsets = [doc_store_reader.record_offset(record_number)
+                                       for record_number in range(len(doc_store_reader))]
+                table_offset = doc_store_reader.table_offset
+            self.doc_store_file_open_object = open(self.doc_store_path, mode="r+b")
+            self.doc_store_file_open_object.seek(table_offset)
+            self.doc_store_file_open_object.truncate()  # the offset table is written again on close
+        else:
+            self.doc_store_file_open_object = open(self.doc_store_path, mode="wb")
+            self.doc_store_file_open_object.write(DocStore.MAGIC)
+
+    def add_page(self, url: str, content: str, encoding: str) -> int:
+        """Appends the page to the store and returns its record number"""
+        payload = DocStore.payload_delim.join([url.encode("utf-8"),
+                                               encoding.encode("utf-8"),
+                                               content.encode("utf-8", errors="surrogatepass")])
+        flags = 0
+        if self.compress:
+            payload = zlib.compress(payload)
+            flags |= DocStore.COMPRESSED
+
+        self.record_offsets.append(self.doc_store_file_open_object.tell())
+        self.doc_store_file_open_object.write(DocStore.RECORD_HEADER.pack(len(payload), flags))
+        self.doc_store_file_open_object.write(payload)
+        return len(self.record_offsets) - 1
+
+    def __len__(self):
+        return len(self.record_offsets)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        table_offset = self.doc_store_file_open_object.tell()
+        for record_offset in self.record_offsets:
+            self.doc_store_file_open_object.write(DocStore.OFFSET.pack(record_offset))
+        self.doc_store_file_open_object.write(DocStore.FOOTER.pack(table_offset, len(self.record_offsets),
+                                                                   DocStore.MAGIC))
+        self.doc_store_file_open_object.close()
+
+
+class DocStoreReader:
+    """
+    Reads a doc store file through mmap, sequentially by iterating it or by record number.
+    Pages are returned as url, content, encoding like the values of a local store json file
+    """
+
+    def __enter__(self):
+        return self
+
+    def __init__(self, doc_store_file: str):
+        self.doc_store_path: Path = Path(doc_store_file)
+        assert self.doc_store_path.is_file(), f"Doc store file {doc_store_file} does not exist"
+
+        self.doc_store_file_open_object = open(self.doc_store_path, mode="rb")
+        self.doc_store_mmap = mmap.mmap(self.doc_store_file_open_object.fileno(), 0, access=mmap.ACCESS_READ)
+
+        assert len(self.doc_store_mmap) >= len(DocStore.MAGIC) + DocStore.FOOTER.size and \
+            self.doc_store_mmap[:len(DocStore.MAGIC)] == DocStore.MAGIC, \
+            f"Doc store file {doc_store_file} is not a doc store"
+        self.table_offset, self.record_count, footer_magic = \
+            DocStore.FOOTER.unpack_from(self.doc_store_mmap, len(self.doc_store_mmap) - DocStore.FOOTER.size)
+        assert footer_magic == DocStore.MAGIC, f"Doc store file {doc_store_file} was not closed after writing"
+
+    def __len__(self):
+        return self.record_count
+
+    def record_offset(self, record_number: int) -> int:
+        if not 0 <= record_number < self.record_count:
+            raise IndexError(f"Record {record_number} not in doc store of {self.record_count} records")
+        return DocStore.OFFSET.unpack_from(self.doc_store_mmap,
+                                           self.table_offset + record_number * DocStore.OFFSET.size)[0]
+
+    def __read_record(self, record_offset: int) -> Tuple[Tuple[str, str, str], int]:
+        """Returns the page stored at record_offset and the offset of the next record"""
+        payload_length, flags = DocStore.RECORD_HEADER.unpack_from(self.doc_store_mmap, record_offset)
+        payload_start = record_offset + DocStore.RECORD_HEADER.size
+        payload = self.doc_store_mmap[payload_start:payload_start + payload_length]
+        if flags & DocStore.COMPRESSED:
+            payload = zlib.decompress(payload)
+        url, encoding, content = payload.split(DocStore.payload_delim, 2)
+        return (url.decode("utf-8"), content.decode("utf-8", errors="surrogatepass"), encoding.decode("utf-8")), \
+            payload_start + payload_length
+
+    def get_page(self, record_number: int) -> Tuple[str, str, str]:
+        return self.__read_record(self.record_offset(record_number))[0]
+
+    def __iter__(self) -> Iterator[Tuple[str, str, str]]:
+        return self.iter_pages()
+
+    def iter_pages(self, start_record: int = 0) -> Iterator[Tuple[str, str, str]]:
+        """Yields the pages from record number start_record to the last"""
+        if start_record >= self.record_count:
+            return
+        # records are contiguous, so walk them from the start record without the offset table
+        record_offset = self.record_offset(start_record)
+        while record_offset < self.table_offset:
+            page, record_offset = self.__read_record(record_offset)
+            yield page
+
+    def close(self):
+        self.doc_store_mmap.close()
+        self.doc_store_file_open_object.close()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def pack_local_store(local_store_dir: str, doc_store_file: Optional[str] = None,
+                     compress: bool = False, append: bool = False) -> int:
+    """
+    Packs all the json files in local_store_dir into a doc store, in the order a build reads them, and returns
+    the number of pages packed. An existing doc store is replaced unless append is set
+    """
+    local_store_path = Path(local_store_dir)
+    assert local_store_path.is_dir(), f"Local store path {local_store_dir} not a directory"
+    if doc_store_file is None:
+        doc_store_file = str(local_store_path.joinpath(DocStore.file_name))
+    if not append:
+        Path(doc_store_file).unlink(missing_ok=True)
+
+    pages_packed = 0
+    with DocStoreWriter(doc_store_file, compress) as doc_store_writer:
+        for page_file in local_store_path.rglob("*.json"):
+            with open(page_file, "r") as page_json:
+                data = json.load(page_json)
+            if type(data) is not dict or len(data) != 3:  # fields must be url, content and encoding
+                print(f"Error packing file {page_file}, json file must have url, content and encoding")
+                continue
+            raw_url, content, encoding = data.values()
+            doc_store_writer.add_page(raw_url, content or "", encoding or "")
+            pages_packed += 1
+            if pages_packed % 1000 == 0:
+                print(f"\rPacked {pages_packed} pages", end="")
+    print()
+    return pages_packed
+
+
+def main(arguments: [str]):
+    parser = argparse.ArgumentParser(description="Packs the json files of the local store into a doc store file")
+    parser.add_argument("--local-store", default="./Indexer/Local_Store",
+                        help="directory of the json files to pack")
+    parser.add_argument("--output", default=None,
+                        help=f"doc store file to write, {DocStore.file_name} in the local store by default")
+    parser.add_argument("--compress", action="store_true",
+                        help="zlib compress the pages, about half the size but several times slower to scan")
+    parser.add_argument("--append", action="store_true", help="append to an existing doc store instead of replacing")
+    args = parser.parse_args(arguments)
+
+    pages_packed = pack_local_store(args.local_store, args.output, compress=args.compress, append=args.append)
+    print(f"Packed {pages_packed} pages from {args.local_store}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,124 @@
+import struct
+from array import array
+from pathlib import Path
+from typing import Optional
+
+from Indexer.Index import Index, MappedFile, publish_file, stable_hash
+
+
+class DocTable:
+    """
+    The url of every doc id and the doc id of every url, read through mmap so looking them up loads nothing at start
+    up. Urls are found by doc id through an offset table into the url bytes, and doc ids by url through an open
+    addressing hash table of doc ids, probed linearly from the blake2b hash of the url.
+    Doc ids without a url, like the docs of the other shards in the table of a shard, have an empty url.
+
+    File layout:
+        url bytes | url offsets | hash slots | footer
+    url bytes:   utf-8 urls in doc id order, padded to 8 bytes
+    url offsets: start of each doc id's url in the url bytes and the end of the last (uint64)
+    hash slots:  doc id in each slot of the hash table, a power of two at most half full, EMPTY_SLOT if empty (uint32)
+    footer:      offsets of the url offsets and hash slots (uint64), doc count (uint64), slot count (uint64), magic
+    """
+
+    EMPTY_SLOT = 0xFFFFFFFF
+    MAGIC = b"SANDYDT1"
+    FOOTER = struct.Struct("<QQQQ8s")
+
+    def __enter__(self):
+        return self
+
+    def __init__(self, index_directory: Optional[str] = None):
+        self.index_path: Path = Path(index_directory or Index.index_directory)
+        assert self.index_path.is_dir(), f"Data path {self.index_path} not a directory"
+        self.doc_table_file_name: str = "doc_table.index"
+
+        self.doc_table_file: Optional[MappedFile] = None
+        self.url_bytes: Optional[memoryview] = None
+        self.url_offsets: Optional[memoryview] = None
+        self.hash_slots: Optional[memoryview] = None
+        self.doc_count: int = 0
+        self.slot_count: int = 0
+
+        if Path(self.index_path.joinpath(self.doc_table_file_name)).is_file():
+            self.__open_mmap()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__close_mmap()
+
+    def __len__(self):
+        return self.doc_count
+
+    def build(self, doc_id_to_url_LUT: {int: str}, doc_count: int):
+        """Writes the table of doc ids 0 to doc_count with the urls of doc_id_to_url_LUT and opens it"""
+        self.__close_mmap()
+
+        slot_count = 1
+        while slot_count < 2 * len(doc_id_to_url_LUT):
+            slot_count *= 2
+        hash_slots = array("I", [DocTable.EMPTY_SLOT]) * slot_count
+        url_offsets = array("Q", [0])
+
+        with publish_file(self.index_path.joinpath(self.doc_table_file_name), mode="wb") as f:
+            for doc_id in range(doc_count):
+                url = doc_id_to_url_LUT.get(doc_id)
+                if url is not None:
+                    url_key = self.__url_key(url)
+                    f.write(url_key)
+                    slot = self.__url_hash(url_key) & (slot_count - 1)
+                    while hash_slots[slot] != DocTable.EMPTY_SLOT:
+                        slot = (slot + 1) & (slot_count - 1)
+                    hash_slots[slot] = doc_id
+                url_offsets.append(f.tell())
+            f.write(b"\0" * (-f.tell() % 8))
+            url_offsets_offset = f.tell()
+            url_offsets.tofile(f)
+            hash_slots_offset = f.tell()
+            hash_slots.tofile(f)
+            f.write(DocTable.FOOTER.pack(url_offsets_offset, hash_slots_offset, doc_count, slot_count,
+                                         DocTable.MAGIC))
+        self.__open_mmap()
+
+    @staticmethod
+    def __url_key(url: str) -> bytes:
+        return url.encode("utf-8", errors="surrogatepass")
+
+    @staticmethod
+    def __url_hash(url_key: bytes) -> int:
+        return stable_hash(url_key)  # the slots are written by the build and probed by the searchers
+
+    def __open_mmap(self):
+        self.doc_table_file = MappedFile(self.index_path.joinpath(self.doc_table_file_name),
+                                         DocTable.FOOTER, DocTable.MAGIC)
+        url_offsets_offset, hash_slots_offset, self.doc_count, self.slot_count = self.doc_table_file.footer
+        self.url_bytes = self.doc_table_file.section(0, url_offsets_offset)
+        self.url_offsets = self.doc_table_file.section(url_offsets_offset, hash_slots_offset, "Q")
+        self.hash_slots = self.doc_table_file.section(hash_slots_offset, hash_slots_offset + self.slot_count * 4, "I")
+
+    def __close_mmap(self):
+        self.url_bytes = self.url_offsets = self.hash_slots = None
+        if self.doc_table_file is not None:
+            self.doc_table_file.close()
+            self.doc_table_file = None
+        self.doc_count = 0
+        self.slot_count = 0
+
+    def get_url(self, doc_id: int) -> Optional[str]:
+        """Url of the doc, None if the doc id is not in the table"""
+        if not 0 <= doc_id < self.doc_count or self.url_offsets[doc_id] == self.url_offsets[doc_id + 1]:
+            return None
+        return bytes(self.url_bytes[self.url_offsets[doc_id]:self.url_offsets[doc_id + 1]]) \
+            .decode("utf-8", errors="surrogatepass")
+
+    def get_doc_id(self, url: str) -> Optional[int]:
+        """Doc id of the url, None if the url is not in the table"""
+        if self.slot_count == 0:
+            return None
+        url_key = self.__url_key(url)
+        slot = self.__url_hash(url_key) & (self.slot_count - 1)
+        while self.hash_slots[slot] != DocTable.EMPTY_SLOT:
+            doc_id = self.hash_slots[slot]
+            if self.url_bytes[self.url_offsets[doc_id]:self.url_offsets[doc_id + 1]] == url_key:
+                return doc_id
+            slot = (slot + 1) & (self.slot_count - 1)
+        return None
@@ -0,0 +1,115 @@
+import math
+from array import array
+from typing import Optional
+
+from Indexer.DocList import PostingsList, Posting
+from Indexer.ForwardIndex import ForwardIndex
+from Indexer.Index import Index
+
+
+class FieldedIndex(Index):
+    """
+    An index with one posting per term and doc for all the fields of the doc, so a query term is scored across the
+    title, anchor, header, bold and text fields from a single posting list instead of one per tier.
+    Each posting stores the term's frequency in each field in place of the positions, in the order of FIELDS,
+    and a BM25F score of the fields in place of the tf-idf scores, so the block max search reads it like any index.
+    Field frequencies are weighted by FIELD_WEIGHTS, the weights of the tiers, and the title and text frequencies
+    are normalized by the title and text lengths of the forward index
+    """
+
+    FIELDS = ("title", "anchor", "header", "bold", "text")
+    FIELD_WEIGHTS = {"title": 8.0, "anchor": 7.0, "header": 5.0, "bold": 4.0, "text": 1.0}
+    # length normalization of each field, the header and bold lengths are not kept and anchor text is not a page
+    FIELD_LENGTH_NORMALIZATION = {"title": 0.75, "anchor": 0.0, "header": 0.0, "bold": 0.0, "text": 0.75}
+    K1 = 1.2  # term frequency saturation
+
+    def __init__(self,
+                 max_n_gram: int,
+                 sort_weights: {str: float},
+                 index_directory: Optional[str] = None,
+                 partial_index_directory: Optional[str] = None,
+                 settings_directory: Optional[str] = None,
+                 ):
+        super().__init__(descriptor="fielded_index",
+                         max_n_gram=max_n_gram,
+                         sort_weights=sort_weights,
+                         postings_list_size_limit=None,
+                         store_positions=True,  # the field frequencies are stored as the positions
+                         index_directory=index_directory,
+                         partial_index_directory=partial_index_directory,
+                         settings_directory=settings_directory,
+                         )
+
+        # title and text lengths of each doc, and their averages, set from the forward index before merging
+        self.title_lengths: array = array("I")
+        self.text_lengths: array = array("I")
+        self.average_title_length: float = 1.0
+        self.average_text_length: float = 1.0
+
+    def add_document_fields(self, doc_id: int, field_term_counts: {str: {str: int}}) -> bool:
+        """
+        Adds a posting for each term of the doc with its frequency in each of the fields given. The postings of a
+        term added for the same doc more than once, like for the anchor text of the doc found later, are added up
+        when merging
+        """
+        term_field_frequencies: {str: [int]} = {}
+        for field, term_counts in field_term_counts.items():
+            field_number = FieldedIndex.FIELDS.index(field)
+            for term, count in term_counts.items():
+                term_field_frequencies.setdefault(term, [0] * len(FieldedIndex.FIELDS))
+                term_field_frequencies[term][field_number] += count
+
+        dumped = False
+        for term, field_frequencies in term_field_frequencies.items():
+            dumped = self.add_term(term, doc_id, field_frequencies) or dumped
+        return dumped
+
+    def set_doc_lengths(self, forward_index: ForwardIndex, doc_count: int):
+        """Reads the title and text length of every doc from the forward index, after its doc ids are final"""
+        self.title_lengths = array("I", [0]) * doc_count
+        self.text_lengths = array("I", [0]) * doc_count
+        for doc_id in range(min(doc_count, len(forward_index))):
+            title_count, body_count = forward_index.get_word_counts(doc_id)
+            self.title_lengths[doc_id] = title_count
+            self.text_lengths[doc_id] = title_count + body_count  # the text field holds the title words too
+        self.average_title_length = max(1.0, sum(self.title_lengths) / max(1, doc_count))
+        self.average_text_length = max(1.0, sum(self.text_lengths) / max(1, doc_count))
+
+    def _score_postings(self,
+                        term: str,
+                        merged_postings_list: PostingsList,
+                        doc_count: int,
+                        complete_index: Optional[Index],
+                        document_frequency: Optional[int]):
+        """Adds up the field frequencies of the term's postings of each doc and scores them with BM25F"""
+        doc_postings: {int: Posting} = {}
+        for posting in merged_postings_list.postings_list:
+            if posting.doc_id in doc_postings:
+                doc_posting = doc_postings[posting.doc_id]
+                doc_posting.term_pos_list = [frequency + other_frequency for frequency, other_frequency
+                                             in zip(doc_posting.term_pos_list, posting.term_pos_list)]
+            else:
+                doc_postings[posting.doc_id] = posting
+            doc_postings[posting.doc_id].doc_term_frequency = sum(doc_postings[posting.doc_id].term_pos_list)
+        merged_postings_list.postings_list = list(doc_postings.values())
+        merged_postings_list.postings_dict = doc_postings
+        merged_postings_list.term_frequency = sum(posting.doc_term_frequency for posting in doc_postings.values())
+
+        document_frequency = document_frequency or len(doc_postings)
+        idf = math.log(1 + (doc_count - document_frequency + 0.5) / (document_frequency + 0.5))
+        for posting in merged_postings_list.postings_list:
+            field_lengths = {"title": self.__length_ratio(self.title_lengths, posting.doc_id,
+                                                          self.average_title_length),
+                             "text": self.__length_ratio(self.text_lengths, posting.doc_id,
+                                                         self.average_text_length)}
+            weighted_frequency = 0.0
+            for field, frequency in zip(FieldedIndex.FIELDS, posting.term_pos_list):
+                length_normalization = FieldedIndex.FIELD_LENGTH_NORMALIZATION[field]
+                weighted_frequency += FieldedIndex.FIELD_WEIGHTS[field] * frequency / \
+                    (1 - length_normalization + length_normalization * field_lengths.get(field, 1.0))
+            posting.local_tf_idf_score = idf * weighted_frequency / (FieldedIndex.K1 + weighted_frequency)
+            posting.global_tf_idf_score = posting.local_tf_idf_score
+
+    @staticmethod
+    def __length_ratio(lengths: array, doc_id: int, average_length: float) -> float:
+        return lengths[doc_id] / average_length if doc_id < len(lengths) else 1.0
@@ -0,0 +1,337 @@
+import json
+import os
+import struct
+from array import array
+from pathlib import Path
+from typing import Optional, List, Tuple
+
+import Tokenizer
+from Indexer.Index import Index, MappedFile
+
+
+class ForwardIndex:
+    """
+    Stores the token stream of every document so query biased snippets can be made without reading the html again.
+    Each distinct word, as it appears in the page, gets a word id and documents are stored as arrays of word ids,
+    two bytes per token when all the word ids of the document fit, otherwise four. The words and the word ids of
+    each stemmed term are read through mmap like the records, the stems found by binary search
+
+    File layout:
+        record | record | ... | offset table | word bytes | word offsets | stem bytes | stem offsets |
+        stem word starts | stem word ids | footer
+    record:           word id size (uint8), title token count (uint32), body token count (uint32), title ids, body ids
+    offset table:     file offset of each doc id's record (uint64)
+    word bytes:       utf-8 word of each word id, padded to 8 bytes
+    word offsets:     start of each word in the word bytes and the end of the last (uint64)
+    stem bytes:       utf-8 stemmed terms of the words in sorted order, padded to 8 bytes
+    stem offsets:     start of each stem in the stem bytes and the end of the last (uint64)
+    stem word starts: start of each stem's word ids in the stem word ids and the end of the last (uint64)
+    stem word ids:    word ids of the words of each stem (uint32)
+    footer:           offsets of the offset table and the sections after it (uint64), doc count (uint64),
+                      word count (uint64), stem count (uint64), magic
+    """
+
+    MAX_DOCUMENT_TOKENS = 10000  # body tokens stored per document, snippets come from the start of longer pages
+    SNIPPET_WINDOW = 30  # number of tokens in a snippet
+    MAGIC = b"SANDYFI2"
+    RECORD_HEADER = struct.Struct("<BII")
+    OFFSET = struct.Struct("<Q")
+    FOOTER = struct.Struct("<QQQQQQQQQQ8s")
+
+    def __enter__(self):
+        return self
+
+    def __init__(self, index_directory: Optional[str] = None):
+        # the words are only kept in memory while building
+        self.word_ids: {str: int} = {}  # word id of each word
+        self.words: [str] = []  # word at each word id
+        self.word_stems: [str] = []  # stemmed term of the word at each word id
+
+        self.record_offsets: [int] = []
+        self.forward_index_file_open_object = None  # only open while building
+        self.words_file_open_object = None  # json line of each new word and its stem, only open while building
+        self.forward_index_file: Optional[MappedFile] = None
+        self.word_bytes: Optional[memoryview] = None
+        self.word_offsets: Optional[memoryview] = None
+        self.stem_bytes: Optional[memoryview] = None
+        self.stem_offsets: Optional[memoryview] = None
+        self.stem_word_starts: Optional[memoryview] = None
+        self.stem_word_ids: Optional[memoryview] = None
+        self.table_offset: int = 0
+        self.doc_count: int = 0
+        self.word_count: int = 0
+        self.stem_count: int = 0
+
+        self.index_path: Path = Path(index_directory or Index.index_directory)
+        assert self.index_path.is_dir(), f"Data path {self.index_path} not a directory"
+
+        self.forward_index_file_name: str = "forward.index"
+        if Path(self.index_path.joinpath(self.forward_index_file_name)).is_file():
+            self.__open_mmap()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__close_mmap()
+        self.__close_build_files()
+
+    def __len__(self):
+        return self.doc_count
+
+    def prep_for_build(self):
+        self.__close_mmap()
+        self.__close_build_files()
+        self.word_ids.clear()
+        self.words.clear()
+        self.word_stems.clear()
+        self.record_offsets.clear()
+        # built in temp files, the records are published over the forward index by finish_build
+        self.forward_index_file_open_object = open(self.index_path.joinpath(f"{self.forward_index_file_name}.tmp"),
+                                                   mode="wb")
+        self.words_file_open_object = open(self.index_path.joinpath(f"{self.forward_index_file_name}.words.tmp"),
+                                           mode="wb")
+
+    def __close_build_files(self):
+        for build_file in (self.forward_index_file_open_object, self.words_file_open_object):
+            if build_file is not None:
+                build_file.close()
+        self.forward_index_file_open_object = None
+        self.words_file_open_object = None
+
+    def checkpoint(self) -> {str: object}:
+        """Flushes the records and words added so far and returns their sizes for restore_checkpoint"""
+        self.forward_index_file_open_object.flush()
+        self.words_file_open_object.flush()
+        return {
+            "file_size": self.forward_index_file_open_object.tell(),
+            "words_size": self.words_file_open_object.tell(),
+        }
+
+    def restore_checkpoint(self, checkpoint: {str: object}, doc_count: int):
+        """
+        Continues a build from a checkpoint with the records of its first doc_count docs, dropping the ones after
+        them. The words of the dropped docs are kept, the same docs get the same word ids when added again
+        """
+        self.__close_mmap()
+        self.__close_build_files()
+        self.word_ids.clear()
+        self.words.clear()
+        self.word_stems.clear()
+        self.record_offsets.clear()
+        self.words_file_open_object = open(self.index_path.joinpath(f"{self.forward_index_file_name}.words.tmp"),
+                                           mode="r+b")
+        self.words_file_open_object.truncate(checkpoint["words_size"])
+        for line in self.words_file_open_object:
+            word, stem = json.loads(line)
+            self.word_ids[word] = len(self.words)
+            self.words.append(word)
+            self.word_stems.append(stem)
+
+        self.forward_index_file_open_object = open(self.index_path.joinpath(f"{self.forward_index_file_name}.tmp"),
+                                                   mode="r+b")
+        record_offset = 0
+        for _ in range(doc_count):
+            self.record_offsets.append(record_offset)
+            self.forward_index_file_open_object.seek(record_offset)
+            item_size, title_count, body_count = ForwardIndex.RECORD_HEADER.unpack(
+                self.forward_index_file_open_object.read(ForwardIndex.RECORD_HEADER.size))
+            record_offset += ForwardIndex.RECORD_HEADER.size + (title_count + body_count) * item_size
+        assert record_offset <= checkpoint["file_size"], f"Forward index checkpoint holds fewer than {doc_count} docs"
+        self.forward_index_file_open_object.truncate(record_offset)
+        self.forward_index_file_open_object.seek(record_offset)
+
+    def add_document(self, doc_id: int, title_words: [Tuple[str, str]], body_words: [Tuple[str, str]]):
+        """Appends the words and their stemmed terms of the next document, doc ids must be added in order"""
+        assert doc_id == len(self.record_offsets), f"Doc id {doc_id} added out of order to the forward index"
+
+        title_ids = [self.__get_word_id(word, stem) for word, stem in title_words]
+        body_ids = [self.__get_word_id(word, stem) for word, stem in body_words[:ForwardIndex.MAX_DOCUMENT_TOKENS]]
+        word_id_array = array("H" if max(title_ids + body_ids, default=0) <= 0xFFFF else "I", title_ids + body_ids)
+
+        self.record_offsets.append(self.forward_index_file_open_object.tell())
+        self.forward_index_file_open_object.write(
+            ForwardIndex.RECORD_HEADER.pack(word_id_array.itemsize, len(title_ids), len(body_ids)))
+        self.forward_index_file_open_object.write(word_id_array.tobytes())
+
+    def __get_word_id(self, word: str, stem: str) -> int:
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            word_id = len(self.words)
+            self.word_ids[word] = word_id
+            self.words.append(word)
+            self.word_stems.append(stem)
+            self.words_file_open_object.write(f"{json.dumps([word, stem])}\n".encode("ascii"))
+        return word_id
+
+    def finish_build(self, doc_id_map: Optional[List[int]] = None):
+        """
+        Writes the offset table, in the new doc id order if doc_id_map is given, and the words with the word ids of
+        each stem, then opens the forward index
+        """
+        if doc_id_map is not None:
+            record_offsets = [0] * len(self.record_offsets)
+            for old_doc_id, record_offset in enumerate(self.record_offsets):
+                record_offsets[doc_id_map[old_doc_id]] = record_offset
+            self.record_offsets = record_offsets
+
+        stem_word_ids: {bytes: [int]} = {}
+        for word_id, stem in enumerate(self.word_stems):
+            stem_word_ids.setdefault(self.__string_key(stem), []).append(word_id)
+        stem_keys = sorted(stem_word_ids)
+
+        f = self.forward_index_file_open_object
+        table_offset = f.tell()
+        array("Q", self.record_offsets).tofile(f)
+        word_bytes_offset = f.tell()
+        word_offsets_offset = self.__write_strings(f, [self.__string_key(word) for word in self.words])
+        stem_bytes_offset = f.tell()
+        stem_offsets_offset = self.__write_strings(f, stem_keys)
+        stem_word_starts_offset = f.tell()
+        stem_word_starts = array("Q", [0])
+        for stem_key in stem_keys:
+            stem_word_starts.append(stem_word_starts[-1] + len(stem_word_ids[stem_key]))
+        stem_word_starts.tofile(f)
+        stem_word_ids_offset = f.tell()
+        array("I", [word_id for stem_key in stem_keys for word_id in stem_word_ids[stem_key]]).tofile(f)
+        f.write(b"\0" * (-f.tell() % 8))
+        f.write(ForwardIndex.FOOTER.pack(table_offset, word_bytes_offset, word_offsets_offset, stem_bytes_offset,
+                                         stem_offsets_offset, stem_word_starts_offset, stem_word_ids_offset,
+                                         len(self.record_offsets), len(self.words), len(stem_keys),
+                                         ForwardIndex.MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+        self.__close_build_files()
+        self.index_path.joinpath(f"{self.forward_index_file_name}.words.tmp").unlink(missing_ok=True)
+        os.replace(self.index_path.joinpath(f"{self.forward_index_file_name}.tmp"),
+                   self.index_path.joinpath(self.forward_index_file_name))
+
+        self.word_ids.clear()
+        self.words.clear()
+        self.word_stems.clear()
+        self.__open_mmap()
+
+    @staticmethod
+    def __string_key(string: str) -> bytes:
+        return string.encode("utf-8", errors="surrogatepass")
+
+    @staticmethod
+    def __write_strings(f, string_keys: [bytes]) -> int:
+        """Writes the strings padded to 8 bytes and then their offsets, returning the file offset of the offsets"""
+        string_offsets = array("Q", [0])
+        for string_key in string_keys:
+            f.write(string_key)
+            string_offsets.append(string_offsets[-1] + len(string_key))
+        f.write(b"\0" * (-f.tell() % 8))
+        string_offsets_offset = f.tell()
+        string_offsets.tofile(f)
+        return string_offsets_offset
+
+    def __open_mmap(self):
+        self.forward_index_file = MappedFile(self.index_path.joinpath(self.forward_index_file_name),
+                                             ForwardIndex.FOOTER, ForwardIndex.MAGIC)
+        self.table_offset, word_bytes_offset, word_offsets_offset, stem_bytes_offset, stem_offsets_offset, \
+            stem_word_starts_offset, stem_word_ids_offset, self.doc_count, self.word_count, self.stem_count = \
+            self.forward_index_file.footer
+        self.word_bytes = self.forward_index_file.section(word_bytes_offset, word_offsets_offset)
+        self.word_offsets = self.forward_index_file.section(word_offsets_offset, stem_bytes_offset, "Q")
+        self.stem_bytes = self.forward_index_file.section(stem_bytes_offset, stem_offsets_offset)
+        self.stem_offsets = self.forward_index_file.section(stem_offsets_offset, stem_word_starts_offset, "Q")
+        self.stem_word_starts = self.forward_index_file.section(stem_word_starts_offset, stem_word_ids_offset, "Q")
+        self.stem_word_ids = self.forward_index_file.section(stem_word_ids_offset,
+                                                             stem_word_ids_offset + self.word_count * 4, "I")
+
+    def __close_mmap(self):
+        self.word_bytes = self.word_offsets = None
+        self.stem_bytes = self.stem_offsets = self.stem_word_starts = self.stem_word_ids = None
+        if self.forward_index_file is not None:
+            self.forward_index_file.close()
+            self.forward_index_file = None
+        self.doc_count = 0
+        self.word_count = 0
+        self.stem_count = 0
+
+    def get_word(self, word_id: int) -> str:
+        return bytes(self.word_bytes[self.word_offsets[word_id]:self.word_offsets[word_id + 1]]) \
+            .decode("utf-8", errors="surrogatepass")
+
+    def get_stem_word_ids(self, stem: str) -> [int]:
+        """Word ids of the words with the stemmed term, to match query terms"""
+        if self.forward_index_file is None:
+            return []
+        stem_key = self.__string_key(stem)
+        start, end = 0, self.stem_count
+        while start < end:
+            middle = (start + end) // 2
+            if self.__stem_key(middle) < stem_key:
+                start = middle + 1
+            else:
+                end = middle
+        if start == self.stem_count or self.__stem_key(start) != stem_key:
+            return []
+        return list(self.stem_word_ids[self.stem_word_starts[start]:self.stem_word_starts[start + 1]])
+
+    def __stem_key(self, stem_number: int) -> bytes:
+        return bytes(self.stem_bytes[self.stem_offsets[stem_number]:self.stem_offsets[stem_number + 1]])
+
+    def get_word_ids(self, doc_id: int) -> Tuple[array, array]:
+        """Word ids of the title and body tokens of the doc"""
+        if self.forward_index_file is None or not 0 <= doc_id < self.doc_count:
+            raise KeyError(f"Doc id {doc_id} not in forward index")
+        record_offset = ForwardIndex.OFFSET.unpack_from(self.forward_index_file.data,
+                                                        self.table_offset + doc_id * ForwardIndex.OFFSET.size)[0]
+        item_size, title_count, body_count = ForwardIndex.RECORD_HEADER.unpack_from(self.forward_index_file.data,
+                                                                                    record_offset)
+        ids_start = record_offset + ForwardIndex.RECORD_HEADER.size
+        word_ids = array("H" if item_size == 2 else "I",
+                         self.forward_index_file.data[ids_start:ids_start + (title_count + body_count) * item_size])
+        return word_ids[:title_count], word_ids[title_count:]
+
+    def get_word_counts(self, doc_id: int) -> Tuple[int, int]:
+        """Number of title and body tokens of the doc, read from its record header only"""
+        if self.forward_index_file is None or not 0 <= doc_id < self.doc_count:
+            raise KeyError(f"Doc id {doc_id} not in forward index")
+        record_offset = ForwardIndex.OFFSET.unpack_from(self.forward_index_file.data,
+                                                        self.table_offset + doc_id * ForwardIndex.OFFSET.size)[0]
+        _, title_count, body_count = ForwardIndex.RECORD_HEADER.unpack_from(self.forward_index_file.data, record_offset)
+        return title_count, body_count
+
+    def get_title(self, doc_id: int) -> str:
+        title_ids, _ = self.get_word_ids(doc_id)
+        return " ".join(self.get_word(word_id) for word_id in title_ids)
+
+    def snippet(self, doc_id: int, query: str,
+                highlight_start: str = "<b>", highlight_end: str = "</b>", window: Optional[int] = None) -> str:
+        """
+        Returns the window of the doc's body tokens holding the most distinct query terms, then the most matches,
+        with the matching words wrapped in highlight_start and highlight_end
+        """
+        window = window or ForwardIndex.SNIPPET_WINDOW
+        _, body_ids = self.get_word_ids(doc_id)
+
+        query_stems = Tokenizer.tokenize_query(query, 1).keys()
+        match_stem_of_word: {int: str} = {word_id: stem for stem in query_stems
+                                         for word_id in self.get_stem_word_ids(stem)}
+
+        # slide the window over the matching tokens, counting the matches of each query term inside it
+        match_positions = [position for position, word_id in enumerate(body_ids) if word_id in match_stem_of_word]
+        best_start, best_score = 0, (0, 0)
+        window_stem_counts: {str: int} = {}
+        first_match = 0
+        for match in range(len(match_positions)):
+            stem = match_stem_of_word[body_ids[match_positions[match]]]
+            window_stem_counts[stem] = window_stem_counts.get(stem, 0) + 1
+            while match_positions[match] - match_positions[first_match] >= window:
+                first_stem = match_stem_of_word[body_ids[match_positions[first_match]]]
+                window_stem_counts[first_stem] -= 1
+                if window_stem_counts[first_stem] == 0:
+                    del window_stem_counts[first_stem]
+                first_match += 1
+            score = (len(window_stem_counts), match - first_match + 1)
+            if score > best_score:
+                best_score = score
+                best_start = match_positions[first_match]
+
+        # start a little before the first match so it reads in context
+        start = max(0, min(best_start - window // 5, len(body_ids) - window))
+        end = min(len(body_ids), start + window)
+        snippet_words = [f"{highlight_start}{self.get_word(word_id)}{highlight_end}" if word_id in match_stem_of_word
+                         else self.get_word(word_id) for word_id in body_ids[start:end]]
+        return f"{'... ' if start > 0 else ''}{' '.join(snippet_words)}{' ...' if end < len(body_ids) else ''}"
@@ -0,0 +1,105 @@
+import re
+import struct
+from array import array
+from pathlib import Path
+from typing import Optional, Tuple, List, Dict
+
+import Tokenizer
+from Indexer.Index import Index, MappedFile, publish_file
+
+
+class HeadQueries:
+    """
+    Precomputed first page results of the most frequent queries, stored next to the indexes they were searched in
+    so they are rebuilt with every build and generation. Queries are matched by their stemmed words in order,
+    which every query searched the same way shares, and all of them are loaded at start up.
+
+    File layout:
+        record | record | ... | footer
+    record: query byte length (uint16), result count (uint16), utf-8 normalized query, doc ids (uint32),
+            scores (float64), in result order
+    footer: query count (uint64), k results the queries were searched with (uint32), magic
+    """
+
+    MAGIC = b"SANDYHQ1"
+    RECORD_HEADER = struct.Struct("<HH")
+    FOOTER = struct.Struct("<QI8s")
+
+    def __enter__(self):
+        return self
+
+    def __init__(self, index_directory: Optional[str] = None):
+        self.index_path: Path = Path(index_directory or Index.index_directory)
+        assert self.index_path.is_dir(), f"Data path {self.index_path} not a directory"
+        self.head_queries_file_name: str = "head_queries.index"
+
+        self.query_results: {str: Tuple[array, array]} = {}  # doc ids and scores of each normalized query
+        self.k_results: int = 0
+
+        if Path(self.index_path.joinpath(self.head_queries_file_name)).is_file():
+            self.__load()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.query_results.clear()
+
+    def __len__(self):
+        return len(self.query_results)
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        words = [Tokenizer.stemmer.stem(re.sub(Tokenizer.token_filter_pattern, "", token).lower())
+                 for token in re.split(Tokenizer.token_split_pattern, query)]
+        return " ".join(word for word in words if len(word) > 0)
+
+    def prep_for_build(self):
+        """Drops the results, whose doc ids a new build of the indexes would not match"""
+        self.query_results.clear()
+        self.k_results = 0
+        self.index_path.joinpath(self.head_queries_file_name).unlink(missing_ok=True)
+
+    def build(self, query_results: {str: List[Tuple[int, float]]}, k_results: int):
+        """Writes the results of each normalized query, searched for k_results, and loads them"""
+        with publish_file(self.index_path.joinpath(self.head_queries_file_name), mode="wb") as f:
+            for query, doc_scores in query_results.items():
+                query_key = query.encode("utf-8")
+                f.write(HeadQueries.RECORD_HEADER.pack(len(query_key), len(doc_scores)))
+                f.write(query_key)
+                f.write(array("I", [doc_id for doc_id, _ in doc_scores]).tobytes())
+                f.write(array("d", [score for _, score in doc_scores]).tobytes())
+            f.write(HeadQueries.FOOTER.pack(len(query_results), k_results, HeadQueries.MAGIC))
+        self.__load()
+
+    def __load(self):
+        head_queries_file = MappedFile(self.index_path.joinpath(self.head_queries_file_name),
+                                       HeadQueries.FOOTER, HeadQueries.MAGIC)
+        query_count, self.k_results = head_queries_file.footer
+        head_queries_data = head_queries_file.data
+
+        self.query_results.clear()
+        offset = 0
+        for _ in range(query_count):
+            query_length, result_count = HeadQueries.RECORD_HEADER.unpack_from(head_queries_data, offset)
+            offset += HeadQueries.RECORD_HEADER.size
+            query = head_queries_data[offset:offset + query_length].decode("utf-8")
+            offset += query_length
+            doc_ids = array("I", head_queries_data[offset:offset + result_count * 4])
+            offset += result_count * 4
+            scores = array("d", head_queries_data[offset:offset + result_count * 8])
+            offset += result_count * 8
+            self.query_results[query] = (doc_ids, scores)
+        head_queries_file.close()
+
+    def get_results(self, query: str, k_results: int) -> Optional[Dict[int, float]]:
+        """
+        Scores of the precomputed results of the query, the best k_results when it was searched for more,
+        None if the query was not precomputed for k_results
+        """
+        if len(self.query_results) == 0 or k_results > self.k_results:
+            return None
+        results = self.query_results.get(self.normalize_query(query))
+        if results is None:
+            return None
+        doc_ids, scores = results
+        # a search for the same k can return more than k results, which are kept
+        result_count = len(doc_ids) if k_results == self.k_results else k_results
+        return dict(zip(doc_ids[:result_count], scores[:result_count]))
@@ -1,10 +1,84 @@
+import hashlib
+import heapq
+import io
+import mmap
 import os
+import struct
+import time
 from pathlib import Path
 import json
-from contextlib import ExitStack
-from typing import Optional
-
-from Indexer.DocList import PostingsList
+from bisect import bisect_left, bisect_right
+from contextlib import ExitStack, contextmanager
+from typing import Optional, List, Callable, Dict, Tuple
+
+from Indexer.DocList import PostingsList, Posting
+
+
+@contextmanager
+def publish_file(path: Path, mode: str = "w", encoding: Optional[str] = None):
+    """
+    Opens a temp file next to path for writing and replaces path with it once it is written and synced,
+    so a crash while writing leaves the previous file in place instead of a half written one
+    """
+    temp_path = path.with_name(f"{path.name}.tmp")
+    with open(temp_path, mode=mode, encoding=encoding) as f:
+        yield f
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def map_file(path: Path):
+    """
+    Maps the file read only. Cursors seek and read the map like a file, and processes forked after the file is
+    opened share the pages of the map instead of the position of one open file. An empty file can not be mapped,
+    so it is read from an empty buffer
+    """
+    with open(path, mode="rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return io.BytesIO()
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class MappedFile:
+    """
+    A file of one of the binary formats ending in a footer of footer_struct whose last field is magic, mapped read
+    only by map_file. Opening it reads the footer only, a missing magic is a file whose writing did not finish.
+    The sections of the file are read in place as memoryviews, cast to arrays of the native byte order, which is
+    the little endian the files are written in
+    """
+
+    def __init__(self, path: Path, footer_struct: struct.Struct, magic: bytes):
+        assert path.stat().st_size >= footer_struct.size, f"File {path.name} was not finished"
+        self.data: mmap.mmap = map_file(path)
+        *footer, footer_magic = footer_struct.unpack_from(self.data, len(self.data) - footer_struct.size)
+        assert footer_magic == magic, f"File {path.name} was not finished"
+        self.footer: tuple = tuple(footer)  # the footer fields before the magic
+        self.views: [memoryview] = []
+
+    def section(self, start: int, end: int, item_format: Optional[str] = None) -> memoryview:
+        """The bytes of the file from start to end, as an array of item_format if given, valid until close"""
+        with memoryview(self.data) as data_view:
+            view = data_view[start:end]
+        if item_format is not None:
+            view = view.cast(item_format)
+        self.views.append(view)
+        return view
+
+    def close(self):
+        # the views must be released before the map can be closed
+        for view in self.views:
+            view.release()
+        self.views.clear()
+        self.data.close()
+
+
+def stable_hash(data: bytes) -> int:
+    """
+    64 bit hash of data that is the same in every process, unlike hash, which is salted per process, so hashes
+    written by a build match in the searchers reading them and in a build resumed from a checkpoint
+    """
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
 
 
 class Index:
@@ -13,6 +87,10 @@ class Index:
     partial_index_directory = "./Indexer/Partial_Tiered_Indexes"
     settings_directory = "./Indexer/Tiered_Indexes_Settings"
     MAX_PARTIAL_INDEX_POSITIONS = 5000000  # max number of term positions in partial index before dumping to file
+    POSTINGS_BLOCK_SIZE = 64  # number of postings in each block of a posting list in the index file
+    DOC_ID_SKIP_INTERVAL = 64  # number of doc ids between skip pointers in a doc id ordered list
+    MERGE_PROGRESS_INTERVAL = 1000  # number of terms merged between calls of the merge progress callback
+    PHRASE_CACHE_SIZE = 1024  # number of n-gram terms matched from the positions of their words kept for reuse
     delim = '='
 
     def __enter__(self):
@@ -24,6 +102,12 @@ class Index:
                  sort_weights: {str: float},
                  postings_list_size_limit: Optional[int],
                  store_positions: bool,
+                 store_doc_id_lists: bool = False,
+                 n_grams_from_positions: bool = False,
+                 max_n_gram_terms: Optional[int] = None,
+                 index_directory: Optional[str] = None,
+                 partial_index_directory: Optional[str] = None,
+                 settings_directory: Optional[str] = None,
                  ):
 
         print(f"Initializing {descriptor.capitalize()} Index object...")
@@ -33,6 +117,10 @@ class Index:
         self.sort_weights: {str: float} = sort_weights
         self.postings_list_size_limit: int = postings_list_size_limit
         self.store_positions: bool = store_positions
+        self.store_doc_id_lists: bool = store_doc_id_lists  # also write doc id ordered lists for intersections
+        # n-gram terms the index does not hold are matched when searched from the positions of their words
+        self.n_grams_from_positions: bool = n_grams_from_positions and store_positions
+        self.max_n_gram_terms: Optional[int] = max_n_gram_terms  # merge only the n-grams in the most docs if set
 
         self.settings_file_name: str = f"{self.descriptor}_settings.json"
         self.temp_index_file_prefix: str = f"partial_{self.descriptor}"
@@ -40,41 +128,67 @@ class Index:
 
         self.index_file_term_LUT: {str: int} = {}  # dict storing term seek positions in index file
         self.document_term_counts: {str: int} = {}  # set of all the indexed terms collected
+        self.index_file_term_byte_sizes: {str: int} = {}  # dict storing byte size of each term's postings line
+        self.merged_postings_list_size_limit: Optional[int] = None  # postings_list_size_limit used at last merge
+        self.doc_id_file_term_LUT: {str: int} = {}  # dict storing term seek positions in the doc id list file
+        self.doc_id_gap_bytes: int = 0  # size of the doc id lists if stored as gamma coded doc id gaps
+        self.doc_count: int = 0  # number of docs at the last merge
+        # doc count and postings data of the n-gram terms last matched from the positions of their words
+        self.phrase_postings_cache: {str: Optional[Tuple[int, bytes]]} = {}
+        self.phrase_cache_stats: {str: int} = {"hits": 0, "misses": 0}
+        # times each term was queried in a query log, the next merge writes the terms queried most first
+        self.term_query_counts: {str: int} = {}
+        # bytes at the start of the index and doc id list files holding the posting lists of queried terms
+        self.hot_region_bytes: int = 0
+        self.hot_doc_id_region_bytes: int = 0
+        self.laid_out_by_query_counts: bool = False  # whether the last merge was given term query counts
 
         self.current_positions_count = 0
 
         self.partial_index: {str: PostingsList} = {}
-        self.partial_index_terms: {str} = set()  # set of terms stored through partial index files
+        self.partial_index_terms: {str: int} = {}  # terms stored through partial index files with their doc counts
         self.partial_index_file_names: [str] = []  # list of all the temp index file names generated in order
         self.partial_index_files_term_LUT: {str: {str: int}} = {}  # dict storing filename with dict of term positions
         self.partial_index_file_counter: int = 0  # number of partial index files and used for naming them
-
-        # verify data paths exist
-        self.partial_index_path: Path = Path(Index.partial_index_directory)
-        assert self.partial_index_path.exists(), f"Partial Index path {Index.partial_index_directory} does not exist"
-        assert self.partial_index_path.is_dir(), f"Partial Index path {Index.partial_index_directory} not a directory"
-        self.index_path: Path = Path(Index.index_directory)
-        assert self.index_path.exists(), f"Data path {Index.index_directory} does not exist"
-        assert self.index_path.is_dir(), f"Data path {Index.index_directory} not a directory"
-        self.settings_path: Path = Path(Index.settings_directory)
-        assert self.settings_path.exists(), f"Settings path {Index.settings_directory} does not exist"
-        assert self.settings_path.is_dir(), f"Settings path {Index.settings_directory} not a directory"
+        self.partial_index_doc_id: Optional[int] = None  # doc id of the last posting added to the partial index
+        self.spilled_doc_count: int = 0  # docs whose postings are all in the partial index files
+        self.restored_doc_count: int = 0  # docs whose postings were restored from the checkpoint of a resumed build
+        self.spill_seconds: float = 0.0  # time spent dumping partial indexes to file during the current build
+        self.spill_sizes: [int] = []  # bytes written by each partial index dump during the current build
+        self.merge_stats: {str: object} = {}  # bytes written and time spent by the last merge, see merge_index
+
+        # verify data paths exist, the class directories are used unless the index is given its own
+        self.partial_index_path: Path = Path(partial_index_directory or Index.partial_index_directory)
+        assert self.partial_index_path.exists(), f"Partial Index path {self.partial_index_path} does not exist"
+        assert self.partial_index_path.is_dir(), f"Partial Index path {self.partial_index_path} not a directory"
+        self.index_path: Path = Path(index_directory or Index.index_directory)
+        assert self.index_path.exists(), f"Data path {self.index_path} does not exist"
+        assert self.index_path.is_dir(), f"Data path {self.index_path} not a directory"
+        self.settings_path: Path = Path(settings_directory or Index.settings_directory)
+        assert self.settings_path.exists(), f"Settings path {self.settings_path} does not exist"
+        assert self.settings_path.is_dir(), f"Settings path {self.settings_path} not a directory"
 
         self.index_file_name: str = f"{self.index_file_prefix}.index"
         print(f"Checking if index file: {self.index_file_name} exists in {self.index_path}")
 
         if Path(self.index_path.joinpath(self.index_file_name)).is_file():
             print(f"Found index file, opening it...", end="")
-            self.index_file_open_object = \
-                open(self.index_path.joinpath(self.index_file_name), mode="r", encoding="ascii")
+            self.index_file_open_object = self.__open_for_reading(self.index_file_name)
             print("Done")
         else:
             print(f"Did not find index file, creating a new one and opening it...", end="")
             with open(self.index_path.joinpath(self.index_file_name), mode="w", encoding="ascii") as f:
                 f.write(" ")
-            self.index_file_open_object = \
-                open(self.index_path.joinpath(self.index_file_name), mode="r", encoding="ascii")
+            self.index_file_open_object = self.__open_for_reading(self.index_file_name)
             print("Done")
+        self.doc_id_file_name: str = f"{self.index_file_prefix}.docids"
+        self.doc_id_file_open_object = None
+        if self.store_doc_id_lists:
+            if not Path(self.index_path.joinpath(self.doc_id_file_name)).is_file():
+                print(f"Did not find doc id list file, creating a new one")
+                with open(self.index_path.joinpath(self.doc_id_file_name), mode="w", encoding="ascii") as f:
+                    f.write(" ")
+            self.doc_id_file_open_object = self.__open_for_reading(self.doc_id_file_name)
         print(f"Checked data and index paths exist")
 
         # positional index stored in index/positional_index.index
@@ -91,6 +205,8 @@ class Index:
     def __exit__(self, exc_type, exc_value, exc_traceback):
         if self.index_file_open_object is not None:
             self.index_file_open_object.close()
+        if self.doc_id_file_open_object is not None:
+            self.doc_id_file_open_object.close()
         print(f"Closed {self.descriptor} file.")
 
     def __contains__(self, key: str):
@@ -98,34 +214,104 @@ class Index:
 
     def prep_for_build(self):
 
+        self.partial_index.clear()
         self.partial_index_terms.clear()
         self.partial_index_file_names.clear()
         self.partial_index_files_term_LUT.clear()
         self.partial_index_file_counter = 0
+        self.partial_index_doc_id = None
+        self.spilled_doc_count = 0
+        self.restored_doc_count = 0
         self.current_positions_count = 0
+        self.spill_seconds = 0.0
+        self.spill_sizes.clear()
 
     def add_term(self, term: str, doc_id: int, positions: [int]) -> bool:
+        """
+        Adds the posting of the doc to the partial index, which is dumped to file when full before the postings of
+        the next doc, so docs added in doc id order are never split between partial index files. Postings of the
+        docs restored from a checkpoint are ignored, as a resumed build parses them again for the other indexes
+        """
+        if doc_id < self.restored_doc_count:
+            return False
 
         dumped = False
+        if self.current_positions_count >= Index.MAX_PARTIAL_INDEX_POSITIONS and doc_id != self.partial_index_doc_id:
+            # print(f"\nPreparing to dump partial index with {current_positions_count} positions to file")
+            self.dump_partial_index()  # dump partial index to file and record it
+            self.spilled_doc_count = doc_id
+            dumped = True
+
         self.partial_index.setdefault(term, PostingsList(store_positions=self.store_positions))
         self.partial_index[term].create_posting(doc_id, positions)
         self.current_positions_count += len(positions) if self.store_positions else 1
+        self.partial_index_doc_id = doc_id
 
-        if self.current_positions_count >= Index.MAX_PARTIAL_INDEX_POSITIONS:
-            # print(f"\nPreparing to dump partial index with {current_positions_count} positions to file")
-            self.__dump_partial_index(self.partial_index)  # dump partial index to file and record it
-            self.current_positions_count = 0
+        self.partial_index_terms[term] = self.partial_index_terms.get(term, 0) + 1
+        return dumped
+
+    def dump_partial_index(self):
+        """Dumps the postings held in memory to a new partial index file, if there are any"""
+        if self.current_positions_count > 0:
+            self.__dump_partial_index(self.partial_index)
             self.partial_index.clear()  # release partial index from memory
-            dumped = True
+            self.current_positions_count = 0
 
-        self.partial_index_terms.add(term)
-        return dumped
+    def finish_parse(self):
+        """
+        Dumps the postings held in memory once the pages are parsed. The postings added after, like the anchor text
+        of the docs linked to, are not in doc id order and are added even for the docs restored from a checkpoint
+        """
+        self.dump_partial_index()
+        self.restored_doc_count = 0
 
-    def merge_index(self, doc_count: int, complete_index: Optional['Index'], doc_page_rankings: [int]):
+    def checkpoint(self, doc_count: int) -> {str: object}:
+        """
+        The names of the partial index files written so far, with the term LUT file written next to each, and the
+        number of docs they hold all the postings of, all doc_count docs added so far if none are held in memory.
+        Nothing is dumped, so a build resumed from it adds the postings of the docs after those again
+        """
+        return {
+            "partial_index_file_names": list(self.partial_index_file_names),
+            "doc_count": doc_count if self.current_positions_count == 0 else self.spilled_doc_count,
+        }
+
+    def restore_checkpoint(self, checkpoint: {str: object}, skip_restored_docs: bool = True):
+        """
+        Restores the postings of the partial index files of a checkpoint, dropping any added after it. If
+        skip_restored_docs is set the postings added again for the docs the checkpoint holds are ignored
+        """
+        self.prep_for_build()
+        for partial_index_file_name in checkpoint["partial_index_file_names"]:
+            with open(self.partial_index_path.joinpath(f"{partial_index_file_name}.lut"), mode="r") as f:
+                data_dict = json.load(f)
+            self.partial_index_files_term_LUT[partial_index_file_name] = data_dict["term_LUT"]
+            for term, count in data_dict["term_doc_counts"].items():
+                self.partial_index_terms[term] = self.partial_index_terms.get(term, 0) + count
+            self.partial_index_file_names.append(partial_index_file_name)
+            self.spill_sizes.append(self.partial_index_path.joinpath(partial_index_file_name).stat().st_size)
+        # later partial index files overwrite the ones left by the interrupted build
+        self.partial_index_file_counter = len(self.partial_index_file_names)
+        self.spilled_doc_count = checkpoint["doc_count"]
+        self.restored_doc_count = checkpoint["doc_count"] if skip_restored_docs else 0
+
+    def merge_index(self,
+                    doc_count: int,
+                    complete_index: Optional['Index'],
+                    doc_page_rankings: [int],
+                    doc_id_map: Optional[List[int]] = None,
+                    progress_callback: Optional[Callable[['Index', int, int], None]] = None,
+                    document_term_counts: Optional[Dict[str, int]] = None):
         """
             Merges the index from the partial index files into one giant index file,
             recording the seek positions of all the terms. Raises ValueError is no partial index files to process
+            If doc_id_map is given the doc ids of the partial index files are renumbered with it while merging
+            If progress_callback is given it is called with the index, terms merged and total terms periodically
+            If document_term_counts is given the idf of each term is computed from its doc count there instead of
+            from the length of its merged posting list, so shards of an index score with the idf of all shards
+            If max_n_gram_terms is set only the n-gram terms found in the most docs are merged
         """
+        merge_start_time = time.perf_counter()
 
         if self.current_positions_count >= 0:
             self.__dump_partial_index(self.partial_index)
@@ -137,12 +323,27 @@ class Index:
 
         self.index_file_term_LUT.clear()  # reset index tracking vars
         self.document_term_counts.clear()
-        if self.index_file_open_object is not None:  # close current index file if open
-            self.index_file_open_object.close()
-
-        self.index_file_open_object = open(self.index_path.joinpath(self.index_file_name),
-                                           mode="w", encoding="ascii"
-                                           )  # reopen index file
+        self.index_file_term_byte_sizes.clear()
+        self.merged_postings_list_size_limit = self.postings_list_size_limit
+        self.doc_count = doc_count
+        self.phrase_postings_cache.clear()
+        self.doc_id_file_term_LUT.clear()
+        self.hot_region_bytes = 0
+        self.hot_doc_id_region_bytes = 0
+        self.laid_out_by_query_counts = len(self.term_query_counts) > 0
+        doc_id_gap_bits = 0
+        bytes_written = 0
+        term_size_buckets: {str: {str: float}} = {}  # time and bytes spent merging terms by their posting counts
+        self.__close_index_files()
+        index_file_open_object, doc_id_file_open_object = self.__open_temp_index_files()
+
+        merged_terms = self.partial_index_terms
+        if self.max_n_gram_terms is not None:
+            kept_n_gram_terms = set(heapq.nlargest(self.max_n_gram_terms,
+                                                   (term for term in self.partial_index_terms if " " in term),
+                                                   key=self.partial_index_terms.get))
+            merged_terms = [term for term in self.partial_index_terms if " " not in term or term in kept_n_gram_terms]
+        merged_terms = self.__order_by_query_count(merged_terms)
 
         # inspiration from src: https://stackoverflow.com/questions/29550290/how-to-open-a-list-of-files-in-python
         with ExitStack() as stack:
@@ -159,10 +360,11 @@ class Index:
             ]
 
             # loop over each term in the partial_index, writing line by line for each term from start in index file
-            for term in self.partial_index_terms:
+            for terms_merged, term in enumerate(merged_terms):
+                term_merge_start_time = time.perf_counter()
+                if progress_callback is not None and terms_merged % Index.MERGE_PROGRESS_INTERVAL == 0:
+                    progress_callback(self, terms_merged, len(merged_terms))
 
-                # store the seek position for the term in the index file
-                self.index_file_term_LUT[term] = self.index_file_open_object.tell()
                 raw_postings_data_merge_list = []  # list of string data of DocPosLists across all partial index files
 
                 # loop over each partial index file and process it if contains the term
@@ -186,39 +388,244 @@ class Index:
                 # merge raw postings for this term into a single PostingsList
                 merged_postings_list = PostingsList(store_positions=self.store_positions,
                                                     raw_posting_data_list=raw_postings_data_merge_list)
+                if doc_id_map is not None:
+                    merged_postings_list.remap_doc_ids(doc_id_map)
 
-                if complete_index is None:
-                    merged_postings_list.compute_local_tf_idf(doc_count, copy_to_global=True)
-                else:
-                    merged_postings_list.compute_local_tf_idf(doc_count, copy_to_global=False)
-                    assert term in complete_index.document_term_counts
-                    merged_postings_list.add_global_tf_idf(complete_index.retrieve_posting_list(term))
+                document_frequency = document_term_counts[term] if document_term_counts is not None else None
+                self._score_postings(term, merged_postings_list, doc_count, complete_index, document_frequency)
                 merged_postings_list.set_page_rankings(doc_page_rankings)
 
-                merged_postings_list.sort(self.sort_weights["page_rank"],
-                                          self.sort_weights["local_tf_idf"],
-                                          self.sort_weights["global_tf_idf"],
+                merged_postings_list.sort(page_rank_factor=self.sort_weights["page_rank"],
+                                          global_tf_idf_factor=self.sort_weights["global_tf_idf"],
+                                          local_tf_idf_factor=self.sort_weights["local_tf_idf"],
                                           )
 
                 if self.postings_list_size_limit is not None:
                     merged_postings_list.limit(self.postings_list_size_limit)
 
-                # prepare data string for writing the merged Postings Data to the final index for this term
-                write_data = f"{term}{Index.delim}{merged_postings_list.dump()}\n"
-
-                self.index_file_open_object.write(write_data)  # write the term postings data to the index
-
-                # store document frequency of term in memory to avoid having to read data from disk
-                self.document_term_counts[term] = len(merged_postings_list)
+                term_bytes_written = self.__write_postings_list(term, merged_postings_list,
+                                                                index_file_open_object, doc_id_file_open_object)
+                if doc_id_file_open_object is not None:
+                    doc_id_gap_bits += merged_postings_list.doc_id_gap_bits()
+
+                # bucket terms by the order of magnitude of their posting counts: 1-9, 10-99, 100-999, ...
+                term_size_bucket = f"{10 ** (len(str(len(merged_postings_list))) - 1)}+"
+                term_size_buckets.setdefault(term_size_bucket, {"terms": 0, "seconds": 0.0, "bytes_written": 0})
+                term_size_buckets[term_size_bucket]["terms"] += 1
+                term_size_buckets[term_size_bucket]["seconds"] += time.perf_counter() - term_merge_start_time
+                term_size_buckets[term_size_bucket]["bytes_written"] += term_bytes_written
+                bytes_written += term_bytes_written
+
+        self.doc_id_gap_bytes = doc_id_gap_bits // 8
+        self.merge_stats = {
+            "terms": len(self.document_term_counts),
+            "bytes_written": bytes_written,
+            "seconds": time.perf_counter() - merge_start_time,
+            "term_size_buckets": term_size_buckets,
+        }
+
+        self.__publish_index_files(index_file_open_object, doc_id_file_open_object)
+
+    def _score_postings(self,
+                        term: str,
+                        merged_postings_list: PostingsList,
+                        doc_count: int,
+                        complete_index: Optional['Index'],
+                        document_frequency: Optional[int]):
+        """Sets the local and global tf-idf scores of the term's merged postings"""
+        if complete_index is None:
+            merged_postings_list.compute_local_tf_idf(doc_count, copy_to_global=True,
+                                                      document_frequency=document_frequency)
+        else:
+            merged_postings_list.compute_local_tf_idf(doc_count, copy_to_global=False,
+                                                      document_frequency=document_frequency)
+            # a complete index keeping only some n-grams scores the others with their local tf-idf
+            assert term in complete_index.document_term_counts or complete_index.max_n_gram_terms is not None
+            merged_postings_list.add_global_tf_idf(complete_index.retrieve_posting_list(term)
+                                                   if term in complete_index.document_term_counts else None)
+
+    def retier(self,
+               source_index: Optional['Index'] = None,
+               doc_page_rankings: Optional[List[float]] = None,
+               progress_callback: Optional[Callable[['Index', int, int], None]] = None):
+        """
+            Rewrites the index from the merged postings of source_index, or of this index, sorted by the current
+            sort_weights and cut to the current postings_list_size_limit, without the partial index files.
+            The tf-idf scores of the postings are kept, so a source index must score its postings as this index
+            would, like the complete index does for a text tier. Only the source's terms of up to max_n_grams
+            words are kept, and postings a source already cut at a lower limit can not be brought back.
+            If doc_page_rankings is given the postings take their PageRank from it
+        """
+        retier_start_time = time.perf_counter()
+        source_index = source_index or self
+        if source_index is self and self.postings_list_size_limit is not None and \
+                (self.merged_postings_list_size_limit is None or
+                 self.postings_list_size_limit > self.merged_postings_list_size_limit):
+            print(f"{self.descriptor} was merged with a limit of {self.merged_postings_list_size_limit} postings, "
+                  f"a merge is needed to hold {self.postings_list_size_limit}")
+
+        # the postings are read from the files published before, which stay open until the new ones are
+        source_index_file_open_object = source_index.index_file_open_object
+        source_term_LUT: {str: int} = dict(source_index.index_file_term_LUT)
+        retiered_terms = self.__order_by_query_count([term for term in source_index.document_term_counts
+                                                      if term.count(" ") < self.max_n_grams])
+
+        self.index_file_term_LUT.clear()
+        self.document_term_counts.clear()
+        self.index_file_term_byte_sizes.clear()
+        self.doc_id_file_term_LUT.clear()
+        self.merged_postings_list_size_limit = self.postings_list_size_limit
+        self.doc_count = source_index.doc_count
+        self.phrase_postings_cache.clear()
+        self.hot_region_bytes = 0
+        self.hot_doc_id_region_bytes = 0
+        self.laid_out_by_query_counts = len(self.term_query_counts) > 0
+        doc_id_gap_bits = 0
+        bytes_written = 0
+        index_file_open_object, doc_id_file_open_object = self.__open_temp_index_files()
+
+        for terms_retiered, term in enumerate(retiered_terms):
+            if progress_callback is not None and terms_retiered % Index.MERGE_PROGRESS_INTERVAL == 0:
+                progress_callback(self, terms_retiered, len(retiered_terms))
+
+            postings_cursor = PostingsCursor(source_index_file_open_object, term, source_term_LUT[term],
+                                             source_index.sort_weights, source_index.postings_list_size_limit)
+            postings_list = PostingsList(store_positions=self.store_positions,
+                                         raw_posting_data_list=postings_cursor.read_blocks_data())
+            if not self.store_positions:
+                for posting in postings_list.postings_list:
+                    posting.term_pos_list = None
+            if doc_page_rankings is not None:
+                postings_list.set_page_rankings(doc_page_rankings)
+
+            postings_list.sort(page_rank_factor=self.sort_weights["page_rank"],
+                               global_tf_idf_factor=self.sort_weights["global_tf_idf"],
+                               local_tf_idf_factor=self.sort_weights["local_tf_idf"],
+                               )
+            if self.postings_list_size_limit is not None:
+                postings_list.limit(self.postings_list_size_limit)
+
+            bytes_written += self.__write_postings_list(term, postings_list,
+                                                        index_file_open_object, doc_id_file_open_object)
+            if doc_id_file_open_object is not None:
+                doc_id_gap_bits += postings_list.doc_id_gap_bits()
+
+        self.doc_id_gap_bytes = doc_id_gap_bits // 8
+        self.merge_stats = {
+            "terms": len(self.document_term_counts),
+            "bytes_written": bytes_written,
+            "seconds": time.perf_counter() - retier_start_time,
+            "source_index": source_index.descriptor,
+        }
+
+        self.__close_index_files()
+        self.__publish_index_files(index_file_open_object, doc_id_file_open_object)
+
+    def __close_index_files(self):
+        for file_open_object in (self.index_file_open_object, self.doc_id_file_open_object):
+            if file_open_object is not None:
+                file_open_object.close()
+        self.index_file_open_object = None
+        self.doc_id_file_open_object = None
+
+    def __open_temp_index_files(self):
+        """Opens the temp files a merged index and its doc id lists are written to until they are published"""
+        index_file_open_object = open(self.index_path.joinpath(f"{self.index_file_name}.tmp"),
+                                      mode="w", encoding="ascii")
+        doc_id_file_open_object = None
+        if self.store_doc_id_lists:  # doc id lists are written alongside the index
+            doc_id_file_open_object = open(self.index_path.joinpath(f"{self.doc_id_file_name}.tmp"),
+                                           mode="w", encoding="ascii")
+        return index_file_open_object, doc_id_file_open_object
+
+    def __write_postings_list(self, term: str, postings_list: PostingsList,
+                              index_file_open_object, doc_id_file_open_object) -> int:
+        """Writes the term's merged postings to the index files, recording where, and returns the bytes written"""
+        # store the seek position for the term in the index file
+        self.index_file_term_LUT[term] = index_file_open_object.tell()
+
+        # prepare data string for writing the merged Postings Data to the final index for this term,
+        # split into blocks of postings so readers can stop after the leading highest scoring blocks
+        write_data = f"{term}{Index.delim}" \
+                     f"{postings_list.dump_blocks(Index.POSTINGS_BLOCK_SIZE, self.sort_weights)}"
+
+        index_file_open_object.write(write_data)  # write the term postings data to the index
+
+        term_bytes_written = len(write_data)
+        if doc_id_file_open_object is not None:  # write the same postings in doc id order
+            self.doc_id_file_term_LUT[term] = doc_id_file_open_object.tell()
+            doc_id_write_data = \
+                f"{term}{Index.delim}" \
+                f"{postings_list.dump_doc_id_blocks(Index.DOC_ID_SKIP_INTERVAL, self.sort_weights)}"
+            doc_id_file_open_object.write(doc_id_write_data)
+            term_bytes_written += len(doc_id_write_data)
+
+        if self.term_query_counts.get(term, 0) > 0:  # the queried terms are written first, so they end here
+            self.hot_region_bytes = index_file_open_object.tell()
+            if doc_id_file_open_object is not None:
+                self.hot_doc_id_region_bytes = doc_id_file_open_object.tell()
+
+        # store document frequency of term in memory to avoid having to read data from disk
+        self.document_term_counts[term] = len(postings_list)
+        # store the size of the postings data so queries can be planned without reading from disk
+        self.index_file_term_byte_sizes[term] = len(write_data)
+        return term_bytes_written
+
+    def __order_by_query_count(self, terms: [str]) -> [str]:
+        """The terms queried most first, so their posting lists sit together at the start of the index files"""
+        if len(self.term_query_counts) == 0:
+            return list(terms)
+        # sorting is stable, so the terms never queried keep their order
+        return sorted(terms, key=lambda term: -self.term_query_counts.get(term, 0))
+
+    def warm_up(self, budget_bytes: int) -> int:
+        """
+        Reads the posting lists of the queried terms, at the start of the index files, into the page cache ahead of
+        the first searches, up to budget_bytes, and returns the bytes read ahead. The files of an index merged
+        without term query counts are read ahead from the start, and nothing of an index none of whose terms
+        were queried
+        """
+        warmed_bytes = 0
+        for file_open_object, hot_region_bytes in ((self.index_file_open_object, self.hot_region_bytes),
+                                                   (self.doc_id_file_open_object, self.hot_doc_id_region_bytes)):
+            if not isinstance(file_open_object, mmap.mmap):  # not opened, or an index without terms
+                continue
+            if warmed_bytes >= budget_bytes:
+                break
+            warm_bytes = min(hot_region_bytes if self.laid_out_by_query_counts else len(file_open_object),
+                             budget_bytes - warmed_bytes)
+            if warm_bytes == 0:
+                continue
+            if hasattr(mmap, "MADV_WILLNEED"):
+                file_open_object.madvise(mmap.MADV_WILLNEED, 0, warm_bytes)
+            else:  # touch a byte of every page where the kernel can not be advised
+                for page_offset in range(0, warm_bytes, mmap.PAGESIZE):
+                    file_open_object[page_offset]
+            warmed_bytes += warm_bytes
+        return warmed_bytes
+
+    def __publish_index_files(self, index_file_open_object, doc_id_file_open_object):
+        # publish the index files before the settings holding their term seek positions
+        for file_open_object, file_name in ((index_file_open_object, self.index_file_name),
+                                            (doc_id_file_open_object, self.doc_id_file_name)):
+            if file_open_object is None:
+                continue
+            file_open_object.flush()
+            os.fsync(file_open_object.fileno())
+            file_open_object.close()  # close the file since done writing
+            os.replace(self.index_path.joinpath(f"{file_name}.tmp"), self.index_path.joinpath(file_name))
 
         self.__save_settings_to_json()
         self.__load_settings_from_json()
         self.__save_settings_to_json()
 
-        self.index_file_open_object.close()  # close the file since done writing
-        self.index_file_open_object = open(self.index_path.joinpath(self.index_file_name),
-                                           mode="r", encoding="ascii"
-                                           )  # reopen index file for reading
+        # reopen index file for reading, in binary to seek to block offsets
+        self.index_file_open_object = self.__open_for_reading(self.index_file_name)
+        if doc_id_file_open_object is not None:
+            self.doc_id_file_open_object = self.__open_for_reading(self.doc_id_file_name)
+
+    def __open_for_reading(self, file_name: str):
+        return map_file(self.index_path.joinpath(file_name))  # an empty file is an index without terms
 
     def __dump_partial_index(self, partial_index: {str: PostingsList}):
         """
@@ -226,6 +633,7 @@ class Index:
         Records seek positions of terms in partial index file for that partial index file, for later merging
         """
 
+        spill_start_time = time.perf_counter()
         partial_index_term_seek_pos_lut = {}  # term : (data start pos, data length in bytes)
 
         # filename for the partial index file: index/partial_index0.dump
@@ -243,20 +651,122 @@ class Index:
                 partial_index_write_data = f"{term}{Index.delim}{doc_pos_list.dump_raw_postings()}\n"
                 partial_index_file_open_object.write(partial_index_write_data)  # write data to the partial index file
 
+            self.spill_sizes.append(partial_index_file_open_object.tell())
+
+        # the term LUT is written next to the partial index file so a build resumed from a checkpoint can read it
+        with publish_file(self.partial_index_path.joinpath(f"{partial_index_file_name}.lut")) as f:
+            json.dump({"term_LUT": partial_index_term_seek_pos_lut,
+                       "term_doc_counts": {term: len(doc_pos_list.postings_list)
+                                           for term, doc_pos_list in partial_index.items()}},
+                      f)
         self.partial_index_file_names.append(partial_index_file_name)  # record partial index file path sequentially
 
         # store the term to seek_pos lut for the partial index file
         self.partial_index_files_term_LUT[partial_index_file_name] = partial_index_term_seek_pos_lut
         self.partial_index_file_counter += 1  # increment global partial index file counter
+        self.spill_seconds += time.perf_counter() - spill_start_time
+
+    def retrieve_posting_list(self, term, max_blocks: Optional[int] = None) -> Optional[PostingsList]:
+        """Retrieves the term's posting list, or only its leading max_blocks blocks of highest scoring postings"""
+        postings_cursor = self.open_postings_cursor(term)
+        if postings_cursor is None:
+            return None
+
+        postings_list = PostingsList(self.store_positions,
+                                     raw_posting_data_list=postings_cursor.read_blocks_data(max_blocks))
 
-    def retrieve_posting_list(self, term) -> Optional[PostingsList]:
+        # postings are stored sorted, so a lowered size limit is honoured by truncating at read time
+        if self.postings_list_size_limit is not None and len(postings_list) > self.postings_list_size_limit:
+            postings_list.limit(self.postings_list_size_limit)
+        return postings_list
+
+    def open_postings_cursor(self, term) -> Optional['PostingsCursor']:
+        """
+        Opens a cursor streaming the term's posting list block by block, reading only its header for now.
+        An n-gram term the index does not hold streams the postings matched from the positions of its words
+        """
         if term not in self.document_term_counts:
+            phrase_postings = self.__match_phrase(term) if self.n_grams_from_positions else None
+            if phrase_postings is None:
+                return None
+            return PostingsCursor(io.BytesIO(phrase_postings[1]), term, 0, self.sort_weights)
+
+        return PostingsCursor(self.index_file_open_object,
+                              term,
+                              self.index_file_term_LUT[term],
+                              self.sort_weights,
+                              self.postings_list_size_limit)
+
+    def phrase_document_count(self, term: str) -> int:
+        """Number of docs of the index holding the n-gram term, matched from the positions of its words if needed"""
+        if term in self.document_term_counts:
+            return self.document_term_counts[term]
+        phrase_postings = self.__match_phrase(term) if self.n_grams_from_positions else None
+        return 0 if phrase_postings is None else phrase_postings[0]
+
+    def __match_phrase(self, term: str) -> Optional[Tuple[int, bytes]]:
+        """
+        Matches the n-gram term from the posting lists of its words, which the index must hold with positions,
+        returning the doc count and the postings data as stored in the index file, None if no doc holds it.
+        The postings are scored like a merged complete index scores its postings, from their own doc count
+        """
+        if term in self.phrase_postings_cache:
+            self.phrase_cache_stats["hits"] += 1
+            return self.phrase_postings_cache[term]
+        self.phrase_cache_stats["misses"] += 1
+
+        words = term.split(" ")
+        phrase_postings = None
+        if len(words) > 1 and all(word in self.document_term_counts for word in words):
+            # n-gram terms hold their words last word first, so the phrase starts with the term's last word
+            phrase_postings_list = PostingsList.match_phrase([self.retrieve_posting_list(word)
+                                                              for word in reversed(words)])
+            if len(phrase_postings_list) > 0:
+                document_count = len(phrase_postings_list)
+                phrase_postings_list.compute_local_tf_idf(self.doc_count, copy_to_global=True)
+                phrase_postings_list.sort(page_rank_factor=self.sort_weights["page_rank"],
+                                          global_tf_idf_factor=self.sort_weights["global_tf_idf"],
+                                          local_tf_idf_factor=self.sort_weights["local_tf_idf"],
+                                          )
+                if self.postings_list_size_limit is not None:
+                    phrase_postings_list.limit(self.postings_list_size_limit)
+                phrase_postings_data = \
+                    f"{term}{Index.delim}" \
+                    f"{phrase_postings_list.dump_blocks(Index.POSTINGS_BLOCK_SIZE, self.sort_weights)}"
+                phrase_postings = (document_count, phrase_postings_data.encode("ascii"))
+
+        if len(self.phrase_postings_cache) >= Index.PHRASE_CACHE_SIZE:
+            del self.phrase_postings_cache[next(iter(self.phrase_postings_cache))]
+        self.phrase_postings_cache[term] = phrase_postings
+        return phrase_postings
+
+    def open_doc_id_cursor(self, term) -> Optional['DocIdCursor']:
+        """Opens a cursor over the term's doc id ordered list, only for indexes storing doc id lists"""
+        if self.doc_id_file_open_object is None or term not in self.doc_id_file_term_LUT:
             return None
 
-        self.index_file_open_object.seek(self.index_file_term_LUT[term])
-        index_term, posting_data = self.index_file_open_object.readline().rstrip('\n').split(Index.delim)
-        assert term == index_term
-        return PostingsList(self.store_positions, dump_data=posting_data)
+        return DocIdCursor(self.doc_id_file_open_object, term, self.doc_id_file_term_LUT[term])
+
+    def estimate_posting_list_bytes(self, term: str) -> int:
+        """
+        Estimates the bytes read to retrieve the term's posting list using the statistics captured at merge time,
+        scaled down if postings_list_size_limit has been lowered since the index was merged
+        """
+        if term not in self.document_term_counts:
+            return 0
+
+        document_count = self.document_term_counts[term]
+        byte_size = self.index_file_term_byte_sizes.get(term, 0)
+        if self.postings_list_size_limit is not None and 0 < self.postings_list_size_limit < document_count:
+            byte_size = int(byte_size * self.postings_list_size_limit / document_count)
+        return byte_size
+
+    def effective_posting_list_length(self, term: str) -> int:
+        """Returns the number of postings the term's list holds under the current postings_list_size_limit"""
+        document_count = self.document_term_counts.get(term, 0)
+        if self.postings_list_size_limit is not None:
+            return min(document_count, self.postings_list_size_limit)
+        return document_count
 
     def __load_settings_from_json(self):
         with open(Path(self.settings_path.joinpath(self.settings_file_name)), mode="r") as f:
@@ -265,23 +775,41 @@ class Index:
             self.index_file_name = data_dict["index_file_name"]
             self.index_file_term_LUT = data_dict["index_file_term_LUT"]
             self.document_term_counts = data_dict["document_term_counts"]
-
-            self.partial_index_terms = set(data_dict["partial_index_terms"])
+            self.index_file_term_byte_sizes = data_dict.get("index_file_term_byte_sizes", {})
+            self.merged_postings_list_size_limit = data_dict.get("merged_postings_list_size_limit", None)
+            self.doc_id_file_term_LUT = data_dict.get("doc_id_file_term_LUT", {})
+            self.doc_id_gap_bytes = data_dict.get("doc_id_gap_bytes", 0)
+            self.doc_count = data_dict.get("doc_count", 0)
+            self.hot_region_bytes = data_dict.get("hot_region_bytes", 0)
+            self.hot_doc_id_region_bytes = data_dict.get("hot_doc_id_region_bytes", 0)
+            self.laid_out_by_query_counts = data_dict.get("laid_out_by_query_counts", self.hot_region_bytes > 0)
+
+            self.partial_index_terms = data_dict["partial_index_terms"]
+            if type(self.partial_index_terms) is list:  # settings saved before the doc counts were kept
+                self.partial_index_terms = {term: 0 for term in self.partial_index_terms}
             self.partial_index_file_names = data_dict["partial_index_file_names"]
             self.partial_index_files_term_LUT = data_dict["partial_index_files_term_LUT"]
             self.partial_index_file_counter = data_dict["partial_index_file_counter"]
 
     def __save_settings_to_json(self):
 
-        with open(Path(self.settings_path.joinpath(self.settings_file_name)), mode="w") as f:
+        with publish_file(self.settings_path.joinpath(self.settings_file_name)) as f:
 
             json_dict = {
 
                 "index_file_name": self.index_file_name,
                 "index_file_term_LUT": self.index_file_term_LUT,
                 "document_term_counts": self.document_term_counts,
-
-                "partial_index_terms": list(self.partial_index_terms),
+                "index_file_term_byte_sizes": self.index_file_term_byte_sizes,
+                "merged_postings_list_size_limit": self.merged_postings_list_size_limit,
+                "doc_id_file_term_LUT": self.doc_id_file_term_LUT,
+                "doc_id_gap_bytes": self.doc_id_gap_bytes,
+                "doc_count": self.doc_count,
+                "hot_region_bytes": self.hot_region_bytes,
+                "hot_doc_id_region_bytes": self.hot_doc_id_region_bytes,
+                "laid_out_by_query_counts": self.laid_out_by_query_counts,
+
+                "partial_index_terms": self.partial_index_terms,
                 "partial_index_file_names": self.partial_index_file_names,
                 "partial_index_files_term_LUT": self.partial_index_files_term_LUT,
                 "partial_index_file_counter": self.partial_index_file_counter,
@@ -289,3 +817,189 @@ class Index:
             }
 
             json.dump(json_dict, f)
+
+
+class PostingsCursor:
+    """
+    Streams the blocks of a term's impact ordered posting list from an index file, leading block first,
+    keeping track of the highest score any posting in the blocks not yet read can have
+    """
+
+    def __init__(self,
+                 index_file_open_object,
+                 term: str,
+                 seek_pos: int,
+                 sort_weights: {str: float},
+                 postings_limit: Optional[int] = None):
+
+        self.index_file_open_object = index_file_open_object
+        self.term: str = term
+        self.sort_weights: {str: float} = sort_weights
+
+        self.index_file_open_object.seek(seek_pos)
+        header_data = self.index_file_open_object.readline()
+        index_term, block_header_data = header_data.decode("ascii").rstrip('\n').split(Index.delim)
+        assert term == index_term
+
+        self.term_frequency, self.block_headers = PostingsList.parse_block_headers(block_header_data)
+        self.postings_limit: Optional[int] = postings_limit
+
+        # drop the blocks past the postings limit, the last block kept is trimmed when it is read
+        if postings_limit is not None:
+            postings_count = 0
+            for i, block_header in enumerate(self.block_headers):
+                postings_count += block_header.postings_count
+                if postings_count >= postings_limit:
+                    del self.block_headers[i + 1:]
+                    break
+
+        # max score left from each block onwards, blocks aren't in strict score order if sort weights changed
+        self.remaining_max_scores: [float] = [0.0] * (len(self.block_headers) + 1)
+        for i in reversed(range(len(self.block_headers))):
+            self.remaining_max_scores[i] = max(self.block_headers[i].max_score, self.remaining_max_scores[i + 1])
+
+        self.next_block: int = 0
+        self.next_block_pos: int = seek_pos + len(header_data)
+        self.postings_read: int = 0
+        self.bytes_read: int = len(header_data)
+
+    def __len__(self):
+        return sum(block_header.postings_count for block_header in self.block_headers)
+
+    def has_next(self) -> bool:
+        return self.next_block < len(self.block_headers)
+
+    def remaining_max_score(self) -> float:
+        """Upper bound of the impact score of any posting not yet read"""
+        return self.remaining_max_scores[self.next_block]
+
+    def read_block_data(self) -> str:
+        """Reads the raw postings data of the next block, trimmed to the postings limit"""
+        block_header = self.block_headers[self.next_block]
+        self.index_file_open_object.seek(self.next_block_pos)
+        block_data = self.index_file_open_object.read(block_header.byte_length).decode("ascii").rstrip('\n')
+
+        self.next_block += 1
+        self.next_block_pos += block_header.byte_length
+        self.bytes_read += block_header.byte_length
+        self.postings_read += block_header.postings_count
+
+        if self.postings_limit is not None and self.postings_read > self.postings_limit:
+            keep_count = block_header.postings_count - (self.postings_read - self.postings_limit)
+            block_data = PostingsList.delim.join(block_data.split(PostingsList.delim)[:keep_count])
+            self.postings_read = self.postings_limit
+        return block_data
+
+    def read_blocks_data(self, max_blocks: Optional[int] = None) -> [str]:
+        """Reads the raw postings data of the next max_blocks blocks, or all the remaining blocks"""
+        blocks_data = []
+        while self.has_next() and (max_blocks is None or len(blocks_data) < max_blocks):
+            blocks_data.append(self.read_block_data())
+        return blocks_data
+
+    def next_postings(self) -> [Posting]:
+        """Reads and parses the postings of the next block"""
+        return self.parse_block_data(self.read_block_data())
+
+    @staticmethod
+    def parse_block_data(block_data: str) -> [Posting]:
+        return [Posting(posting_data=posting_data) for posting_data in block_data.split(PostingsList.delim)]
+
+
+class DocIdCursor:
+    """
+    Walks a term's doc id ordered list in increasing doc id order, using the skip pointers in its header to jump
+    straight to the block that may hold a doc id and galloping search within a block
+    """
+
+    def __init__(self, doc_id_file_open_object, term: str, seek_pos: int):
+
+        self.doc_id_file_open_object = doc_id_file_open_object
+        self.term: str = term
+
+        self.doc_id_file_open_object.seek(seek_pos)
+        header_data = self.doc_id_file_open_object.readline()
+        index_term, block_header_data = header_data.decode("ascii").rstrip('\n').split(Index.delim)
+        assert term == index_term
+
+        self.document_count, self.block_headers = PostingsList.parse_doc_id_block_headers(block_header_data)
+        self.block_first_doc_ids: [int] = [block_header.first_doc_id for block_header in self.block_headers]
+        self.block_positions: [int] = []
+        block_pos = seek_pos + len(header_data)
+        for block_header in self.block_headers:
+            self.block_positions.append(block_pos)
+            block_pos += block_header.byte_length
+
+        self.block: int = -1
+        self.block_doc_ids: [int] = []
+        self.block_impact_scores: [float] = []
+        self.pos: int = 0
+        self.blocks_read: int = 0
+        self.postings_read: int = 0
+        self.bytes_read: int = len(header_data)
+
+        if len(self.block_headers) > 0:
+            self.__read_block(0)
+
+    def __len__(self):
+        return self.document_count
+
+    def __read_block(self, block: int):
+        self.doc_id_file_open_object.seek(self.block_positions[block])
+        block_data = self.doc_id_file_open_object.read(self.block_headers[block].byte_length)
+
+        self.block = block
+        self.block_doc_ids.clear()
+        self.block_impact_scores.clear()
+        self.pos = 0
+        self.blocks_read += 1
+        self.postings_read += self.block_headers[block].postings_count
+        self.bytes_read += len(block_data)
+
+        doc_id = self.block_headers[block].first_doc_id
+        for entry_data in block_data.decode("ascii").rstrip('\n').split(PostingsList.delim):
+            gap, impact_score = entry_data.split(Posting.delim)
+            doc_id += int(gap)
+            self.block_doc_ids.append(doc_id)
+            self.block_impact_scores.append(float(impact_score))
+
+    def doc_id(self) -> Optional[int]:
+        """The doc id the cursor is on, None once the list is exhausted"""
+        if self.pos < len(self.block_doc_ids):
+            return self.block_doc_ids[self.pos]
+        return None
+
+    def impact_score(self) -> float:
+        return self.block_impact_scores[self.pos]
+
+    def advance(self) -> Optional[int]:
+        """Moves to the next doc id in the list"""
+        self.pos += 1
+        if self.pos >= len(self.block_doc_ids) and self.block + 1 < len(self.block_headers):
+            self.__read_block(self.block + 1)
+        return self.doc_id()
+
+    def seek(self, target_doc_id: int) -> Optional[int]:
+        """Moves forward to the first doc id at or after target_doc_id, never moving backwards"""
+        current_doc_id = self.doc_id()
+        if current_doc_id is None or current_doc_id >= target_doc_id:
+            return current_doc_id
+
+        # follow the skip pointers to the last block starting at or before the target doc id
+        block = bisect_right(self.block_first_doc_ids, target_doc_id, lo=self.block) - 1
+        if block > self.block:
+            self.__read_block(block)
+
+        # gallop forward from the current position to bracket the target, then binary search the bracket
+        low, step = self.pos, 1
+        high = low + step
+        while high < len(self.block_doc_ids) and self.block_doc_ids[high] < target_doc_id:
+            low = high
+            step *= 2
+            high = low + step
+        self.pos = bisect_left(self.block_doc_ids, target_doc_id, low, min(high + 1, len(self.block_doc_ids)))
+
+        # the target is past this block, so the next block starts after it
+        if self.pos >= len(self.block_doc_ids) and self.block + 1 < len(self.block_headers):
+            self.__read_block(self.block + 1)
+        return self.doc_id()
@@ -0,0 +1,118 @@
+import fcntl
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Optional, IO
+
+from Indexer.Index import publish_file
+
+
+class IndexGenerations:
+    """
+    Versions of the tiered indexes kept in numbered generation directories, each holding the indexes of one build
+    in the data_directory layout of TieredIndex. The CURRENT file names the generation to search and is replaced
+    atomically when a build is published, so a new generation is built while searches keep using the current one.
+    Searchers hold a shared lock on the LEASE file of each generation they have open, and an old generation is
+    only deleted once no searcher holds it
+    """
+
+    generations_directory = "./Indexer/Generations"
+    current_file_name = "CURRENT"
+    lease_file_name = "LEASE"
+    reclaimed_prefix = ".reclaimed_"  # generations being deleted are renamed with it first
+    generation_name_pattern = re.compile(r"generation_(?P<number>[0-9]+)")
+
+    def __init__(self, generations_directory: Optional[str] = None):
+        self.generations_path: Path = Path(generations_directory or IndexGenerations.generations_directory)
+        self.generations_path.mkdir(parents=True, exist_ok=True)
+
+    def current_generation(self) -> Optional[str]:
+        """Name of the published generation to search, None if no generation was published yet"""
+        try:
+            with open(self.generations_path.joinpath(IndexGenerations.current_file_name), mode="r") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def generation_directory(self, generation: str) -> str:
+        return str(self.generations_path.joinpath(generation))
+
+    def generations(self) -> [str]:
+        """Names of all the generations on disk, oldest first"""
+        return sorted((path.name for path in self.generations_path.iterdir()
+                       if path.is_dir() and IndexGenerations.generation_name_pattern.fullmatch(path.name)),
+                      key=self.generation_number)
+
+    @staticmethod
+    def generation_number(generation: str) -> int:
+        return int(IndexGenerations.generation_name_pattern.fullmatch(generation).group("number"))
+
+    def new_generation(self) -> str:
+        """Creates the directories of a generation numbered after all the others and returns its name"""
+        generations = self.generations()
+        generation = f"generation_{self.generation_number(generations[-1]) + 1 if generations else 1:06d}"
+        for directory_name in ("Tiered_Indexes", "Partial_Tiered_Indexes", "Tiered_Indexes_Settings"):
+            self.generations_path.joinpath(generation, directory_name).mkdir(parents=True, exist_ok=True)
+        return generation
+
+    def unpublished_generation(self) -> Optional[str]:
+        """The newest generation if it is newer than the current one, left by a build that did not finish"""
+        generations = self.generations()
+        current_generation = self.current_generation()
+        if len(generations) == 0 or generations[-1] == current_generation or \
+                (current_generation is not None and
+                 self.generation_number(generations[-1]) < self.generation_number(current_generation)):
+            return None
+        return generations[-1]
+
+    def publish(self, generation: str):
+        """Makes generation the current generation, searchers switch to it the next time they refresh"""
+        assert Path(self.generation_directory(generation)).is_dir(), f"Generation {generation} does not exist"
+        with publish_file(self.generations_path.joinpath(IndexGenerations.current_file_name)) as f:
+            f.write(generation)
+
+    def lease(self, generation: str) -> Optional[IO]:
+        """
+        Takes a shared lease on generation, held until the returned file is closed, so reclaim does not delete it
+        meanwhile. None if the generation was reclaimed before the lease was taken
+        """
+        try:
+            lease_file = open(self.generations_path.joinpath(generation, IndexGenerations.lease_file_name), mode="a")
+        except FileNotFoundError:
+            return None
+        fcntl.flock(lease_file, fcntl.LOCK_SH)
+        if os.fstat(lease_file.fileno()).st_nlink == 0:  # deleted while waiting for the reclaim to finish
+            lease_file.close()
+            return None
+        return lease_file
+
+    def reclaim(self):
+        """
+        Deletes the generations before the current one that no searcher holds a lease on, the others are deleted
+        by a later reclaim. A generation is locked and renamed before it is deleted, so no lease can be taken on it
+        while it is deleted
+        """
+        for reclaimed_path in self.generations_path.glob(f"{IndexGenerations.reclaimed_prefix}*"):
+            shutil.rmtree(reclaimed_path, ignore_errors=True)  # left by a reclaim that was interrupted
+
+        current_generation = self.current_generation()
+        if current_generation is None:
+            return
+        for generation in self.generations():
+            if self.generation_number(generation) >= self.generation_number(current_generation):
+                break
+            try:
+                with open(self.generations_path.joinpath(generation, IndexGenerations.lease_file_name),
+                          mode="a") as lease_file:
+                    try:
+                        fcntl.flock(lease_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        print(f"Keeping index generation {generation}, it is still searched")
+                        continue
+                    reclaimed_path = self.generations_path.joinpath(f"{IndexGenerations.reclaimed_prefix}{generation}")
+                    os.rename(self.generation_directory(generation), reclaimed_path)
+                    print(f"Deleting index generation {generation}")
+                    shutil.rmtree(reclaimed_path, ignore_errors=True)
+            except FileNotFoundError:  # reclaimed by another process meanwhile
+                continue
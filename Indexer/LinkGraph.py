@@ -0,0 +1,197 @@
+import heapq
+import os
+import struct
+from array import array
+from pathlib import Path
+from typing import Optional, Iterator, List
+
+from Indexer.Index import Index, MappedFile
+
+
+class LinkGraph:
+    """
+    The links between docs as compressed sparse rows: the neighbors of every doc in doc id order, with the offset of
+    each doc's neighbors, for the out links and for the in links. The file is read through mmap, so opening it
+    loads nothing and only the pages of the docs looked up are read.
+    While building, links are held as sorted runs of RUN_EDGES links spilled to the partial index directory and
+    the runs are merged into the file, so the memory of a build does not grow with the number of links.
+
+    File layout:
+        out neighbors | in neighbors | out offsets | in offsets | footer
+    out neighbors: target doc ids of the links from each doc, sorted (uint32)
+    in neighbors:  source doc ids of the links to each doc, sorted, padded to 8 bytes (uint32)
+    out offsets:   start of each doc's out neighbors and the end of the last (uint64)
+    in offsets:    start of each doc's in neighbors and the end of the last (uint64)
+    footer:        offsets of the in neighbors, out offsets and in offsets (uint64), doc count (uint64),
+                   link count (uint64), magic
+    """
+
+    RUN_EDGES = 1 << 20  # links held in memory before they are sorted and spilled as a run
+    READ_EDGES = 1 << 14  # links read at a time from each run while merging
+    MAGIC = b"SANDYLG1"
+    FOOTER = struct.Struct("<QQQQQ8s")
+
+    def __enter__(self):
+        return self
+
+    def __init__(self, index_directory: Optional[str] = None, partial_index_directory: Optional[str] = None):
+        self.index_path: Path = Path(index_directory or Index.index_directory)
+        assert self.index_path.is_dir(), f"Data path {self.index_path} not a directory"
+        self.partial_index_path: Path = Path(partial_index_directory or Index.partial_index_directory)
+        assert self.partial_index_path.is_dir(), f"Partial index path {self.partial_index_path} not a directory"
+        self.link_graph_file_name: str = "link_graph.index"
+
+        # links being built, as source << 32 | target for the out links and target << 32 | source for the in links
+        self.out_keys: array = array("Q")
+        self.in_keys: array = array("Q")
+        self.run_count: int = 0
+
+        self.link_graph_file: Optional[MappedFile] = None
+        self.out_neighbors: Optional[memoryview] = None
+        self.in_neighbors: Optional[memoryview] = None
+        self.out_offsets: Optional[memoryview] = None
+        self.in_offsets: Optional[memoryview] = None
+        self.doc_count: int = 0
+        self.link_count: int = 0
+
+        if Path(self.index_path.joinpath(self.link_graph_file_name)).is_file():
+            self.__open_mmap()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__close_mmap()
+        self.__delete_runs()
+
+    def __len__(self):
+        return self.link_count
+
+    def prep_for_build(self):
+        self.__close_mmap()
+        self.__delete_runs()
+
+    def add_link(self, source_doc_id: int, target_doc_id: int):
+        self.out_keys.append(source_doc_id << 32 | target_doc_id)
+        self.in_keys.append(target_doc_id << 32 | source_doc_id)
+        if len(self.out_keys) >= LinkGraph.RUN_EDGES:
+            self.__spill_run()
+
+    def finish_build(self, doc_count: int):
+        """Merges the runs of the links added into the link graph file of doc_count docs and opens it"""
+        self.__spill_run()
+        self.__close_mmap()
+
+        link_graph_path = self.index_path.joinpath(self.link_graph_file_name)
+        with open(f"{link_graph_path}.tmp", mode="wb") as f:
+            out_offsets = self.__write_neighbors(f, "out", doc_count)
+            in_neighbors_offset = f.tell()
+            in_offsets = self.__write_neighbors(f, "in", doc_count)
+            f.write(b"\0" * (-f.tell() % 8))
+            out_offsets_offset = f.tell()
+            out_offsets.tofile(f)
+            in_offsets_offset = f.tell()
+            in_offsets.tofile(f)
+            f.write(LinkGraph.FOOTER.pack(in_neighbors_offset, out_offsets_offset, in_offsets_offset,
+                                          doc_count, out_offsets[doc_count], LinkGraph.MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{link_graph_path}.tmp", link_graph_path)
+
+        self.__delete_runs()
+        self.__open_mmap()
+
+    def renumber(self, doc_id_map: List[int]):
+        """Rewrites the link graph with the new doc id at each old doc id"""
+        self.__delete_runs()
+        for source_doc_id in range(self.doc_count):
+            for target_doc_id in self.out_links(source_doc_id):
+                self.add_link(doc_id_map[source_doc_id], doc_id_map[target_doc_id])
+        self.finish_build(self.doc_count)
+
+    def __run_path(self, direction: str, run_number: int) -> Path:
+        return self.partial_index_path.joinpath(f"link_graph_{direction}_run_{run_number}.partial")
+
+    def __spill_run(self):
+        if len(self.out_keys) == 0:
+            return
+        for direction, keys in (("out", self.out_keys), ("in", self.in_keys)):
+            with open(self.__run_path(direction, self.run_count), mode="wb") as f:
+                array("Q", sorted(set(keys))).tofile(f)
+        self.run_count += 1
+        self.out_keys = array("Q")
+        self.in_keys = array("Q")
+
+    def __delete_runs(self):
+        for run_number in range(self.run_count):
+            for direction in ("out", "in"):
+                self.__run_path(direction, run_number).unlink(missing_ok=True)
+        self.run_count = 0
+        self.out_keys = array("Q")
+        self.in_keys = array("Q")
+
+    def __iter_run(self, direction: str, run_number: int) -> Iterator[int]:
+        with open(self.__run_path(direction, run_number), mode="rb") as f:
+            while True:
+                keys = array("Q")
+                try:
+                    keys.fromfile(f, LinkGraph.READ_EDGES)
+                except EOFError:  # the keys left before the end of the run are still read
+                    yield from keys
+                    return
+                yield from keys
+
+    def __write_neighbors(self, f, direction: str, doc_count: int) -> array:
+        """Writes the neighbors of every doc merged from the runs and returns the offsets of each doc's neighbors"""
+        neighbor_counts = array("Q", bytes(8 * (doc_count + 1)))
+        neighbors = array("I")
+        last_key = None
+        for key in heapq.merge(*(self.__iter_run(direction, run_number) for run_number in range(self.run_count))):
+            if key == last_key:  # the same link found on a page again, or in another run
+                continue
+            last_key = key
+            neighbor_counts[(key >> 32) + 1] += 1
+            neighbors.append(key & 0xFFFFFFFF)
+            if len(neighbors) >= LinkGraph.READ_EDGES:
+                neighbors.tofile(f)
+                neighbors = array("I")
+        neighbors.tofile(f)
+
+        for doc_id in range(doc_count):
+            neighbor_counts[doc_id + 1] += neighbor_counts[doc_id]
+        return neighbor_counts
+
+    def __open_mmap(self):
+        self.link_graph_file = MappedFile(self.index_path.joinpath(self.link_graph_file_name),
+                                          LinkGraph.FOOTER, LinkGraph.MAGIC)
+        in_neighbors_offset, out_offsets_offset, in_offsets_offset, self.doc_count, self.link_count = \
+            self.link_graph_file.footer
+        self.out_neighbors = self.link_graph_file.section(0, self.link_count * 4, "I")
+        self.in_neighbors = self.link_graph_file.section(in_neighbors_offset,
+                                                         in_neighbors_offset + self.link_count * 4, "I")
+        self.out_offsets = self.link_graph_file.section(out_offsets_offset, in_offsets_offset, "Q")
+        self.in_offsets = self.link_graph_file.section(in_offsets_offset,
+                                                       in_offsets_offset + (self.doc_count + 1) * 8, "Q")
+
+    def __close_mmap(self):
+        self.out_neighbors = self.in_neighbors = self.out_offsets = self.in_offsets = None
+        if self.link_graph_file is not None:
+            self.link_graph_file.close()
+            self.link_graph_file = None
+        self.doc_count = 0
+        self.link_count = 0
+
+    def out_links(self, doc_id: int) -> [int]:
+        """Doc ids the doc links to"""
+        if not 0 <= doc_id < self.doc_count:
+            return []
+        return self.out_neighbors[self.out_offsets[doc_id]:self.out_offsets[doc_id + 1]].tolist()
+
+    def in_links(self, doc_id: int) -> [int]:
+        """Doc ids of the docs linking to the doc"""
+        if not 0 <= doc_id < self.doc_count:
+            return []
+        return self.in_neighbors[self.in_offsets[doc_id]:self.in_offsets[doc_id + 1]].tolist()
+
+    def out_degree(self, doc_id: int) -> int:
+        return self.out_offsets[doc_id + 1] - self.out_offsets[doc_id] if 0 <= doc_id < self.doc_count else 0
+
+    def in_degree(self, doc_id: int) -> int:
+        return self.in_offsets[doc_id + 1] - self.in_offsets[doc_id] if 0 <= doc_id < self.doc_count else 0
@@ -0,0 +1,215 @@
+import math
+from pathlib import Path
+from typing import Optional, List, Callable
+
+from Indexer.Index import Index
+from Indexer.TieredIndex import TieredIndex
+
+
+class ShardedIndex:
+    """
+    One tier of a sharded index, adding each posting to the same tier of the shard holding its doc and merging the
+    tier of every shard with the doc counts of all the shards, so the shards score postings with the same idf
+    """
+
+    def __init__(self, shard_indexes: [Index], shard_of_doc: Callable[[int], int]):
+        self.shard_indexes: [Index] = shard_indexes
+        self.shard_of_doc: Callable[[int], int] = shard_of_doc
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        for shard_index in self.shard_indexes:
+            shard_index.__exit__(exc_type, exc_value, exc_traceback)
+
+    def __contains__(self, key: str):
+        return any(key in shard_index for shard_index in self.shard_indexes)
+
+    @property
+    def descriptor(self) -> str:
+        return self.shard_indexes[0].descriptor
+
+    @property
+    def max_n_grams(self) -> int:
+        return self.shard_indexes[0].max_n_grams
+
+    @property
+    def sort_weights(self) -> {str: float}:
+        return self.shard_indexes[0].sort_weights
+
+    @property
+    def spill_seconds(self) -> float:
+        return sum(shard_index.spill_seconds for shard_index in self.shard_indexes)
+
+    @property
+    def spill_sizes(self) -> [int]:
+        return [spill_size for shard_index in self.shard_indexes for spill_size in shard_index.spill_sizes]
+
+    @property
+    def doc_id_gap_bytes(self) -> int:
+        return sum(shard_index.doc_id_gap_bytes for shard_index in self.shard_indexes)
+
+    @property
+    def merge_stats(self) -> {str: object}:
+        return {
+            "terms": len(self.document_term_counts),
+            "bytes_written": sum(shard_index.merge_stats.get("bytes_written", 0) for shard_index in self.shard_indexes),
+            "seconds": sum(shard_index.merge_stats.get("seconds", 0.0) for shard_index in self.shard_indexes),
+            "shards": [shard_index.merge_stats for shard_index in self.shard_indexes],
+        }
+
+    @property
+    def phrase_cache_stats(self) -> {str: int}:
+        return {counter: sum(shard_index.phrase_cache_stats[counter] for shard_index in self.shard_indexes)
+                for counter in ("hits", "misses")}
+
+    @property
+    def document_term_counts(self) -> {str: int}:
+        """Doc counts of the merged posting lists summed over the shards"""
+        return self.__sum_term_counts([shard_index.document_term_counts for shard_index in self.shard_indexes])
+
+    @staticmethod
+    def __sum_term_counts(shard_term_counts: [{str: int}]) -> {str: int}:
+        term_counts: {str: int} = {}
+        for term_counts_of_shard in shard_term_counts:
+            for term, count in term_counts_of_shard.items():
+                term_counts[term] = term_counts.get(term, 0) + count
+        return term_counts
+
+    @property
+    def term_query_counts(self) -> {str: int}:
+        return self.shard_indexes[0].term_query_counts
+
+    @term_query_counts.setter
+    def term_query_counts(self, term_query_counts: {str: int}):
+        for shard_index in self.shard_indexes:
+            shard_index.term_query_counts = term_query_counts
+
+    def prep_for_build(self):
+        for shard_index in self.shard_indexes:
+            shard_index.prep_for_build()
+
+    def add_term(self, term: str, doc_id: int, positions: [int]) -> bool:
+        return self.shard_indexes[self.shard_of_doc(doc_id)].add_term(term, doc_id, positions)
+
+    def dump_partial_index(self):
+        for shard_index in self.shard_indexes:
+            shard_index.dump_partial_index()
+
+    def finish_parse(self):
+        for shard_index in self.shard_indexes:
+            shard_index.finish_parse()
+
+    def checkpoint(self, doc_count: int) -> {str: object}:
+        """The checkpoint of each shard's tier, holding all the docs of the shard with the fewest"""
+        shard_checkpoints = [shard_index.checkpoint(doc_count) for shard_index in self.shard_indexes]
+        return {
+            "shards": shard_checkpoints,
+            "doc_count": min(shard_checkpoint["doc_count"] for shard_checkpoint in shard_checkpoints),
+        }
+
+    def restore_checkpoint(self, checkpoint: {str: object}, skip_restored_docs: bool = True):
+        for shard_index, shard_checkpoint in zip(self.shard_indexes, checkpoint["shards"]):
+            shard_index.restore_checkpoint(shard_checkpoint, skip_restored_docs)
+
+    def retier(self,
+               source_index: Optional['ShardedIndex'] = None,
+               doc_page_rankings: Optional[List[float]] = None,
+               progress_callback: Optional[Callable[[Index, int, int], None]] = None):
+        """Rewrites the tier of each shard in turn from the same tier of the source shard, see Index.retier"""
+        for shard, shard_index in enumerate(self.shard_indexes):
+            shard_index.retier(source_index.shard_indexes[shard] if source_index is not None else None,
+                               doc_page_rankings, progress_callback)
+
+    def warm_up(self, budget_bytes: int) -> int:
+        """Reads the queried posting lists of each shard in turn into the page cache, see Index.warm_up"""
+        warmed_bytes = 0
+        for shard_index in self.shard_indexes:
+            warmed_bytes += shard_index.warm_up(budget_bytes - warmed_bytes)
+        return warmed_bytes
+
+    def merge_index(self,
+                    doc_count: int,
+                    complete_index: Optional['ShardedIndex'],
+                    doc_page_rankings: [int],
+                    doc_id_map: Optional[List[int]] = None,
+                    progress_callback: Optional[Callable[[Index, int, int], None]] = None):
+        """Merges the tier of each shard in turn, see Index.merge_index"""
+        assert doc_id_map is None, f"Docs can not be renumbered across the shards of a sharded index"
+
+        # doc counts of all the postings added to the tier, before the tier's posting list size limit is applied
+        document_term_counts = self.__sum_term_counts([shard_index.partial_index_terms
+                                                       for shard_index in self.shard_indexes])
+        for shard, shard_index in enumerate(self.shard_indexes):
+            shard_index.merge_index(doc_count,
+                                    complete_index.shard_indexes[shard] if complete_index is not None else None,
+                                    doc_page_rankings,
+                                    progress_callback=progress_callback,
+                                    document_term_counts=document_term_counts)
+
+
+class ShardedTieredIndex(TieredIndex):
+    """
+    Tiered index split by doc id range into shards, each a complete tiered index in its own directory that can be
+    searched on its own. The local store is parsed once, so doc ids, duplicates, anchor text and PageRank are
+    computed over the whole collection, and each posting is added to the shard holding its doc.
+    The url LUTs, link graph, forward index and autocomplete of the whole collection are kept in the shards directory
+    """
+
+    shards_directory = "./Indexer/Shards"
+    TIERS = ("title_index", "anchor_index", "header_index", "bold_index", "limited_index", "complete_index")
+
+    def __init__(self, shard_count: int, max_n_grams: int, page_rank_iterations: int,
+                 shards_directory: Optional[str] = None, unigram_positions_only: Optional[bool] = None):
+        assert shard_count > 0, f"Shard count {shard_count} must be positive"
+        self.shard_count: int = shard_count
+        shards_path = Path(shards_directory or ShardedTieredIndex.shards_directory)
+        self.shard_directories: [str] = [str(shards_path.joinpath(f"shard_{shard}")) for shard in range(shard_count)]
+        for data_directory in [str(shards_path)] + self.shard_directories:
+            for directory_name in ("Tiered_Indexes", "Partial_Tiered_Indexes", "Tiered_Indexes_Settings"):
+                Path(data_directory).joinpath(directory_name).mkdir(parents=True, exist_ok=True)
+
+        # fielded postings are not built for sharded indexes
+        super().__init__(max_n_grams, page_rank_iterations, doc_id_ordering=None, data_directory=str(shards_path),
+                         unigram_positions_only=unigram_positions_only, fielded_postings=False)
+        self.docs_per_shard: int = 1  # set from the size of the local store when building
+        self.shards: [TieredIndex] = [TieredIndex(max_n_grams, page_rank_iterations, data_directory=shard_directory,
+                                                  unigram_positions_only=self.unigram_positions_only)
+                                      for shard_directory in self.shard_directories]
+
+    def __enter__(self):
+        for shard in self.shards:
+            shard.__enter__()
+        for tier in ShardedTieredIndex.TIERS:
+            setattr(self, tier, ShardedIndex([getattr(shard, tier) for shard in self.shards], self.shard_of_doc))
+        self._open_collection_indexes()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        print(f"\nPreparing to close sharded tiered index...")
+        for shard in self.shards:
+            shard.__exit__(exc_type, exc_val, exc_tb)
+        self._close_collection_indexes(exc_type, exc_val, exc_tb)
+        print(f"Closed sharded tiered index.")
+
+    def shard_of_doc(self, doc_id: int) -> int:
+        return min(doc_id // self.docs_per_shard, self.shard_count - 1)
+
+    def build_tiered_indexes(self, resume: bool = False):
+        # split the doc ids into even ranges, duplicates skipped while parsing leave the last shard a little smaller
+        self.docs_per_shard = max(1, math.ceil(self.local_store_page_count() / self.shard_count))
+        super().build_tiered_indexes(resume)
+
+    def save_doc_table(self):
+        """Writes the doc table of the whole collection and the doc table of each shard, with the urls of its docs"""
+        for shard_number, shard in enumerate(self.shards):
+            shard.doc_id_counter = self.doc_id_counter
+            shard.doc_id_to_url_LUT = {doc_id: url for doc_id, url in self.doc_id_to_url_LUT.items()
+                                       if self.shard_of_doc(doc_id) == shard_number}
+            shard.save_doc_table()
+        super().save_doc_table()
+
+    def save_settings(self):
+        """Saves the settings of the whole collection and of each shard"""
+        super().save_settings()
+        for shard in self.shards:
+            shard.doc_id_counter = self.doc_id_counter
+            shard.save_settings()
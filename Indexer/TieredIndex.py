@@ -1,15 +1,33 @@
 import json
+import time
 import urllib.parse
+from collections import deque
 from pathlib import Path
+from typing import Optional, Iterator, Tuple, List
 
 import Tokenizer
-from Indexer.Index import Index
+from Indexer.Index import Index, publish_file, stable_hash
+from Indexer.Autocomplete import Autocomplete
+from Indexer.BuildMetrics import BuildMetrics
+from Indexer.DocStore import DocStore, DocStoreReader
+from Indexer.DocTable import DocTable
+from Indexer.FieldedIndex import FieldedIndex
+from Indexer.ForwardIndex import ForwardIndex
+from Indexer.HeadQueries import HeadQueries
+from Indexer.LinkGraph import LinkGraph
 import Tokenizer
 
 
 class TieredIndex:
     local_store_dir = "./Indexer/Local_Store"
     settings_directory = "./Indexer/Tiered_Indexes_Settings"
+    build_metrics_file_name = "build_metrics.jsonl"  # json lines of build progress, written to the settings directory
+    checkpoint_file_name = "build_checkpoint.json"  # progress of an unfinished build, in the settings directory
+    # json line of the changes each page parsed made to the parsed docs, in the settings directory until built
+    parsed_pages_log_file_name = "build_parsed_pages.jsonl"
+    CHECKPOINT_INTERVAL = 10000  # number of local store pages parsed between build checkpoints
+    FREQUENT_PAIR_LIMIT = 10000  # pairs of words kept in the complete index of a unigram positions only build
+    WARM_UP_BUDGET = 256 << 20  # bytes of the indexes read into the page cache at start up by default
 
     def __enter__(self):
 
@@ -19,6 +37,7 @@ class TieredIndex:
                   sort_weights={"page_rank": 0.40, "global_tf_idf": 0.20, "local_tf_idf": 0.40},
                   postings_list_size_limit=70,
                   store_positions=False,
+                  **self.index_directories,
                   )
 
         self.anchor_index: Index = \
@@ -27,43 +46,83 @@ class TieredIndex:
                   sort_weights={"page_rank": 0.40, "global_tf_idf": 0.00, "local_tf_idf": 0.60},
                   postings_list_size_limit=90,
                   store_positions=False,
+                  **self.index_directories,
                   )
 
         self.header_index: Index = \
             Index(descriptor="headers_index",
-                  max_n_gram=3,
+                  max_n_gram=1 if self.unigram_positions_only else self.max_n_grams,
                   sort_weights={"page_rank": 0.40, "global_tf_idf": 0.20, "local_tf_idf": 0.40},
                   postings_list_size_limit=120,
                   store_positions=True,
+                  n_grams_from_positions=self.unigram_positions_only,
+                  **self.index_directories,
                   )
 
         self.bold_index: Index = \
             Index(descriptor="important_text_index",
-                  max_n_gram=3,
+                  max_n_gram=1 if self.unigram_positions_only else self.max_n_grams,
                   sort_weights={"page_rank": 0.40, "global_tf_idf": 0.20, "local_tf_idf": 0.40},
                   postings_list_size_limit=150,
                   store_positions=True,
+                  n_grams_from_positions=self.unigram_positions_only,
+                  **self.index_directories,
                   )
 
         self.limited_index: Index = \
             Index(descriptor="limited_text_index",
-                  max_n_gram=3,
+                  max_n_gram=1 if self.unigram_positions_only else self.max_n_grams,
                   sort_weights={"page_rank": 0.40, "global_tf_idf": 0.60, "local_tf_idf": 0.00},
                   postings_list_size_limit=200,
                   store_positions=True,
+                  n_grams_from_positions=self.unigram_positions_only,
+                  **self.index_directories,
                   )
 
         self.complete_index: Index = \
             Index(descriptor="all_text_index",
-                  max_n_gram=3,
+                  max_n_gram=min(2, self.max_n_grams) if self.unigram_positions_only else self.max_n_grams,
                   sort_weights={"page_rank": 0.40, "global_tf_idf": 0.60, "local_tf_idf": 0.00},
                   postings_list_size_limit=None,
                   store_positions=True,
+                  store_doc_id_lists=True,
+                  n_grams_from_positions=self.unigram_positions_only,
+                  max_n_gram_terms=TieredIndex.FREQUENT_PAIR_LIMIT if self.unigram_positions_only else None,
+                  **self.index_directories,
                   )
 
+        self._open_collection_indexes()
         return self
 
-    def __init__(self, max_n_grams: int, page_rank_iterations: int):
+    def _open_collection_indexes(self):
+        """
+        Opens the indexes besides the tiers, which a sharded index keeps for the whole collection while its shards
+        hold the tiers
+        """
+        self.fielded_index: Optional[FieldedIndex] = None
+        if self.fielded_postings:
+            self.fielded_index = \
+                FieldedIndex(max_n_gram=self.max_n_grams,
+                             sort_weights={"page_rank": 0.40, "global_tf_idf": 0.00, "local_tf_idf": 0.60},
+                             **self.index_directories,
+                             )
+
+        self.forward_index: ForwardIndex = ForwardIndex(self.index_directories["index_directory"])
+        self.autocomplete: Autocomplete = Autocomplete(self.index_directories["index_directory"], self.max_n_grams)
+        self.link_graph: LinkGraph = LinkGraph(self.index_directories["index_directory"],
+                                               self.index_directories["partial_index_directory"])
+        self.doc_table: DocTable = DocTable(self.index_directories["index_directory"])
+        self.head_queries: HeadQueries = HeadQueries(self.index_directories["index_directory"])
+
+    DOC_ID_ORDERINGS = ("url", "graph")
+
+    def __init__(self,
+                 max_n_grams: int,
+                 page_rank_iterations: int,
+                 doc_id_ordering: Optional[str] = None,
+                 data_directory: Optional[str] = None,
+                 unigram_positions_only: Optional[bool] = None,
+                 fielded_postings: Optional[bool] = None):
 
         self.processed_urls = set()
         self.parsed_html_hashes: {int} = {}
@@ -72,28 +131,65 @@ class TieredIndex:
         self.doc_id_to_url_LUT: {int: str} = {}
         self.url_to_doc_id_LUT: {str: int} = {}
         self.doc_id_counter = 0
+        self.doc_id_to_store_record: {int: int} = {}  # record number of each doc in the doc store, if built from one
+        self.doc_store_reader: Optional[DocStoreReader] = None
+        self.parsed_pages_log_open_object = None  # only open while parsing
 
         self.max_n_grams: int = max_n_grams
 
         self.page_rank_iterations = page_rank_iterations
-        self.doc_in_edges: {int: {int}} = {}
-        self.doc_out_edges: {int: {int}} = {}
+
+        # renumber docs after parsing so docs close together by url or links get close doc ids, None to keep
+        # the doc ids in the order the local store was parsed
+        assert doc_id_ordering is None or doc_id_ordering in TieredIndex.DOC_ID_ORDERINGS, \
+            f"Doc id ordering {doc_id_ordering} must be one of {TieredIndex.DOC_ID_ORDERINGS}"
+        self.doc_id_ordering: Optional[str] = doc_id_ordering
+
+        # the positional tiers hold only single words, and the complete index pairs of words found in the most
+        # docs, other n-grams are matched from the positions of their words when searched. None keeps the mode
+        # of the indexes last built
+        self.unigram_positions_only: bool = False
+
+        # a fielded index is built next to the tiers, with one posting per term and doc holding the term's frequency
+        # in every field the tiers split, scored with BM25F. None keeps the setting of the indexes last built
+        self.fielded_postings: bool = False
+
+        self.build_phase_timings: {str: float} = {}  # seconds spent in each phase of the last build
 
         self.local_store_path = Path(TieredIndex.local_store_dir)
         assert self.local_store_path.exists(), f"Local store path {TieredIndex.local_store_dir} does not exist"
         assert self.local_store_path.is_dir(), f"Local store path {TieredIndex.local_store_dir} not a directory"
-
-        self.settings_path: Path = Path(TieredIndex.settings_directory)
-        assert self.settings_path.exists(), f"Settings path {Index.settings_directory} does not exist"
-        assert self.settings_path.is_dir(), f"Settings path {Index.settings_directory} not a directory"
+        # pages are read from the doc store packed from the local store json files if there is one
+        self.doc_store_path: Path = self.local_store_path.joinpath(DocStore.file_name)
+
+        # the indexes and settings are kept in the class directories, or in sub directories of data_directory
+        # so several tiered indexes, like the shards of a sharded index, can be built side by side
+        self.index_directories: {str: Optional[str]} = {
+            "index_directory": None, "partial_index_directory": None, "settings_directory": None
+        }
+        if data_directory is not None:
+            self.index_directories = {
+                "index_directory": str(Path(data_directory).joinpath("Tiered_Indexes")),
+                "partial_index_directory": str(Path(data_directory).joinpath("Partial_Tiered_Indexes")),
+                "settings_directory": str(Path(data_directory).joinpath("Tiered_Indexes_Settings")),
+            }
+        self.settings_path: Path = Path(self.index_directories["settings_directory"] or TieredIndex.settings_directory)
+        assert self.settings_path.exists(), f"Settings path {self.settings_path} does not exist"
+        assert self.settings_path.is_dir(), f"Settings path {self.settings_path} not a directory"
 
         self.settings_file_name = f"Tiered_IndexBuilder_settings.json"
+        self.build_metrics: BuildMetrics = \
+            BuildMetrics(str(self.settings_path.joinpath(TieredIndex.build_metrics_file_name)))
         if Path(self.settings_path.joinpath(self.settings_file_name)).is_file():
             print(f"Found settings file, loading settings...", end="")
             self.__load_settings_from_json()
             print(f"Done")
         else:
             print(f"Did not find settings file")
+        if unigram_positions_only is not None:
+            self.unigram_positions_only = unigram_positions_only
+        if fielded_postings is not None:
+            self.fielded_postings = fielded_postings
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         print(f"\nPreparing to close tiered index builder...")
@@ -103,61 +199,114 @@ class TieredIndex:
         self.bold_index.__exit__(exc_type, exc_val, exc_tb)
         self.limited_index.__exit__(exc_type, exc_val, exc_tb)
         self.complete_index.__exit__(exc_type, exc_val, exc_tb)
+        self._close_collection_indexes(exc_type, exc_val, exc_tb)
         print(f"Closed tiered index builder.")
 
-    def build_tiered_indexes(self):
+    def _close_collection_indexes(self, exc_type, exc_val, exc_tb):
+        if self.fielded_index is not None:
+            self.fielded_index.__exit__(exc_type, exc_val, exc_tb)
+        self.forward_index.__exit__(exc_type, exc_val, exc_tb)
+        self.autocomplete.__exit__(exc_type, exc_val, exc_tb)
+        self.link_graph.__exit__(exc_type, exc_val, exc_tb)
+        self.doc_table.__exit__(exc_type, exc_val, exc_tb)
+        self.head_queries.__exit__(exc_type, exc_val, exc_tb)
+        if self.doc_store_reader is not None:
+            self.doc_store_reader.close()
+
+    def build_tiered_indexes(self, resume: bool = False):
+        """
+        Builds the tiered indexes from the local store, saving a checkpoint every CHECKPOINT_INTERVAL pages parsed
+        and after each stage of the build. If resume is set and an interrupted build left a checkpoint, the build
+        continues from it instead of starting over. The parsed docs are appended to the parsed pages log as the
+        pages are parsed, so a checkpoint only records the sizes of the files written so far
+        """
 
         print("-" * 120)
-        print(f"Starting to build index from local store data")
-        print(f"Clearing tiered indexes", end="")
-        self.title_index.prep_for_build()
-        print(f".", end="")
-        self.anchor_index.prep_for_build()
-        print(f".", end="")
-        self.header_index.prep_for_build()
-        print(f".", end="")
-        self.bold_index.prep_for_build()
-        print(f".", end="")
-        self.limited_index.prep_for_build()
-        print(f".", end="")
-        self.complete_index.prep_for_build()
-        print(f"Done\n")
+        self.head_queries.prep_for_build()
+        checkpoint = self.__load_checkpoint() if resume else None
+        if checkpoint is not None:
+            self.__restore_checkpoint(checkpoint)
+            print(f"Resuming build from checkpoint at stage {checkpoint['stage']}, "
+                  f"{checkpoint['pages_scanned']} pages of the local store parsed")
+        else:
+            print(f"Starting to build index from local store data")
+            print(f"Clearing tiered indexes", end="")
+            self.title_index.prep_for_build()
+            print(f".", end="")
+            self.anchor_index.prep_for_build()
+            print(f".", end="")
+            self.header_index.prep_for_build()
+            print(f".", end="")
+            self.bold_index.prep_for_build()
+            print(f".", end="")
+            self.limited_index.prep_for_build()
+            print(f".", end="")
+            self.complete_index.prep_for_build()
+            print(f".", end="")
+            if self.fielded_index is not None:
+                self.fielded_index.prep_for_build()
+                print(f".", end="")
+            self.forward_index.prep_for_build()
+            print(f"Done\n")
+
+            self.doc_id_counter = 0
+            self.url_to_doc_id_LUT.clear()
+            self.doc_id_to_url_LUT.clear()
+
+            self.processed_urls.clear()
+            self.parsed_html_hashes.clear()
+            self.doc_fingerprints.clear()
+            self.doc_id_to_store_record.clear()
+            self.parsed_pages_log_open_object = open(
+                self.settings_path.joinpath(TieredIndex.parsed_pages_log_file_name), mode="wb")
+
+            checkpoint = {
+                "stage": "parse",  # parse, anchor_links or merge, the stage the build continues from
+                "local_store_pages": self.local_store_page_count(),
+                "pages_scanned": 0,
+                "parsed_pages_log_size": 0,
+                "exact_duplicates_found": 0,
+                "near_duplicates_found": 0,
+                "doc_id_map": None,
+                "merged_indexes": [],
+            }
 
-        self.doc_id_counter = 0
-        self.doc_in_edges.clear()
-        self.doc_out_edges.clear()
-        self.url_to_doc_id_LUT.clear()
-        self.doc_id_to_url_LUT.clear()
+        exact_duplicates_found = checkpoint["exact_duplicates_found"]
+        near_duplicates_found = checkpoint["near_duplicates_found"]
 
-        self.processed_urls.clear()
-        self.parsed_html_hashes.clear()
-        self.doc_fingerprints.clear()
+        self.build_phase_timings.clear()
+        phase_start_time = time.perf_counter()
 
-        exact_duplicates_found = 0
-        near_duplicates_found = 0
+        self.build_metrics.start_build(checkpoint["local_store_pages"], self.all_indexes())
 
-        print(f"Starting to parse pages in local store")
-        for page_file in self.local_store_path.rglob("*.json"):  # iterate all json files in local store
-            # print(f"Opening json file: {page_file}")
+        if checkpoint["stage"] == "parse":
+            print(f"Starting to parse pages in local store")
+            for documents_scanned, (page_source, store_record, raw_url, content, encoding) in \
+                    enumerate(self.iter_local_store_pages(checkpoint["pages_scanned"]),
+                              start=checkpoint["pages_scanned"]):
+                self.build_metrics.count_documents(self.all_indexes(), documents_scanned, self.doc_id_counter,
+                                                   exact_duplicates_found, near_duplicates_found)
+                if documents_scanned > checkpoint["pages_scanned"] and \
+                        documents_scanned % TieredIndex.CHECKPOINT_INTERVAL == 0:
+                    checkpoint.update(pages_scanned=documents_scanned,
+                                      exact_duplicates_found=exact_duplicates_found,
+                                      near_duplicates_found=near_duplicates_found)
+                    self.__save_checkpoint(checkpoint)
+                # print(f"Opening json file: {page_source}")
 
-            # if self.doc_id_counter > 2500:
-            #     break
+                # if self.doc_id_counter > 2500:
+                #     break
 
-            with open(page_file, "r") as page_json:  # open and read the json file
-                data = json.load(page_json)  # load the json data using json.load
-                if type(data) is not dict or len(data) != 3:  # fields must be url, content and encoding
-                    print(f"Error parsing file {page_file}, json file must have url, content and encoding")
-                raw_url, content, encoding = data.values()
                 try:
                     url = urllib.parse.urldefrag(raw_url).url
                 except ValueError:
-                    print(f"Error parsing file {page_file}, url invalid format: {raw_url}")
+                    print(f"Error parsing file {page_source}, url invalid format: {raw_url}")
                     continue
 
                 if content is None or len(content) == 0:
-                    print(f"Error parsing file {page_file}, content empty")
+                    print(f"Error parsing file {page_source}, content empty")
                 if encoding is None or len(encoding) == 0:
-                    print(f"Error parsing file {page_file}, encoding not specified")
+                    print(f"Error parsing file {page_source}, encoding not specified")
 
                 if url in self.processed_urls:  # skip if url already processed
                     print(f"\nAlready parsed url: {url}, ", end="")
@@ -174,6 +323,7 @@ class TieredIndex:
                     print(f"\nDuplicate html content found between url: {url} "
                           f"and parsed url: {self.parsed_html_hashes[html_hash]}")
                     exact_duplicates_found += 1
+                    self.__log_parsed_page(documents_scanned, url)
                     continue
                 self.parsed_html_hashes[html_hash] = url
 
@@ -184,10 +334,14 @@ class TieredIndex:
                     print(f"\nNear duplicate content found between url: {url} "
                           f"and parsed url: {self.doc_id_to_url_LUT[doc_id]}")
                     near_duplicates_found += 1
+                    self.__log_parsed_page(documents_scanned, url, html_hash)
                     continue
 
                 doc_id = self.__add_doc(url)
                 self.doc_fingerprints[doc_id] = doc_simhash
+                if store_record is not None:
+                    self.doc_id_to_store_record[doc_id] = store_record
+                self.__log_parsed_page(documents_scanned, url, html_hash, doc_id, doc_simhash, store_record)
 
                 print(f"\rParsing doc_id: {doc_id}, url: {url}", end="")
 
@@ -198,50 +352,147 @@ class TieredIndex:
                     self.title_index.add_term(term=title_term, doc_id=doc_id, positions=positions)
 
                 for header_term, positions in page_token_dict["header"].items():
-                    self.header_index.add_term(term=header_term, doc_id=doc_id, positions=positions)
+                    if header_term.count(" ") < self.header_index.max_n_grams:
+                        self.header_index.add_term(term=header_term, doc_id=doc_id, positions=positions)
 
                 for bold_term, positions in page_token_dict["bold"].items():
-                    self.bold_index.add_term(term=bold_term, doc_id=doc_id, positions=positions)
+                    if bold_term.count(" ") < self.bold_index.max_n_grams:
+                        self.bold_index.add_term(term=bold_term, doc_id=doc_id, positions=positions)
 
+                # the limited index holds the leading postings of the complete index, derived from it once merged
                 for term, positions in page_token_dict["text"].items():
-                    self.limited_index.add_term(term=term, doc_id=doc_id, positions=positions)
-                    self.complete_index.add_term(term=term, doc_id=doc_id, positions=positions)
-
-        print()
-        print(f"Finished parsing {doc_id} documents")
+                    if term.count(" ") < self.complete_index.max_n_grams:
+                        self.complete_index.add_term(term=term, doc_id=doc_id, positions=positions)
+
+                if self.fielded_index is not None:
+                    self.fielded_index.add_document_fields(doc_id, {
+                        field: {term: len(positions) for term, positions in page_token_dict[tokens].items()
+                                if term.count(" ") < self.fielded_index.max_n_grams}
+                        for field, tokens in (("title", "title"), ("header", "header"),
+                                              ("bold", "bold"), ("text", "text"))
+                    })
+
+                self.forward_index.add_document(doc_id, page_token_dict["title_words"], page_token_dict["words"])
+
+            print()
+            print(f"Finished parsing {self.doc_id_counter} documents")
+
+            self.build_metrics.count_documents(self.all_indexes(), self.build_metrics.total_documents,
+                                               self.doc_id_counter, exact_duplicates_found, near_duplicates_found)
+            phase_start_time = self.__record_build_phase("parse", phase_start_time)
+            # the postings left in memory are dumped when merging anyway, dumping them now lets the next stages
+            # continue from their checkpoints
+            for index in self.all_indexes():
+                index.finish_parse()
+            checkpoint.update(stage="anchor_links",
+                              pages_scanned=self.build_metrics.total_documents,
+                              exact_duplicates_found=exact_duplicates_found,
+                              near_duplicates_found=near_duplicates_found)
+            self.__save_checkpoint(checkpoint)
+            self.parsed_pages_log_open_object.close()
+            self.parsed_pages_log_open_object = None
 
         print(f"Starting to compute PageRank and initialize anchor index.", end="")
-        self.doc_in_edges, self.doc_out_edges = self.build_anchor_index_and_get_page_directed_edges()
-        print(".", end="")
-        doc_id_page_rankings: [int] = \
-            self.compute_page_rank(self.doc_in_edges, self.doc_out_edges, self.page_rank_iterations)
+        if checkpoint["stage"] == "anchor_links":
+            self.build_metrics.start_phase("anchor_links", self.all_indexes())
+            self.link_graph.prep_for_build()
+            self.build_anchor_index_and_link_graph()
+            self.link_graph.finish_build(self.doc_id_counter)
+            phase_start_time = self.__record_build_phase("anchor_links", phase_start_time)
+            print(".", end="")
+
+            doc_id_map = None
+            if self.doc_id_ordering is not None:
+                self.build_metrics.start_phase("doc_id_ordering", self.all_indexes())
+                doc_id_map = self.compute_doc_id_map(self.doc_id_ordering)
+                self.reassign_doc_ids(doc_id_map)
+                phase_start_time = self.__record_build_phase("doc_id_ordering", phase_start_time)
+                print(".", end="")
+            self.forward_index.finish_build(doc_id_map)
+            self.anchor_index.dump_partial_index()
+            if self.fielded_index is not None:
+                self.fielded_index.dump_partial_index()
+            checkpoint.update(stage="merge", doc_id_map=doc_id_map)
+            self.__save_checkpoint(checkpoint)
+        doc_id_map: Optional[List[int]] = checkpoint["doc_id_map"]
+
+        self.build_metrics.start_phase("page_rank", self.all_indexes())
+        doc_id_page_rankings: [int] = self.compute_page_rank(self.link_graph, self.page_rank_iterations)
+        phase_start_time = self.__record_build_phase("page_rank", phase_start_time)
         print(f"Done\n")
 
-        print(f"Merging full index to get global tf-idf scores...")
-        self.complete_index.merge_index(doc_count=self.doc_id_counter,
-                                        complete_index=None,
-                                        doc_page_rankings=doc_id_page_rankings)
-        print(f"Done\n")
+        if self.complete_index.descriptor not in checkpoint["merged_indexes"]:
+            print(f"Merging full index to get global tf-idf scores...")
+            self.build_metrics.start_phase(f"merge_{self.complete_index.descriptor}", self.all_indexes())
+            self.complete_index.merge_index(doc_count=self.doc_id_counter,
+                                            complete_index=None,
+                                            doc_page_rankings=doc_id_page_rankings,
+                                            doc_id_map=doc_id_map,
+                                            progress_callback=self.build_metrics.merge_progress)
+            self.build_metrics.merge_finished(self.complete_index)
+            phase_start_time = self.__record_build_phase(f"merge_{self.complete_index.descriptor}", phase_start_time)
+            print(f"Done, doc id lists take {self.complete_index.doc_id_gap_bytes} bytes as gamma coded gaps\n")
+
+            print(f"Building autocomplete from the terms of the full index...", end="")
+            self.autocomplete.build(self.complete_index.document_term_counts)
+            phase_start_time = self.__record_build_phase("autocomplete", phase_start_time)
+            print(f"Done, {len(self.autocomplete)} terms\n")
+            checkpoint["merged_indexes"].append(self.complete_index.descriptor)
+            self.__save_checkpoint(checkpoint)
 
         print(f"Starting to merge tiered indexes")
-        print(f"Merging title index...", end="")
-        self.title_index.merge_index(self.doc_id_counter, self.complete_index, doc_id_page_rankings)
-        print(f"Done")
-        print(f"Merging anchor index...", end="")
-        self.anchor_index.merge_index(self.doc_id_counter, None, doc_id_page_rankings)
-        print(f"Done")
-        print(f"Merging header index...", end="")
-        self.header_index.merge_index(self.doc_id_counter, self.complete_index, doc_id_page_rankings)
-        print(f"Done")
-        print(f"Merging bold index...", end="")
-        self.bold_index.merge_index(self.doc_id_counter, self.complete_index, doc_id_page_rankings)
+        for index, complete_index, index_name in ((self.title_index, self.complete_index, "title"),
+                                                  (self.anchor_index, None, "anchor"),
+                                                  (self.header_index, self.complete_index, "header"),
+                                                  (self.bold_index, self.complete_index, "bold")):
+            if index.descriptor in checkpoint["merged_indexes"]:
+                print(f"Skipping {index_name} index, merged before the build was resumed")
+                continue
+            print(f"Merging {index_name} index...", end="")
+            self.build_metrics.start_phase(f"merge_{index.descriptor}", self.all_indexes())
+            index.merge_index(self.doc_id_counter, complete_index, doc_id_page_rankings, doc_id_map,
+                              self.build_metrics.merge_progress)
+            self.build_metrics.merge_finished(index)
+            phase_start_time = self.__record_build_phase(f"merge_{index.descriptor}", phase_start_time)
+            checkpoint["merged_indexes"].append(index.descriptor)
+            self.__save_checkpoint(checkpoint)
+            print(f"Done")
+
+        if self.limited_index.descriptor not in checkpoint["merged_indexes"]:
+            print(f"Deriving limited index from the full index...", end="")
+            self.build_metrics.start_phase(f"merge_{self.limited_index.descriptor}", self.all_indexes())
+            self.limited_index.retier(self.complete_index, progress_callback=self.build_metrics.merge_progress)
+            self.build_metrics.merge_finished(self.limited_index)
+            phase_start_time = self.__record_build_phase(f"merge_{self.limited_index.descriptor}", phase_start_time)
+            checkpoint["merged_indexes"].append(self.limited_index.descriptor)
+            self.__save_checkpoint(checkpoint)
+            print(f"Done")
+
+        if self.fielded_index is not None and self.fielded_index.descriptor not in checkpoint["merged_indexes"]:
+            print(f"Merging fielded index...", end="")
+            self.build_metrics.start_phase(f"merge_{self.fielded_index.descriptor}", self.all_indexes())
+            # the doc lengths are read with the doc ids of the finished forward index, which the merge renumbers to
+            self.fielded_index.set_doc_lengths(self.forward_index, self.doc_id_counter)
+            self.fielded_index.merge_index(self.doc_id_counter, None, doc_id_page_rankings, doc_id_map,
+                                           self.build_metrics.merge_progress)
+            self.build_metrics.merge_finished(self.fielded_index)
+            phase_start_time = self.__record_build_phase(f"merge_{self.fielded_index.descriptor}", phase_start_time)
+            checkpoint["merged_indexes"].append(self.fielded_index.descriptor)
+            self.__save_checkpoint(checkpoint)
+            print(f"Done")
+        print()
+
+        # spills happen while parsing and building the anchor index, so this overlaps with those phases
+        self.build_phase_timings["spill"] = sum(index.spill_seconds for index in self.all_indexes())
+
+        self.build_metrics.finish_build(self.all_indexes())
+
+        print(f"Writing doc table...", end="")
+        self.save_doc_table()
         print(f"Done")
-        print(f"Merging limited index...", end="")
-        self.limited_index.merge_index(self.doc_id_counter, self.complete_index, doc_id_page_rankings)
-        print(f"Done\n")
 
         print(f"saving current options to json...", end="")
-        self.__save_settings_to_json()
+        self.save_settings()
         print(f"Done\n")
 
         print(f"Done Building all Tiered Indexes. "
@@ -249,17 +500,134 @@ class TieredIndex:
               f"{near_duplicates_found} near duplicate documents")
 
         print(f"Saving settings to file...", end="")
-        self.__save_settings_to_json()
+        self.save_settings()
+        self.settings_path.joinpath(TieredIndex.checkpoint_file_name).unlink(missing_ok=True)
+        self.settings_path.joinpath(TieredIndex.parsed_pages_log_file_name).unlink(missing_ok=True)
         print(f"Done")
 
         print("-" * 120)
 
+    def retier_indexes(self, descriptors: Optional[List[str]] = None, recompute_page_rank: bool = False):
+        """
+        Rewrites the merged tiers with the sort weights and posting list size limits they are opened with now,
+        without parsing the local store: the limited index from the complete index and the others from their own
+        postings, which a tier merged with a lower limit holds no more of. Only the tiers of the descriptors given
+        are rewritten, all of them if None. If recompute_page_rank is set every tier is rewritten with the PageRank
+        computed again from the link graph with page_rank_iterations
+        """
+        print("-" * 120)
+        retier_start_time = time.perf_counter()
+        retiered_indexes = [index for index in self.all_indexes()
+                            if recompute_page_rank or descriptors is None or index.descriptor in descriptors]
+        # the complete index goes first, since the limited index is derived from it
+        retiered_indexes.sort(key=lambda x: x is not self.complete_index)
+
+        doc_id_page_rankings: Optional[List[float]] = None
+        if recompute_page_rank:
+            print(f"Computing PageRank with {self.page_rank_iterations} iterations...", end="")
+            doc_id_page_rankings = self.compute_page_rank(self.link_graph, self.page_rank_iterations)
+            print(f"Done")
+
+        for index in retiered_indexes:
+            print(f"Re-tiering {index.descriptor}...", end="")
+            index.retier(self.complete_index if index is self.limited_index else None, doc_id_page_rankings)
+            print(f"Done, {len(index.document_term_counts)} terms in {index.merge_stats['seconds']:.1f}s")
+
+        # the results precomputed for the head queries came from the tiers before
+        self.head_queries.prep_for_build()
+        print(f"Re-tiered {len(retiered_indexes)} indexes in {time.perf_counter() - retier_start_time:.1f}s, "
+              f"precompute the head queries again if they were")
+        print("-" * 120)
+
+    def set_query_counts(self, query_counts: {str: int}):
+        """
+        Sets the number of times each query was logged, so the next build or re-tiering writes the posting lists of
+        the terms queried most first in every index, where warm_up reads them into the page cache
+        """
+        term_query_counts: {str: int} = {}
+        for query, count in query_counts.items():
+            for term in Tokenizer.tokenize_query(query, self.max_n_grams):
+                term_query_counts[term] = term_query_counts.get(term, 0) + count
+        for index in self.all_indexes():
+            index.term_query_counts = term_query_counts
+
+    def warm_up(self, budget_bytes: int = WARM_UP_BUDGET) -> int:
+        """
+        Reads the posting lists of the terms queried most into the page cache, up to budget_bytes over all the
+        indexes, the tiers searched first taking their share first. Returns the bytes read ahead
+        """
+        warm_up_start_time = time.perf_counter()
+        warmed_bytes = 0
+        for index in self.all_indexes():
+            warmed_bytes += index.warm_up(budget_bytes - warmed_bytes)
+        print(f"Read {warmed_bytes / (1 << 20):.1f} MB of the indexes ahead into the page cache "
+              f"in {time.perf_counter() - warm_up_start_time:.2f}s")
+        return warmed_bytes
+
+    def phrase_cache_stats(self) -> {str: int}:
+        """Hits and misses of the caches of the n-grams matched from positions, over all the indexes"""
+        return {counter: sum(index.phrase_cache_stats[counter] for index in self.all_indexes())
+                for counter in ("hits", "misses")}
+
+    def all_indexes(self) -> [Index]:
+        indexes = [self.title_index, self.anchor_index, self.header_index,
+                   self.bold_index, self.limited_index, self.complete_index]
+        if self.fielded_index is not None:
+            indexes.append(self.fielded_index)
+        return indexes
+
+    def __record_build_phase(self, phase: str, phase_start_time: float) -> float:
+        """Records the time spent in the build phase that started at phase_start_time and returns the time now"""
+        phase_end_time = time.perf_counter()
+        self.build_phase_timings[phase] = phase_end_time - phase_start_time
+        return phase_end_time
+
     def __add_doc(self, url) -> int:
         self.doc_id_to_url_LUT[self.doc_id_counter] = url
         self.url_to_doc_id_LUT[url] = self.doc_id_counter
         self.doc_id_counter += 1
         return self.doc_id_counter - 1
 
+    def local_store_page_count(self) -> int:
+        if self.doc_store_path.is_file():
+            with DocStoreReader(str(self.doc_store_path)) as doc_store_reader:
+                return len(doc_store_reader)
+        return sum(1 for _ in self.local_store_path.rglob("*.json"))
+
+    def iter_local_store_pages(self, skip_pages: int = 0) -> Iterator[Tuple[str, Optional[int], str, str, str]]:
+        """
+        Yields the source, doc store record number, url, content and encoding of each page in the local store,
+        sequentially from the doc store if the local store was packed, otherwise from all its json files.
+        The first skip_pages pages are skipped, so a resumed build continues after the pages it already parsed
+        """
+        if self.doc_store_path.is_file():
+            with DocStoreReader(str(self.doc_store_path)) as doc_store_reader:
+                for store_record, (raw_url, content, encoding) in \
+                        enumerate(doc_store_reader.iter_pages(skip_pages), start=skip_pages):
+                    yield f"{self.doc_store_path} record {store_record}", store_record, raw_url, content, encoding
+            return
+
+        pages_read = 0
+        for page_file in self.local_store_path.rglob("*.json"):  # iterate all json files in local store
+            with open(page_file, "r") as page_json:  # open and read the json file
+                data = json.load(page_json)  # load the json data using json.load
+            if type(data) is not dict or len(data) != 3:  # fields must be url, content and encoding
+                print(f"Error parsing file {page_file}, json file must have url, content and encoding")
+                continue
+            pages_read += 1
+            if pages_read <= skip_pages:
+                continue
+            raw_url, content, encoding = data.values()
+            yield str(page_file), None, raw_url, content, encoding
+
+    def get_document(self, doc_id: int) -> Optional[Tuple[str, str, str]]:
+        """Url, content and encoding of the doc read from the doc store, None if the index was not built from one"""
+        if doc_id not in self.doc_id_to_store_record or not self.doc_store_path.is_file():
+            return None
+        if self.doc_store_reader is None:
+            self.doc_store_reader = DocStoreReader(str(self.doc_store_path))
+        return self.doc_store_reader.get_page(self.doc_id_to_store_record[doc_id])
+
     def find_near_duplicate_doc(self, doc_simhash: int):
 
         for doc_id, simhash in self.doc_fingerprints.items():
@@ -270,96 +638,251 @@ class TieredIndex:
                 return doc_id
         return None
 
-    def build_anchor_index_and_get_page_directed_edges(self):
+    def build_anchor_index_and_link_graph(self):
+        """Adds the anchor text of the links between parsed docs to the anchor index and the links to the link graph"""
 
         url_anchor_text_dict: {int: {str: int}} = {}
-        doc_out_edges: {int: {int}} = {}
-        doc_in_edges: {int: {int}} = {}
-
-        for page_file in self.local_store_path.rglob("*.json"):  # iterate all json files in local store
-            # print(f"Opening json file: {page_file}")
-            with open(page_file, "r") as page_json:  # open and read the json file
 
-                data = json.load(page_json)
-                raw_url, content, encoding = data.values()
-                try:
-                    url = urllib.parse.urldefrag(raw_url).url
-                except ValueError:
-                    print(f"Error parsing file {page_file}, url invalid format: {raw_url}")
-                    continue
+        for page_source, _, raw_url, content, encoding in self.iter_local_store_pages():
+            try:
+                url = urllib.parse.urldefrag(raw_url).url
+            except ValueError:
+                print(f"Error parsing file {page_source}, url invalid format: {raw_url}")
+                continue
 
-                if url not in self.url_to_doc_id_LUT:
-                    continue
+            if url not in self.url_to_doc_id_LUT:
+                continue
 
-                doc_id = self.url_to_doc_id_LUT[url]
+            doc_id = self.url_to_doc_id_LUT[url]
 
-                page_links_dict = Tokenizer.get_page_links(content, self.anchor_index.max_n_grams)
+            page_links_dict = Tokenizer.get_page_links(content, self.anchor_index.max_n_grams)
 
-                for target_link, term_frequency_dict in page_links_dict.items():
-                    try:
-                        target_url = urllib.parse.urldefrag(target_link).url
+            for target_link, term_frequency_dict in page_links_dict.items():
+                try:
+                    target_url = urllib.parse.urldefrag(target_link).url
 
-                    except ValueError:
-                        continue
+                except ValueError:
+                    continue
 
-                    if target_url not in self.url_to_doc_id_LUT:
-                        continue
+                if target_url not in self.url_to_doc_id_LUT:
+                    continue
 
-                    target_doc_id = self.url_to_doc_id_LUT[target_url]
+                target_doc_id = self.url_to_doc_id_LUT[target_url]
 
-                    doc_in_edges.setdefault(target_doc_id, set())
-                    doc_in_edges[target_doc_id].add(doc_id)
-                    doc_out_edges.setdefault(doc_id, set())
-                    doc_out_edges[doc_id].add(target_doc_id)
+                self.link_graph.add_link(doc_id, target_doc_id)
 
-                    for term, count in term_frequency_dict.items():
-                        url_anchor_text_dict.setdefault(target_doc_id, {})
-                        url_anchor_text_dict[target_doc_id].setdefault(term, 0)
-                        url_anchor_text_dict[target_doc_id][term] += 1
+                for term, count in term_frequency_dict.items():
+                    url_anchor_text_dict.setdefault(target_doc_id, {})
+                    url_anchor_text_dict[target_doc_id].setdefault(term, 0)
+                    url_anchor_text_dict[target_doc_id][term] += 1
 
         for target_doc_id, term_frequency_dict in url_anchor_text_dict.items():
             for term, count in term_frequency_dict.items():
                 self.anchor_index.add_term(term, target_doc_id, [None] * count)
-
-        return doc_in_edges, doc_out_edges
-
-    def compute_page_rank(self, doc_in_edges: {int: {int}}, doc_out_edges: {int: {int}}, iterations: int) -> [int]:
+            if self.fielded_index is not None:
+                self.fielded_index.add_document_fields(target_doc_id, {"anchor": term_frequency_dict})
+
+    def compute_doc_id_map(self, doc_id_ordering: str) -> [int]:
+        """
+        Computes new doc ids for the parsed docs, returning the new doc id at each old doc id.
+        "url" orders docs by host, with its labels reversed so subdomains sit together, then by path.
+        "graph" walks the link graph breadth first from the docs in url order, so linked docs sit together
+        """
+        def url_key(doc_id):
+            parsed_url = urllib.parse.urlsplit(self.doc_id_to_url_LUT[doc_id])
+            return list(reversed(parsed_url.hostname.split("."))) if parsed_url.hostname else [], \
+                parsed_url.path, parsed_url.query
+
+        url_ordered_doc_ids = sorted(range(self.doc_id_counter), key=url_key)
+        if doc_id_ordering == "url":
+            ordered_doc_ids = url_ordered_doc_ids
+        else:
+            url_ranks = {doc_id: rank for rank, doc_id in enumerate(url_ordered_doc_ids)}
+            ordered_doc_ids = []
+            visited = set()
+            for start_doc_id in url_ordered_doc_ids:
+                if start_doc_id in visited:
+                    continue
+                visited.add(start_doc_id)
+                queue = deque([start_doc_id])
+                while len(queue) > 0:
+                    doc_id = queue.popleft()
+                    ordered_doc_ids.append(doc_id)
+                    linked_doc_ids = set(self.link_graph.out_links(doc_id)) | set(self.link_graph.in_links(doc_id))
+                    for linked_doc_id in sorted(linked_doc_ids - visited, key=lambda x: url_ranks[x]):
+                        visited.add(linked_doc_id)
+                        queue.append(linked_doc_id)
+
+        doc_id_map = [0] * self.doc_id_counter
+        for new_doc_id, old_doc_id in enumerate(ordered_doc_ids):
+            doc_id_map[old_doc_id] = new_doc_id
+        return doc_id_map
+
+    def reassign_doc_ids(self, doc_id_map: [int]):
+        """
+        Renumbers the docs in the url LUTs, link graph and fingerprints with the new doc id at each old doc id.
+        The postings in the partial index files are renumbered with the same map when the indexes are merged
+        """
+        self.__renumber_parsed_docs(doc_id_map)
+        self.link_graph.renumber(doc_id_map)
+
+    def __renumber_parsed_docs(self, doc_id_map: [int]):
+        self.doc_id_to_url_LUT = {doc_id_map[doc_id]: url for doc_id, url in self.doc_id_to_url_LUT.items()}
+        self.url_to_doc_id_LUT = {url: doc_id_map[doc_id] for url, doc_id in self.url_to_doc_id_LUT.items()}
+        self.doc_fingerprints = {doc_id_map[doc_id]: simhash for doc_id, simhash in self.doc_fingerprints.items()}
+        self.doc_id_to_store_record = {doc_id_map[doc_id]: store_record
+                                       for doc_id, store_record in self.doc_id_to_store_record.items()}
+
+    def compute_page_rank(self, link_graph: LinkGraph, iterations: int) -> [int]:
 
         d = 0.85
         page_rank_values: [float] = [1.0 for _ in range(self.doc_id_counter)]
 
         for _ in range(iterations):
             for doc_id in range(self.doc_id_counter):
-                if doc_id not in doc_in_edges:
+                if link_graph.in_degree(doc_id) == 0:
                     continue
 
                 page_rank_values[doc_id] = \
-                    (1 - d) + d * sum(1 / len(doc_out_edges[target_doc_id])
-                                      for target_doc_id in doc_in_edges[doc_id])
+                    (1 - d) + d * sum(1 / link_graph.out_degree(source_doc_id)
+                                      for source_doc_id in link_graph.in_links(doc_id))
 
         return page_rank_values
 
+    def save_doc_table(self):
+        """Writes the urls of the parsed docs to the doc table, which serves the url lookups once the build is done"""
+        self.doc_table.build(self.doc_id_to_url_LUT, self.doc_id_counter)
+        self.doc_id_to_url_LUT.clear()
+        self.url_to_doc_id_LUT.clear()
+
+    def save_settings(self):
+        self.__save_settings_to_json()
+
+    def __load_checkpoint(self) -> Optional[dict]:
+        """The checkpoint of an interrupted build, None if there is none or the local store changed since"""
+        checkpoint_path = self.settings_path.joinpath(TieredIndex.checkpoint_file_name)
+        if not checkpoint_path.is_file():
+            print(f"Did not find a build checkpoint, starting the build over")
+            return None
+        with open(checkpoint_path, mode="r") as f:
+            checkpoint = json.load(f)
+        if checkpoint["local_store_pages"] != self.local_store_page_count():
+            print(f"Local store changed since the build checkpoint, starting the build over")
+            return None
+        return checkpoint
+
+    def __save_checkpoint(self, checkpoint: dict):
+        """
+        Saves the build progress in checkpoint with the sizes of the parsed pages log and forward index written so
+        far and the partial index files each index has dumped, without dumping the postings held in memory
+        """
+        if self.parsed_pages_log_open_object is not None:
+            self.parsed_pages_log_open_object.flush()
+            checkpoint["parsed_pages_log_size"] = self.parsed_pages_log_open_object.tell()
+        checkpoint_data = dict(checkpoint)
+        checkpoint_data.update({
+            "doc_id_counter": self.doc_id_counter,
+            "partial_index_files": {index.descriptor: index.checkpoint(self.doc_id_counter)
+                                    for index in self.all_indexes()},
+            # the forward index is finished before merging
+            "forward_index": self.forward_index.checkpoint() if checkpoint["stage"] != "merge" else None,
+        })
+        with publish_file(self.settings_path.joinpath(TieredIndex.checkpoint_file_name)) as f:
+            json.dump(checkpoint_data, f)
+
+    def __restore_checkpoint(self, checkpoint: dict):
+        """
+        Restores the partial index files of every index and the parsed docs of the parsed pages log. While parsing,
+        the build continues from the first doc not dumped by every index, parsing its page and the ones after it
+        again, and each index ignores the postings of the docs it restored
+        """
+        parsing = checkpoint["stage"] == "parse"
+        doc_count = checkpoint["doc_id_counter"]
+        if parsing:
+            doc_count = min([doc_count] + [index_checkpoint["doc_count"]
+                                           for index_checkpoint in checkpoint["partial_index_files"].values()])
+
+        for index in self.all_indexes():
+            index.restore_checkpoint(checkpoint["partial_index_files"][index.descriptor], skip_restored_docs=parsing)
+        if checkpoint["forward_index"] is not None:
+            self.forward_index.restore_checkpoint(checkpoint["forward_index"], doc_count)
+
+        self.__replay_parsed_pages_log(checkpoint, doc_count)
+        if parsing:
+            self.parsed_pages_log_open_object = open(
+                self.settings_path.joinpath(TieredIndex.parsed_pages_log_file_name), mode="ab")
+        if checkpoint["doc_id_map"] is not None:
+            self.__renumber_parsed_docs(checkpoint["doc_id_map"])
+
+    def __log_parsed_page(self, page: int, url: str, html_hash: Optional[int] = None, doc_id: Optional[int] = None,
+                          doc_simhash: Optional[int] = None, store_record: Optional[int] = None):
+        """
+        Appends the page's url, html hash and doc to the parsed pages log, the html hash is None for an exact
+        duplicate and the doc None for a near duplicate
+        """
+        self.parsed_pages_log_open_object.write(
+            f"{json.dumps([page, url, html_hash, doc_id, doc_simhash, store_record])}\n".encode("ascii"))
+
+    def __replay_parsed_pages_log(self, checkpoint: dict, doc_count: int):
+        """
+        Restores the parsed docs from the parsed pages log of the checkpoint, up to the page adding doc doc_count,
+        truncating the log before it. The checkpoint is updated to continue parsing from that page
+        """
+        self.doc_id_counter = 0
+        self.url_to_doc_id_LUT.clear()
+        self.doc_id_to_url_LUT.clear()
+        self.processed_urls.clear()
+        self.parsed_html_hashes.clear()
+        self.doc_fingerprints.clear()
+        self.doc_id_to_store_record.clear()
+
+        exact_duplicates_found = 0
+        near_duplicates_found = 0
+        log_size = 0
+        with open(self.settings_path.joinpath(TieredIndex.parsed_pages_log_file_name), mode="r+b") as f:
+            f.truncate(checkpoint["parsed_pages_log_size"])
+            for line in f:
+                page, url, html_hash, doc_id, doc_simhash, store_record = json.loads(line)
+                if doc_id is not None and doc_id >= doc_count:
+                    checkpoint["pages_scanned"] = page
+                    break
+                log_size += len(line)
+
+                self.processed_urls.add(url)
+                if html_hash is None:
+                    exact_duplicates_found += 1
+                    continue
+                self.parsed_html_hashes[html_hash] = url
+                if doc_id is None:
+                    near_duplicates_found += 1
+                    continue
+                assert self.__add_doc(url) == doc_id, f"Parsed pages log out of order at page {page}"
+                self.doc_fingerprints[doc_id] = doc_simhash
+                if store_record is not None:
+                    self.doc_id_to_store_record[doc_id] = store_record
+            f.truncate(log_size)
+
+        checkpoint.update(parsed_pages_log_size=log_size,
+                          exact_duplicates_found=exact_duplicates_found,
+                          near_duplicates_found=near_duplicates_found)
+
     def __load_settings_from_json(self):
         with open(Path(self.settings_path.joinpath(self.settings_file_name)), mode="r") as f:
             data_dict = json.load(f)
 
             self.doc_id_counter = data_dict["doc_id_counter"]
-            self.url_to_doc_id_LUT = data_dict["url_to_doc_id_LUT"]
-            self.doc_id_to_url_LUT = {int(k): v for k, v in data_dict["doc_id_to_url_LUT"].items()}
-
-            self.doc_in_edges = {int(k): set(v) for k, v in data_dict["doc_in_edges"].items()}
-            self.doc_out_edges = {int(k): set(v) for k, v in data_dict["doc_out_edges"].items()}
+            self.unigram_positions_only = data_dict.get("unigram_positions_only", False)
+            self.fielded_postings = data_dict.get("fielded_postings", False)
+            self.doc_id_to_store_record = {int(k): v for k, v in data_dict.get("doc_id_to_store_record", {}).items()}
 
     def __save_settings_to_json(self):
-        with open(Path(self.settings_path.joinpath(self.settings_file_name)), mode="w") as f:
+        with publish_file(self.settings_path.joinpath(self.settings_file_name)) as f:
             json_dict = {
 
                 "doc_id_counter": self.doc_id_counter,
-                "url_to_doc_id_LUT": self.url_to_doc_id_LUT,
-                "doc_id_to_url_LUT": self.doc_id_to_url_LUT,
-
-                "doc_in_edges": {str(k): list(v) for k, v in self.doc_in_edges.items()},
-                "doc_out_edges": {str(k): list(v) for k, v in self.doc_out_edges.items()},
+                "unigram_positions_only": self.unigram_positions_only,
+                "fielded_postings": self.fielded_postings,
+                "doc_id_to_store_record": self.doc_id_to_store_record,
 
             }
 
@@ -367,4 +890,4 @@ class TieredIndex:
 
 
 def crc_hash(content):
-    return hash(content)
+    return stable_hash((content or "").encode("utf-8", errors="surrogatepass"))
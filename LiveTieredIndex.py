@@ -0,0 +1,148 @@
+import threading
+import time
+from typing import Optional, IO
+
+from Indexer.IndexGenerations import IndexGenerations
+from Indexer.TieredIndex import TieredIndex
+from Scorer import Scorer
+
+
+class OpenGeneration:
+    """A generation opened for searching, counting the searches still using it so it is closed after the last"""
+
+    def __init__(self, live_tiered_index: 'LiveTieredIndex', generation: str, tiered_index: TieredIndex,
+                 lease_file: IO):
+        self.live_tiered_index: LiveTieredIndex = live_tiered_index
+        self.generation: str = generation
+        self.tiered_index: TieredIndex = tiered_index
+        self.lease_file: IO = lease_file  # lease on the generation, held until it is closed
+        self.references: int = 0
+        self.retired: bool = False  # set once a newer generation replaced it
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.live_tiered_index.release(self)
+
+    def new_scorer(self, **scorer_arguments) -> Scorer:
+        """
+        A scorer of this generation. A scorer reads the index files of the generation it was made with and keeps
+        the search it continues, so a scorer is made for each acquired generation and never used past its release
+        """
+        return Scorer(self.tiered_index, **scorer_arguments)
+
+
+class LiveTieredIndex:
+    """
+    Searches the current generation of the index generations, switching to a newly published generation without
+    a restart. A search acquires the open generation and releases it when done, so a search, and the next pages
+    of its results, keep using the generation they started with. A replaced generation is closed once the last
+    search using it releases it, and reclaimed unless another process still holds it. A newly published generation
+    is opened in the background, searches acquire the open generation meanwhile
+    """
+
+    def __init__(self,
+                 index_generations: IndexGenerations,
+                 max_n_grams: int,
+                 page_rank_iterations: int,
+                 refresh_interval_seconds: float = 1.0):
+        self.index_generations: IndexGenerations = index_generations
+        self.max_n_grams: int = max_n_grams
+        self.page_rank_iterations: int = page_rank_iterations
+        self.refresh_interval_seconds: float = refresh_interval_seconds  # time between checks of CURRENT
+
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()  # held while opening a generation so it is only opened once
+        self.refresh_thread: Optional[threading.Thread] = None  # the last background refresh
+        self.open_generation: Optional[OpenGeneration] = None
+        self.last_refresh_time: float = 0.0
+        self.refresh()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def refresh(self) -> bool:
+        """Opens the current generation if it was published since the last refresh, returns whether it switched"""
+        with self.refresh_lock:
+            return self.__refresh()
+
+    def __refresh_in_background(self):
+        try:
+            self.__refresh()
+        finally:
+            self.refresh_lock.release()
+
+    def __refresh(self) -> bool:
+        self.last_refresh_time = time.monotonic()
+        generation = self.index_generations.current_generation()
+        if generation is None or \
+                (self.open_generation is not None and self.open_generation.generation == generation):
+            return False
+
+        lease_file = self.index_generations.lease(generation)
+        if lease_file is None:  # replaced and reclaimed since CURRENT was read, the next refresh reads it again
+            return False
+
+        # open the new generation before switching, searches keep using the old one meanwhile
+        tiered_index = TieredIndex(self.max_n_grams, self.page_rank_iterations,
+                                   data_directory=self.index_generations.generation_directory(generation))
+        new_generation = OpenGeneration(self, generation, tiered_index.__enter__(), lease_file)
+
+        with self.lock:
+            old_generation = self.open_generation
+            self.open_generation = new_generation
+        if old_generation is not None:
+            self.__retire(old_generation)
+        print(f"Switched to index generation {generation}")
+        return True
+
+    def acquire(self) -> OpenGeneration:
+        """
+        The current generation for a search, to release with release or by using it as a context manager. Once the
+        refresh interval passed a thread is started to check for a new generation, without waiting on it
+        """
+        if self.open_generation is None:  # nothing to search until the first generation is opened
+            self.refresh()
+        elif time.monotonic() - self.last_refresh_time >= self.refresh_interval_seconds and \
+                self.refresh_lock.acquire(blocking=False):
+            self.last_refresh_time = time.monotonic()
+            self.refresh_thread = threading.Thread(target=self.__refresh_in_background, daemon=True)
+            self.refresh_thread.start()
+        with self.lock:
+            assert self.open_generation is not None, \
+                f"No index generation published in {self.index_generations.generations_path}"
+            self.open_generation.references += 1
+            return self.open_generation
+
+    def release(self, open_generation: OpenGeneration):
+        with self.lock:
+            open_generation.references -= 1
+            close = open_generation.retired and open_generation.references == 0
+        if close:
+            self.__close_generation(open_generation)
+
+    def close(self):
+        if self.refresh_thread is not None:  # a generation opened after closing would never be closed
+            self.refresh_thread.join()
+        with self.lock:
+            old_generation = self.open_generation
+            self.open_generation = None
+        if old_generation is not None:
+            self.__retire(old_generation)
+
+    def __retire(self, open_generation: OpenGeneration):
+        with self.lock:
+            open_generation.retired = True
+            close = open_generation.references == 0
+        if close:
+            self.__close_generation(open_generation)
+
+    def __close_generation(self, open_generation: OpenGeneration):
+        print(f"Closing index generation {open_generation.generation}")
+        open_generation.tiered_index.__exit__(None, None, None)
+        open_generation.lease_file.close()
+        self.index_generations.reclaim()
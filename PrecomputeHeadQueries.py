@@ -0,0 +1,83 @@
+import argparse
+import json
+import sys
+from collections import Counter
+
+from Indexer.HeadQueries import HeadQueries
+from Indexer.TieredIndex import TieredIndex
+from Scorer import Scorer
+
+
+def read_query_log(query_log_file: str) -> (Counter, {str: str}):
+    """
+    Counts the normalized queries of the query log, which has a query per line, either as text or as the json
+    records of the slow query log. Returns the count and the first query logged of each normalized query
+    """
+    query_counts: Counter = Counter()
+    logged_queries: {str: str} = {}
+    with open(query_log_file, mode="r") as f:
+        for line in f:
+            query = line.strip()
+            if query.startswith("{"):
+                try:
+                    query = str(json.loads(query).get("query", ""))
+                except (json.JSONDecodeError, AttributeError):
+                    pass
+            normalized_query = HeadQueries.normalize_query(query)
+            if len(normalized_query) == 0:
+                continue
+            query_counts[normalized_query] += 1
+            logged_queries.setdefault(normalized_query, query)
+    return query_counts, logged_queries
+
+
+def logged_query_counts(query_log_file: str) -> {str: int}:
+    """Number of times each query of the query log was logged, keyed by the first query logged of each"""
+    query_counts, logged_queries = read_query_log(query_log_file)
+    return {logged_queries[normalized_query]: count for normalized_query, count in query_counts.items()}
+
+
+def precompute_head_queries(tiered_index: TieredIndex,
+                            query_log_file: str,
+                            top_queries: int = 1000,
+                            k_results: int = 10) -> int:
+    """
+    Searches the top_queries most frequent queries of the query log without a time budget and stores their first
+    page results for k_results with the indexes, returning the number of queries stored
+    """
+    tiered_index.head_queries.prep_for_build()
+    query_counts, logged_queries = read_query_log(query_log_file)
+    scorer = Scorer(tiered_index)
+
+    query_results: {str: [(int, float)]} = {}
+    for normalized_query, count in query_counts.most_common(top_queries):
+        scorer.new_search()
+        scorer.sprint_search(logged_queries[normalized_query], k_results)
+        query_results[normalized_query] = sorted(scorer.current_results.items(), key=lambda x: x[1], reverse=True)
+
+    tiered_index.head_queries.build(query_results, k_results)
+    print(f"Precomputed the results of {len(query_results)} head queries, "
+          f"{sum(count for _, count in query_counts.most_common(top_queries))} of the "
+          f"{sum(query_counts.values())} queries logged")
+    return len(query_results)
+
+
+def main(arguments: [str]):
+    parser = argparse.ArgumentParser(description="Precomputes the results of the most frequent logged queries")
+    parser.add_argument("--query-log", required=True,
+                        help="file with a query per line, as text or as the json records of the slow query log")
+    parser.add_argument("--top-queries", type=int, default=1000, help="number of most frequent queries stored")
+    parser.add_argument("--k-results", type=int, default=10, help="results per page the queries are searched for")
+    parser.add_argument("--data-directory", default=None,
+                        help="directory of the indexes, like an index generation, instead of ./Indexer")
+    parser.add_argument("--max-n-grams", type=int, default=3)
+    parser.add_argument("--page-rank-iterations", type=int, default=5)
+    args = parser.parse_args(arguments)
+
+    with TieredIndex(args.max_n_grams, args.page_rank_iterations,
+                     data_directory=args.data_directory) as tiered_index:
+        precompute_head_queries(tiered_index, args.query_log, args.top_queries, args.k_results)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
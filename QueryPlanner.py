@@ -0,0 +1,166 @@
+from typing import Optional, List
+
+from Indexer.Index import Index
+from Indexer.TieredIndex import TieredIndex
+
+
+class TierPlan:
+    """A candidate way of answering a query from one tier index, with its estimated cost and result quality"""
+
+    def __init__(self, index: Index, score_weight: float, estimated_cost: int, estimated_quality: float):
+        self.index: Index = index
+        self.score_weight: float = score_weight
+        self.estimated_cost: int = estimated_cost  # estimated bytes of postings data read from disk
+        self.estimated_quality: float = estimated_quality  # 0.0 - 1.0 estimated coverage of the wanted results
+
+    def describe(self) -> str:
+        return f"{self.index.descriptor}: " \
+               f"cost={self.estimated_cost}B, " \
+               f"quality={round(self.estimated_quality, 3)}, " \
+               f"limit={self.index.postings_list_size_limit}"
+
+
+class QueryPlan:
+    """
+    The tiers chosen to answer a query, along with every plan considered and the reason for the choice. The
+    fallback tiers are searched after the chosen ones, in priority order, only if those come back short of results
+    """
+
+    def __init__(self, chosen: [TierPlan], considered: [TierPlan], reason: str,
+                 fallback: Optional[List[TierPlan]] = None):
+        self.chosen: [TierPlan] = chosen
+        self.considered: [TierPlan] = considered
+        self.reason: str = reason
+        self.fallback: [TierPlan] = fallback or []
+
+    @property
+    def tiers_to_search(self) -> [TierPlan]:
+        return self.chosen + self.fallback
+
+    @property
+    def estimated_cost(self) -> int:
+        return sum(tier_plan.estimated_cost for tier_plan in self.chosen)
+
+    def explain(self) -> str:
+        lines = [f"Query plan: {', '.join(tier_plan.index.descriptor for tier_plan in self.chosen) or 'no tiers'} "
+                 f"(estimated cost {self.estimated_cost}B) - {self.reason}"]
+        for tier_plan in self.considered:
+            mark = "*" if tier_plan in self.chosen else "?" if tier_plan in self.fallback else " "
+            lines.append(f"    {mark} {tier_plan.describe()}")
+        return "\n".join(lines)
+
+
+class QueryPlanner:
+    """
+    Estimates the cost of answering a query from each tier using the posting list byte sizes and document
+    frequencies captured when the tiers were merged, and picks the cheapest tiers that meet a target quality
+    """
+
+    SEEK_COST_BYTES = 4096  # fixed cost charged for each posting list read, roughly one disk page
+    DEPTH_FACTOR = 10  # postings needed per term for each result wanted, since docs must match across terms
+
+    def __init__(self,
+                 tiered_index: TieredIndex,
+                 target_quality: float = 0.9,
+                 cost_budget_bytes: Optional[int] = 2000000,
+                 ):
+        self.tiered_index: TieredIndex = tiered_index
+        self.target_quality: float = target_quality
+        self.cost_budget_bytes: Optional[int] = cost_budget_bytes
+
+    def estimate_cost(self, index: Index, query_terms: [str]) -> int:
+        """Estimates the bytes read from the index to retrieve the posting lists of all the query terms"""
+        return sum(index.estimate_posting_list_bytes(term) + QueryPlanner.SEEK_COST_BYTES
+                   for term in query_terms if term in index)
+
+    def estimate_quality(self, index: Index, scored_query: {str: float}, required_depth: int) -> float:
+        """
+        Estimates the fraction of the wanted postings the index holds, averaged over the query terms by their
+        query weight. A term is fully covered if the index holds all of its postings from the complete index
+        or at least the required_depth highest ranked ones, since posting lists are stored in sorted order
+        """
+        complete_index = self.tiered_index.complete_index
+        total_weight = sum(scored_query.values())
+        if total_weight <= 0:
+            return 1.0
+
+        quality = 0.0
+        for term, term_weight in scored_query.items():
+            wanted_postings = min(complete_index.document_term_counts.get(term, 0), required_depth)
+            if wanted_postings == 0:
+                quality += term_weight
+                continue
+            quality += term_weight * min(1.0, index.effective_posting_list_length(term) / wanted_postings)
+        return quality / total_weight
+
+    def plan_tier(self, index: Index, score_weight: float, scored_query: {str: float}, required_depth: int):
+        return TierPlan(index=index,
+                        score_weight=score_weight,
+                        estimated_cost=self.estimate_cost(index, list(scored_query)),
+                        estimated_quality=self.estimate_quality(index, scored_query, required_depth))
+
+    def plan_complete_search(self, scored_query: {str: float}, k_results: int, returned_results: int) -> QueryPlan:
+        """
+        Picks the single text tier for a next page search: the cheapest one that meets the target quality for
+        the results already returned plus the next k_results, within the cost budget if possible
+        """
+        required_depth = QueryPlanner.DEPTH_FACTOR * (returned_results + k_results)
+        considered = [self.plan_tier(index, 1.0, scored_query, required_depth)
+                      for index in (self.tiered_index.limited_index, self.tiered_index.complete_index)]
+
+        affordable = [tier_plan for tier_plan in considered if self.__within_budget(tier_plan.estimated_cost)]
+        if len(affordable) == 0:
+            chosen = min(considered, key=lambda x: x.estimated_cost)
+            return QueryPlan([chosen], considered, f"no tier within cost budget of {self.cost_budget_bytes}B, "
+                                                   f"using the cheapest")
+
+        meeting_target = [tier_plan for tier_plan in affordable
+                          if tier_plan.estimated_quality >= self.target_quality]
+        if len(meeting_target) == 0:
+            chosen = max(affordable, key=lambda x: (x.estimated_quality, -x.estimated_cost))
+            return QueryPlan([chosen], considered, f"no tier meets target quality {self.target_quality}, "
+                                                   f"using the highest quality within budget")
+
+        # prefer the higher quality tier when the costs are equal, such as when no list was truncated
+        chosen = min(meeting_target, key=lambda x: (x.estimated_cost, -x.estimated_quality))
+        return QueryPlan([chosen], considered, f"cheapest tier meeting target quality {self.target_quality} "
+                                               f"for depth {required_depth}")
+
+    def plan_sprint_search(self, tiers: [(Index, float)], scored_query: {str: float}, k_results: int) -> QueryPlan:
+        """
+        Picks the tiers to visit, in their priority order, for a first page search. Tiers holding none of the
+        query terms are skipped, and once the planned tiers may hold k_results documents any further tier that
+        does not fit in what is left of the cost budget is deferred to the fallback tiers. The documents the
+        planned tiers hold are only an upper bound, a doc can be in several tiers and a multi word query
+        matches fewer docs than its longest list, so the fallback tiers are searched if the page comes back short
+        """
+        considered = [self.plan_tier(index, score_weight, scored_query, k_results) for index, score_weight in tiers]
+
+        chosen = []
+        fallback = []
+        planned_cost = 0
+        expected_docs = 0  # upper bound of the docs the chosen tiers return
+        skipped = []
+        for tier_plan in considered:
+            if not any(term in tier_plan.index for term in scored_query):
+                skipped.append(f"{tier_plan.index.descriptor} has no query terms")
+                continue
+            if expected_docs >= k_results and not self.__within_budget(planned_cost + tier_plan.estimated_cost):
+                fallback.append(tier_plan)
+                continue
+            chosen.append(tier_plan)
+            planned_cost += tier_plan.estimated_cost
+            expected_docs += max((tier_plan.index.effective_posting_list_length(term) for term in scored_query),
+                                 default=0)
+
+        reason = "tiers in priority order"
+        if len(skipped) > 0:
+            reason += f", skipped {'; '.join(skipped)}"
+        if len(fallback) > 0:
+            reason += f", deferred {', '.join(tier_plan.index.descriptor for tier_plan in fallback)} over the " \
+                      f"cost budget of {self.cost_budget_bytes}B as the tiers before may hold {expected_docs} " \
+                      f"of the {k_results} docs, searched only if the page comes back short"
+        return QueryPlan(chosen, considered, reason, fallback)
+
+    def __within_budget(self, cost: int) -> bool:
+        return self.cost_budget_bytes is None or cost <= self.cost_budget_bytes
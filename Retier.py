@@ -0,0 +1,35 @@
+import argparse
+import sys
+
+from Indexer.TieredIndex import TieredIndex
+from PrecomputeHeadQueries import logged_query_counts
+
+
+def main(arguments: [str]):
+    parser = argparse.ArgumentParser(
+        description="Rewrites the built tiers with the sort weights and posting list size limits set in "
+                    "TieredIndex.__enter__, without parsing the local store again")
+    parser.add_argument("--tiers", nargs="*", default=None,
+                        help="descriptors of the tiers to rewrite, like limited_text_index, all of them by default")
+    parser.add_argument("--recompute-page-rank", action="store_true",
+                        help="compute PageRank again from the link graph and rewrite every tier with it")
+    parser.add_argument("--query-log", default=None,
+                        help="query log to write the posting lists of the terms queried most first by")
+    parser.add_argument("--data-directory", default=None,
+                        help="directory of the indexes, like an index generation, instead of ./Indexer")
+    parser.add_argument("--max-n-grams", type=int, default=3)
+    parser.add_argument("--page-rank-iterations", type=int, default=5)
+    args = parser.parse_args(arguments)
+
+    with TieredIndex(args.max_n_grams, args.page_rank_iterations,
+                     data_directory=args.data_directory) as tiered_index:
+        descriptors = {index.descriptor for index in tiered_index.all_indexes()}
+        for descriptor in args.tiers or []:
+            assert descriptor in descriptors, f"Tier {descriptor} must be one of {sorted(descriptors)}"
+        if args.query_log is not None:
+            tiered_index.set_query_counts(logged_query_counts(args.query_log))
+        tiered_index.retier_indexes(args.tiers, args.recompute_page_rank)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
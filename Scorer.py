@@ -1,161 +1,683 @@
+import heapq
 import math
+import time
+from typing import Optional, Dict, Iterator
 
 import Tokenizer
-from Indexer.DocList import Posting
-from Indexer.Index import Index
+from Indexer.Index import Index, PostingsCursor, DocIdCursor
 from Indexer.TieredIndex import TieredIndex
+from QueryPlanner import QueryPlanner
+from SearchTrace import QueryTrace, TraceAggregator
+
+
+class SearchResults(list):
+    """List of result urls, flagged as partial when the search ran out of its time budget before finishing"""
+
+    def __init__(self, urls: [str], partial: bool = False):
+        super().__init__(urls)
+        self.partial: bool = partial
+
+
+class ProvisionalResults(SearchResults):
+    """
+    Result urls of a streaming search ranked by the scores found so far, with the scores in the same order.
+    The ranking is provisional until final, since the tiers left can add to the scores of the docs found and
+    find new ones
+    """
+
+    def __init__(self, urls: [str], scores: [float], tier: str, new_urls: [str], final: bool, partial: bool = False):
+        super().__init__(urls, partial)
+        self.scores: [float] = scores
+        self.tier: str = tier  # descriptor of the tier searched last
+        self.new_urls: [str] = new_urls  # urls first found in the tier searched last
+        self.final: bool = final
+
+
+class SearchDeadline:
+    """Tracks the time budget of a single search call, checked by the search at safe points between work"""
+
+    def __init__(self, time_budget_ms: Optional[float]):
+        self.deadline: Optional[float] = None if time_budget_ms is None else time.perf_counter() + time_budget_ms / 1000
+        self.exceeded: bool = False
+
+    def expired(self) -> bool:
+        if self.deadline is not None and not self.exceeded and time.perf_counter() >= self.deadline:
+            self.exceeded = True
+        return self.exceeded
+
+
+class SearchCursor:
+    """
+    A search of one tier kept open between pages of results: the posting list cursors positioned after the blocks
+    read so far and the scores of the query terms read for each doc. The next page carries on reading the posting
+    lists from where the last page stopped, so it only reads the blocks needed to settle the next k results
+    """
+
+    def __init__(self,
+                 index: Index,
+                 query_terms: [str],
+                 scored_query: {str: float},
+                 score_weight: float,
+                 query: Optional[str] = None):
+        self.index: Index = index
+        self.query_terms: [str] = query_terms
+        self.scored_query: {str: float} = scored_query
+        self.score_weight: float = score_weight
+        self.query: Optional[str] = query  # the query of a search continued over several pages
+        self.postings_cursors: {str: PostingsCursor} = {}
+        self.doc_term_scores: {int: {str: float}} = {}  # score of each query term read so far for each candidate
+        self.doc_impact_scores: {int: float} = {}  # sum of the term scores read so far for each candidate
+        # max heap of (-impact score, doc id) of the candidates, pushed on every change of their impact scores,
+        # the entries out of date or of docs dropped are left on it until they reach the top
+        self.candidate_heap: [(float, int)] = []
+        # impact and term scores of the docs dropped from the candidates once returned, read on in case they are
+        # let back in by forget_returned
+        self.dropped_doc_scores: {int: (float, {str: float})} = {}
+        self.docs_scored: int = 0
+
+    def next_candidate(self, excluded: {int}, popped_doc_ids: [int]) -> Optional[int]:
+        """
+        Pops the candidate with the highest impact score off the heap, dropping the excluded docs it comes across,
+        and appends it to popped_doc_ids to push back once done. Returns None once no candidates are left
+        """
+        while len(self.candidate_heap) > 0:
+            negative_impact_score, doc_id = heapq.heappop(self.candidate_heap)
+            if self.doc_impact_scores.get(doc_id) != -negative_impact_score or doc_id in popped_doc_ids:
+                continue  # out of date, dropped or a duplicate of an entry already popped
+            if doc_id in excluded:
+                self.drop(doc_id)
+                continue
+            popped_doc_ids.append(doc_id)
+            return doc_id
+        return None
+
+    def push_back(self, popped_doc_ids: [int]):
+        for doc_id in popped_doc_ids:
+            if doc_id in self.doc_impact_scores:
+                heapq.heappush(self.candidate_heap, (-self.doc_impact_scores[doc_id], doc_id))
+        if len(self.candidate_heap) > 2 * len(self.doc_impact_scores):  # mostly out of date entries
+            self.candidate_heap = [(-impact_score, doc_id) for doc_id, impact_score in self.doc_impact_scores.items()]
+            heapq.heapify(self.candidate_heap)
+
+    def drop(self, doc_id: int):
+        self.dropped_doc_scores[doc_id] = (self.doc_impact_scores.pop(doc_id), self.doc_term_scores.pop(doc_id))
+
+    def restore(self, doc_ids: [int]):
+        """Lets dropped docs back into the candidates"""
+        for doc_id in doc_ids:
+            if doc_id in self.dropped_doc_scores:
+                self.doc_impact_scores[doc_id], self.doc_term_scores[doc_id] = self.dropped_doc_scores.pop(doc_id)
+                heapq.heappush(self.candidate_heap, (-self.doc_impact_scores[doc_id], doc_id))
 
 
 class Scorer:
 
-    def __init__(self, tiered_index: TieredIndex):
+    DEADLINE_CHECK_INTERVAL = 32  # number of candidate docs checked between checks of the search deadline
+
+    def __init__(self,
+                 tiered_index: TieredIndex,
+                 query_planner: QueryPlanner = None,
+                 debug: bool = False,
+                 trace_aggregator: TraceAggregator = None,
+                 document_term_counts: Optional[Dict[str, int]] = None):
         self.tiered_index = tiered_index
+        # doc counts of the terms of the whole collection when searching a shard, to weight query terms with
+        # instead of those of the complete index
+        self.document_term_counts: Optional[Dict[str, int]] = document_term_counts
+        self.query_planner: QueryPlanner = query_planner if query_planner is not None else QueryPlanner(tiered_index)
+        self.debug: bool = debug
+        self.trace_aggregator: Optional[TraceAggregator] = trace_aggregator  # traces every search when set
         self.returned_results: {int} = set()
+        self.search_cursor: Optional[SearchCursor] = None  # the search continued by the next complete_search
         self.current_results: {int: float} = {}
+        self.stats: {str: int} = {"searches": 0, "budget_exceeded": 0, "head_query_hits": 0}
 
-    def sprint_search(self, query: str, k_results):
-        scored_query = self.__score_query(query, self.tiered_index.max_n_grams)
+    def sprint_tiers(self) -> [(Index, float)]:
+        """The tiers searched for the first page in priority order, with the weight of their scores"""
+        return [
+            (self.tiered_index.title_index, 8.0),
+            (self.tiered_index.anchor_index, 7.0),
+            (self.tiered_index.header_index, 5.0),
+            (self.tiered_index.bold_index, 4.0),
+            (self.tiered_index.limited_index, 1.0),
+        ]
+
+    def sprint_search(self,
+                      query: str,
+                      k_results,
+                      time_budget_ms: Optional[float] = None,
+                      trace: QueryTrace = None) -> SearchResults:
+        """
+        Searches the tiers in priority order until k_results are found, or returns the precomputed results of a
+        head query. If a time budget is given the search stops once it runs out, returning the best results found
+        so far flagged as partial
+        """
+        deadline = SearchDeadline(time_budget_ms)
+        trace = self.__start_trace(query, "sprint_search", trace)
+
+        self.current_results.clear()
+
+        # the results of the most frequent queries are precomputed after the build
+        head_query_results = self.tiered_index.head_queries.get_results(query, k_results)
+        if head_query_results is not None:
+            self.current_results.update(head_query_results)
+            self.returned_results.update(self.current_results.keys())
+            self.stats["head_query_hits"] += 1
+            if trace is not None:
+                trace.count("head_query_hits")
+            return self.__finish_search(deadline, trace)
+
+        scored_query = self.__score_query(query, self.tiered_index.max_n_grams, trace)
         query_terms = [term for term in scored_query]
 
+        stage_start_time = time.perf_counter() if trace is not None else 0.0
+        query_plan = self.query_planner.plan_sprint_search(self.sprint_tiers(), scored_query, k_results)
+        if trace is not None:
+            trace.add_stage_time("plan", stage_start_time)
+        if self.debug:
+            print(query_plan.explain())
+
+        # the fallback tiers are only reached while the page is short, since the search stops once it is full
+        for tier_plan in query_plan.tiers_to_search:
+            if deadline.expired():
+                break
+            self.current_results.update(
+                self._search(tier_plan.index, query_terms, scored_query, tier_plan.score_weight, k_results,
+                             deadline, trace)
+            )
+            self.returned_results.update(self.current_results.keys())
+            if len(self.current_results) >= k_results:
+                break
+
+        return self.__finish_search(deadline, trace)
+
+    def iter_search(self,
+                    query: str,
+                    k_results,
+                    time_budget_ms: Optional[float] = None,
+                    trace: QueryTrace = None) -> Iterator[ProvisionalResults]:
+        """
+        Searches the tiers like sprint_search, yielding the ranking of the results found so far after each tier, so
+        the results of the first tiers can be shown before the deeper tiers are searched. The last ranking is
+        flagged final, and stopping the iteration before it skips the tiers left
+        """
+        deadline = SearchDeadline(time_budget_ms)
+        trace = self.__start_trace(query, "iter_search", trace)
+
         self.current_results.clear()
 
-        self.current_results.update(
-            self._search(self.tiered_index.title_index, query_terms, scored_query, 8.0, k_results)
-        )
-        self.returned_results.update(self.current_results.keys())
-        if len(self.current_results) >= k_results:
-            return [self.tiered_index.doc_id_to_url_LUT[doc_id] for doc_id in
-                    sorted((doc_id for doc_id in self.current_results),
-                           key=lambda x: self.current_results[x],
-                           reverse=True)
-                    ]
+        try:
+            head_query_results = self.tiered_index.head_queries.get_results(query, k_results)
+            if head_query_results is not None:
+                self.current_results.update(head_query_results)
+                self.returned_results.update(self.current_results.keys())
+                self.stats["head_query_hits"] += 1
+                if trace is not None:
+                    trace.count("head_query_hits")
+                yield self.__provisional_results("head_queries", list(self.current_results), True, deadline)
+                return
 
-        self.current_results.update(
-            self._search(self.tiered_index.anchor_index, query_terms, scored_query, 7.0, k_results)
-        )
-        self.returned_results.update(self.current_results.keys())
-        if len(self.current_results) >= k_results:
-            return [self.tiered_index.doc_id_to_url_LUT[doc_id] for doc_id in
-                    sorted((doc_id for doc_id in self.current_results),
-                           key=lambda x: self.current_results[x],
-                           reverse=True)
-                    ]
+            scored_query = self.__score_query(query, self.tiered_index.max_n_grams, trace)
+            query_terms = [term for term in scored_query]
 
-        self.current_results.update(
-            self._search(self.tiered_index.header_index, query_terms, scored_query, 5.0, k_results)
-        )
-        self.returned_results.update(self.current_results.keys())
-        if len(self.current_results) >= k_results:
-            return [self.tiered_index.doc_id_to_url_LUT[doc_id] for doc_id in
-                    sorted((doc_id for doc_id in self.current_results),
-                           key=lambda x: self.current_results[x],
-                           reverse=True)
-                    ]
+            stage_start_time = time.perf_counter() if trace is not None else 0.0
+            query_plan = self.query_planner.plan_sprint_search(self.sprint_tiers(), scored_query, k_results)
+            if trace is not None:
+                trace.add_stage_time("plan", stage_start_time)
+            if self.debug:
+                print(query_plan.explain())
 
-        self.current_results.update(
-            self._search(self.tiered_index.bold_index, query_terms, scored_query, 4.0, k_results)
-        )
-        self.returned_results.update(self.current_results.keys())
-        if len(self.current_results) >= k_results:
-            return [self.tiered_index.doc_id_to_url_LUT[doc_id] for doc_id in
-                    sorted((doc_id for doc_id in self.current_results),
-                           key=lambda x: self.current_results[x],
-                           reverse=True)
-                    ]
+            if len(query_plan.chosen) == 0 or deadline.expired():
+                yield self.__provisional_results("", [], True, deadline)
+                return
+
+            tiers_to_search = query_plan.tiers_to_search
+            for tier_number, tier_plan in enumerate(tiers_to_search):
+                tier_results = self._search(tier_plan.index, query_terms, scored_query, tier_plan.score_weight,
+                                            k_results, deadline, trace)
+                new_doc_ids = [doc_id for doc_id in tier_results if doc_id not in self.current_results]
+                self.current_results.update(tier_results)
+                self.returned_results.update(self.current_results.keys())
+                final = len(self.current_results) >= k_results or tier_number == len(tiers_to_search) - 1 or \
+                    deadline.expired()
+                yield self.__provisional_results(tier_plan.index.descriptor, new_doc_ids, final, deadline)
+                if final:
+                    return
+        finally:
+            self.__record_search(deadline, len(self.current_results), trace)
+
+    def complete_search(self,
+                        query: str,
+                        k_results,
+                        time_budget_ms: Optional[float] = None,
+                        trace: QueryTrace = None) -> SearchResults:
+        """
+        Searches the planned text tier for the next page of results, leaving out the docs already returned. The
+        search of the tier is kept open, so the pages after it continue reading where the last page stopped.
+        If a time budget is given the search stops once it runs out, returning the best results found so far
+        flagged as partial
+        """
+        deadline = SearchDeadline(time_budget_ms)
+        trace = self.__start_trace(query, "complete_search", trace)
+
+        self.current_results.clear()
+
+        if self.search_cursor is None or self.search_cursor.query != query:
+            scored_query = self.__score_query(query, self.tiered_index.max_n_grams, trace)
+
+            stage_start_time = time.perf_counter() if trace is not None else 0.0
+            query_plan = self.query_planner.plan_complete_search(scored_query, k_results, len(self.returned_results))
+            if trace is not None:
+                trace.add_stage_time("plan", stage_start_time)
+            if self.debug:
+                print(query_plan.explain())
+
+            tier_plan = query_plan.chosen[0]
+            self.search_cursor = self._open_search_cursor(tier_plan.index, [term for term in scored_query],
+                                                          scored_query, tier_plan.score_weight, deadline, trace,
+                                                          query=query)
 
         self.current_results.update(
-            self._search(self.tiered_index.limited_index, query_terms, scored_query, 1.0, k_results)
+            self._search_next(self.search_cursor, k_results, deadline, trace, excluded=self.returned_results)
         )
+        if len(self.current_results) < k_results and not deadline.expired() and \
+                self.search_cursor.index is not self.tiered_index.complete_index:
+            # the planned tier ran out of docs for the query, the rest of the pages come from the complete index
+            self.returned_results.update(self.current_results.keys())
+            self.search_cursor = self._open_search_cursor(self.tiered_index.complete_index,
+                                                          self.search_cursor.query_terms,
+                                                          self.search_cursor.scored_query,
+                                                          1.0, deadline, trace, query=query)
+            self.current_results.update(
+                self._search_next(self.search_cursor, k_results - len(self.current_results), deadline, trace,
+                                  excluded=self.returned_results)
+            )
         self.returned_results.update(self.current_results.keys())
-        return [self.tiered_index.doc_id_to_url_LUT[doc_id] for doc_id in
-                sorted((doc_id for doc_id in self.current_results),
-                       key=lambda x: self.current_results[x],
-                       reverse=True)
-                ]
-
-    def complete_search(self, query: str, k_results):
-        scored_query = self.__score_query(query, self.tiered_index.max_n_grams)
-        query_terms = [term for term in scored_query]
+        return self.__finish_search(deadline, trace)
+
+    def conjunctive_search(self,
+                           query: str,
+                           k_results,
+                           time_budget_ms: Optional[float] = None,
+                           trace: QueryTrace = None) -> SearchResults:
+        """
+        Searches the complete index for the top k_results docs containing every word of the query, intersecting
+        the doc id ordered lists of the words from the rarest word. If a time budget is given the search stops
+        once it runs out, returning the best results found so far flagged as partial
+        """
+        deadline = SearchDeadline(time_budget_ms)
+        trace = self.__start_trace(query, "conjunctive_search", trace)
+        index = self.tiered_index.complete_index
+        required_terms = [term for term in Tokenizer.tokenize_query(query, 1)]
 
         self.current_results.clear()
 
-        if all(self.tiered_index.complete_index.document_term_counts[term] < 600 for term in query_terms):
+        if len(required_terms) > 0 and all(term in index for term in required_terms):
+            scored_query = self.__score_query(query, self.tiered_index.max_n_grams, trace)
             self.current_results.update(
-                self._search(self.tiered_index.complete_index, query_terms, scored_query, 1.0, k_results)
+                self._intersect(index, required_terms, scored_query, 1.0, k_results, deadline, trace)
             )
-        else:
+        self.returned_results.update(self.current_results.keys())
+        return self.__finish_search(deadline, trace)
+
+    def fielded_search(self,
+                       query: str,
+                       k_results,
+                       time_budget_ms: Optional[float] = None,
+                       trace: QueryTrace = None) -> SearchResults:
+        """
+        Searches the fielded index for the top k_results docs by their BM25F scores, reading one posting list per
+        query term instead of one per tier, and leaving out the docs already returned. If a time budget is given
+        the search stops once it runs out, returning the best results found so far flagged as partial
+        """
+        deadline = SearchDeadline(time_budget_ms)
+        trace = self.__start_trace(query, "fielded_search", trace)
+        index = self.tiered_index.fielded_index
+        assert index is not None, f"Fielded search of indexes built without fielded postings"
+
+        self.current_results.clear()
+
+        # BM25F scores already weight each term by its idf, so query terms are weighted by their count only
+        scored_query = {term: count for term, count in Tokenizer.tokenize_query(query, index.max_n_grams).items()
+                        if term in index}
+        if len(scored_query) > 0:
+            search_cursor = self._open_search_cursor(index, [term for term in scored_query], scored_query, 1.0,
+                                                     deadline, trace)
+            # the BM25F scores of the terms add up, unlike the tier scores normalized over the query terms
             self.current_results.update(
-                self._search(self.tiered_index.limited_index, query_terms, scored_query, 1.0, k_results)
+                {doc_id: search_cursor.dropped_doc_scores[doc_id][0]
+                 for doc_id in self._search_next(search_cursor, k_results, deadline, trace,
+                                                 excluded=self.returned_results)}
             )
         self.returned_results.update(self.current_results.keys())
-        return [self.tiered_index.doc_id_to_url_LUT[doc_id] for doc_id in
-                sorted((doc_id for doc_id in self.current_results),
-                       key=lambda x: self.current_results[x],
-                       reverse=True)
-                ]
+        return self.__finish_search(deadline, trace)
 
     def new_search(self):
         self.returned_results.clear()
+        self.search_cursor = None
+
+    def forget_returned(self, doc_ids: [int]):
+        """Lets docs already returned be returned again, like the docs of a shard left out of a merged page"""
+        self.returned_results.difference_update(doc_ids)
+        if self.search_cursor is not None:
+            self.search_cursor.restore(doc_ids)
+
+    def __start_trace(self, query: str, search_type: str, trace: Optional[QueryTrace]) -> Optional[QueryTrace]:
+        """Returns the trace attached to the search call, or a new one if every search is traced"""
+        if trace is None and self.trace_aggregator is not None:
+            return QueryTrace(query, search_type)
+        return trace
+
+    def __finish_search(self, deadline: SearchDeadline, trace: QueryTrace = None) -> SearchResults:
+        """Records the search in the stats and returns the current results sorted by score"""
+        stage_start_time = time.perf_counter() if trace is not None else 0.0
+        results = SearchResults([self.tiered_index.doc_table.get_url(doc_id) for doc_id in self.__ranked_doc_ids()],
+                                partial=deadline.exceeded)
+        if trace is not None:
+            trace.add_stage_time("render", stage_start_time)
+        self.__record_search(deadline, len(results), trace)
+        return results
+
+    def __provisional_results(self, tier: str, new_doc_ids: [int], final: bool,
+                              deadline: SearchDeadline) -> ProvisionalResults:
+        ranked_doc_ids = self.__ranked_doc_ids()
+        return ProvisionalResults([self.tiered_index.doc_table.get_url(doc_id) for doc_id in ranked_doc_ids],
+                                  [self.current_results[doc_id] for doc_id in ranked_doc_ids],
+                                  tier,
+                                  [self.tiered_index.doc_table.get_url(doc_id) for doc_id in new_doc_ids],
+                                  final,
+                                  partial=deadline.exceeded)
+
+    def __ranked_doc_ids(self) -> [int]:
+        return sorted(self.current_results, key=lambda x: self.current_results[x], reverse=True)
+
+    def __record_search(self, deadline: SearchDeadline, results_count: int, trace: QueryTrace = None):
+        self.stats["searches"] += 1
+        if deadline.exceeded:
+            self.stats["budget_exceeded"] += 1
+        if trace is not None:
+            trace.finish(results_count, deadline.exceeded)
+            if self.trace_aggregator is not None:
+                self.trace_aggregator.record(trace)
+
+    def __score_query(self, query: str, max_n_grams: int, trace: QueryTrace = None) -> {str: float}:
+        stage_start_time = time.perf_counter() if trace is not None else 0.0
+        document_term_counts = self.document_term_counts if self.document_term_counts is not None \
+            else self.tiered_index.complete_index.document_term_counts
+        complete_index = self.tiered_index.complete_index
+        tokenized_query = Tokenizer.tokenize_query(query, max_n_grams)
+
+        # n-grams left out of a unigram positions only build are counted from the positions of their words
+        phrase_document_counts = {term: complete_index.phrase_document_count(term)
+                                  for term in tokenized_query
+                                  if " " in term and term not in document_term_counts and
+                                  complete_index.n_grams_from_positions}
 
-    def __score_query(self, query: str, max_n_grams: int) -> {str: float}:
         def score(term, count):
             return (1 + math.log10(count)) * \
                    math.log10(
-                       len(self.tiered_index.complete_index.document_term_counts) /
-                       self.tiered_index.complete_index.document_term_counts[term]
+                       len(document_term_counts) /
+                       (document_term_counts[term] if term in document_term_counts else phrase_document_counts[term])
                    )
 
         query_term_counts = {term: count
-                             for term, count in Tokenizer.tokenize_query(query, max_n_grams).items()
-                             if term in self.tiered_index.complete_index.document_term_counts
+                             for term, count in tokenized_query.items()
+                             if term in document_term_counts or phrase_document_counts.get(term, 0) > 0
                              }
 
         query_term_scores = {term: score(term, count) for term, count in query_term_counts.items()}
         normalized_factor = math.sqrt(sum(score ** 2 for score in query_term_scores.values()))
+        if trace is not None:
+            trace.add_stage_time("tokenize", stage_start_time)
+        if normalized_factor == 0:  # no query term is in the index
+            return {}
         return {term: term_score / normalized_factor for term, term_score in query_term_scores.items()}
 
     def _search(self,
                 index: Index,
-                query_terms: [int],
-                scored_query: [float],
+                query_terms: [str],
+                scored_query: {str: float},
                 score_weight: float,
-                k_results: int) -> [int]:
-        term_postings_lists = {term: index.retrieve_posting_list(term) for term in query_terms if term in index}
-        doc_ids = {doc_id for postings_list in term_postings_lists.values() for doc_id in postings_list.postings_dict
-                   # if doc_id not in self.returned_results
-                   }
-        sorted_doc_ids = sorted(
-            doc_ids,
-            key=lambda x: sum(1 for postings_list in term_postings_lists.values() if x in postings_list.postings_dict),
-            reverse=True
-        )
+                k_results: int,
+                deadline: SearchDeadline = None,
+                trace: QueryTrace = None) -> {int: float}:
+        """
+        Scores the top k_results docs of the index for the query, reading the impact ordered posting lists block
+        by block from the term with the highest scores left, and stopping once the block max scores of the
+        unread blocks show no other doc can beat the current k-th best doc
+        """
+        if deadline is None:
+            deadline = SearchDeadline(None)
+        search_cursor = self._open_search_cursor(index, query_terms, scored_query, score_weight, deadline, trace)
+        return self._search_next(search_cursor, k_results, deadline, trace)
 
-        results: {int: float} = {}
+    def _open_search_cursor(self,
+                            index: Index,
+                            query_terms: [str],
+                            scored_query: {str: float},
+                            score_weight: float,
+                            deadline: SearchDeadline = None,
+                            trace: QueryTrace = None,
+                            query: Optional[str] = None) -> SearchCursor:
+        if deadline is None:
+            deadline = SearchDeadline(None)
+        stage_start_time = time.perf_counter() if trace is not None else 0.0
+        search_cursor = SearchCursor(index, query_terms, scored_query, score_weight, query)
 
-        global_tf_idf_weight = index.sort_weights["global_tf_idf"]
-        local_tf_idf_weight = index.sort_weights["local_tf_idf"]
-        page_rank_weight = index.sort_weights["page_rank"]
+        # open the posting lists one at a time so an expired deadline still scores the lists already opened
+        for term in query_terms:
+            if deadline.expired():
+                break
+            postings_cursor = index.open_postings_cursor(term)
+            if postings_cursor is not None:
+                search_cursor.postings_cursors[term] = postings_cursor
 
-        doc_id_scores = [0.0] * len(query_terms)
+        if trace is not None:
+            trace.add_stage_time("open_postings", stage_start_time)
+            trace.count("posting_lists_opened", len(search_cursor.postings_cursors))
+        return search_cursor
 
-        for doc_id in sorted_doc_ids:
-            if len(results) >= k_results:
-                return results
-            for i, query_term in enumerate(query_terms):
+    def _search_next(self,
+                     search_cursor: SearchCursor,
+                     k_results: int,
+                     deadline: SearchDeadline = None,
+                     trace: QueryTrace = None,
+                     excluded: {int} = frozenset()) -> {int: float}:
+        """
+        Scores the next top k_results docs of the search, leaving out the excluded docs, reading on from the
+        blocks the search already read. The docs scored are dropped from the candidates of the search
+        """
+        if deadline is None:
+            deadline = SearchDeadline(None)
+        stage_start_time = time.perf_counter() if trace is not None else 0.0
 
-                if query_term not in term_postings_lists or doc_id not in term_postings_lists[query_term].postings_dict:
-                    doc_id_scores[i] = 0
+        index = search_cursor.index
+        query_terms = search_cursor.query_terms
+        scored_query = search_cursor.scored_query
+        postings_cursors = search_cursor.postings_cursors
+        doc_term_scores = search_cursor.doc_term_scores
+        doc_impact_scores = search_cursor.doc_impact_scores
+        dropped_doc_scores = search_cursor.dropped_doc_scores
+        docs_scored = search_cursor.docs_scored
+        bytes_read = sum(postings_cursor.bytes_read for postings_cursor in postings_cursors.values())
+
+        # the blocks read for the last page can be enough to settle the next one
+        settled = docs_scored > 0 and self.__top_k_settled(search_cursor, scored_query, k_results, excluded)
+        while not settled and not deadline.expired():
+            unread_cursors = [(term, postings_cursor) for term, postings_cursor in postings_cursors.items()
+                              if postings_cursor.has_next()]
+            if len(unread_cursors) == 0:
+                break
+
+            term, postings_cursor = max(unread_cursors,
+                                        key=lambda x: scored_query[x[0]] * x[1].remaining_max_score())
+            if trace is None:
+                postings = postings_cursor.next_postings()
+            else:
+                block_data = postings_cursor.read_block_data()
+                stage_start_time = trace.add_stage_time("read_postings", stage_start_time)
+                postings = postings_cursor.parse_block_data(block_data)
+                stage_start_time = trace.add_stage_time("parse_postings", stage_start_time)
+                trace.count("blocks_read")
+                trace.count("postings_decoded", len(postings))
+
+            for posting in postings:
+                term_score = posting.impact_score(index.sort_weights) * scored_query[term]
+                doc_id = posting.doc_id
+                if doc_id in dropped_doc_scores:
+                    impact_score, term_scores = dropped_doc_scores[doc_id]
+                    term_scores[term] = term_score
+                    dropped_doc_scores[doc_id] = (impact_score + term_score, term_scores)
                     continue
+                if doc_id in doc_impact_scores:
+                    doc_term_scores[doc_id][term] = term_score
+                    doc_impact_scores[doc_id] += term_score
+                else:
+                    doc_term_scores[doc_id] = {term: term_score}
+                    doc_impact_scores[doc_id] = term_score
+                    search_cursor.docs_scored += 1
+                heapq.heappush(search_cursor.candidate_heap, (-doc_impact_scores[doc_id], doc_id))
+
+            settled = self.__top_k_settled(search_cursor, scored_query, k_results, excluded)
+            if trace is not None:
+                stage_start_time = trace.add_stage_time("score", stage_start_time)
+
+        results: {int: float} = {}
 
-                doc_posting: Posting = term_postings_lists[query_term].postings_dict[doc_id]
-                doc_id_scores[i] = \
-                    doc_posting.global_tf_idf_score * scored_query[query_term] * global_tf_idf_weight + \
-                    doc_posting.local_tf_idf_score * scored_query[query_term] * local_tf_idf_weight + \
-                    doc_posting.page_rank * scored_query[query_term] * page_rank_weight
+        doc_id_scores = [0.0] * len(query_terms)
+
+        top_doc_ids: [int] = []
+        while len(top_doc_ids) < k_results and search_cursor.next_candidate(excluded, top_doc_ids) is not None:
+            pass
+        for doc_id in top_doc_ids:
+            for i, query_term in enumerate(query_terms):
+                doc_id_scores[i] = doc_term_scores[doc_id].get(query_term, 0)
             normalize_factor = math.sqrt(sum(doc_term_score ** 2 for doc_term_score in doc_id_scores))
-            doc_score = score_weight * sum(doc_id_score / normalize_factor for doc_id_score in doc_id_scores)
+            doc_score = search_cursor.score_weight * sum(doc_id_score / normalize_factor
+                                                         for doc_id_score in doc_id_scores)
 
             results.setdefault(doc_id, 0)
             results[doc_id] += doc_score
+            search_cursor.drop(doc_id)  # returned, so left out of the next pages
 
+        if trace is not None:
+            trace.add_stage_time("score", stage_start_time)
+            trace.count("docs_scored", search_cursor.docs_scored - docs_scored)
+            trace.count("bytes_read",
+                        sum(postings_cursor.bytes_read for postings_cursor in postings_cursors.values()) - bytes_read)
+            tier_record = trace.visit_tier(index.descriptor)
+            for term, postings_cursor in postings_cursors.items():
+                trace.record_term(tier_record, term,
+                                  bytes_read=postings_cursor.bytes_read,
+                                  blocks_read=postings_cursor.next_block,
+                                  postings_read=postings_cursor.postings_read,
+                                  list_length=len(postings_cursor))
         return results
+
+    def _intersect(self,
+                   index: Index,
+                   required_terms: [str],
+                   scored_query: {str: float},
+                   score_weight: float,
+                   k_results: int,
+                   deadline: SearchDeadline = None,
+                   trace: QueryTrace = None) -> {int: float}:
+        """
+        Scores the top k_results docs of the index containing all the required terms. Each doc id of the rarest
+        term is looked up in the other terms' lists by skipping and galloping forward, and a miss moves the rarest
+        term's cursor forward to the doc id found, so the work done is bounded by the length of the shortest list
+        """
+        if deadline is None:
+            deadline = SearchDeadline(None)
+
+        stage_start_time = time.perf_counter() if trace is not None else 0.0
+
+        doc_id_cursors: [Optional[DocIdCursor]] = [index.open_doc_id_cursor(term) for term in required_terms]
+        if len(doc_id_cursors) == 0 or any(doc_id_cursor is None for doc_id_cursor in doc_id_cursors):
+            # no doc id lists stored, or a term without one, so no doc can be found to hold every term
+            return {}
+        doc_id_cursors.sort(key=len)
+        rarest_cursor = doc_id_cursors[0]
+
+        if trace is not None:
+            stage_start_time = trace.add_stage_time("open_postings", stage_start_time)
+            trace.count("posting_lists_opened", len(doc_id_cursors))
+
+        top_docs: [(float, int, [float])] = []  # min heap of (impact score, doc id, term scores) of the best docs
+        candidates_checked = 0
+
+        candidate_doc_id = rarest_cursor.doc_id()
+        while candidate_doc_id is not None:
+            candidates_checked += 1
+            if candidates_checked % Scorer.DEADLINE_CHECK_INTERVAL == 0 and deadline.expired():
+                break
+
+            for doc_id_cursor in doc_id_cursors[1:]:
+                doc_id = doc_id_cursor.seek(candidate_doc_id)
+                if doc_id != candidate_doc_id:  # missing from this list, jump the rarest list to where it is at
+                    candidate_doc_id = None if doc_id is None else rarest_cursor.seek(doc_id)
+                    break
+            else:
+                term_scores = [scored_query.get(doc_id_cursor.term, 0) * doc_id_cursor.impact_score()
+                               for doc_id_cursor in doc_id_cursors]
+                doc_entry = (sum(term_scores), candidate_doc_id, term_scores)
+                if len(top_docs) < k_results:
+                    heapq.heappush(top_docs, doc_entry)
+                elif doc_entry > top_docs[0]:
+                    heapq.heapreplace(top_docs, doc_entry)
+                candidate_doc_id = rarest_cursor.advance()
+
+        results: {int: float} = {}
+        for impact_score, doc_id, term_scores in sorted(top_docs, reverse=True):
+            normalize_factor = math.sqrt(sum(term_score ** 2 for term_score in term_scores))
+            results[doc_id] = score_weight * sum(term_score / normalize_factor for term_score in term_scores)
+
+        if trace is not None:
+            trace.add_stage_time("intersect", stage_start_time)
+            trace.count("docs_scored", candidates_checked)
+            trace.count("bytes_read", sum(doc_id_cursor.bytes_read for doc_id_cursor in doc_id_cursors))
+            trace.count("blocks_read", sum(doc_id_cursor.blocks_read for doc_id_cursor in doc_id_cursors))
+            tier_record = trace.visit_tier(index.descriptor)
+            for doc_id_cursor in doc_id_cursors:
+                trace.record_term(tier_record, doc_id_cursor.term,
+                                  bytes_read=doc_id_cursor.bytes_read,
+                                  blocks_read=doc_id_cursor.blocks_read,
+                                  postings_read=doc_id_cursor.postings_read,
+                                  list_length=len(doc_id_cursor))
+        return results
+
+    @staticmethod
+    def __top_k_settled(search_cursor: SearchCursor,
+                        scored_query: {str: float},
+                        k_results: int,
+                        excluded: {int} = frozenset()) -> bool:
+        """
+        Returns True if no doc, read or unread, can get a higher score than the current k-th best doc
+        from the postings left in the unread blocks, leaving out the excluded docs. The candidates after the k-th
+        are checked in order of their impact scores, until the scores left in every list can not lift them over it
+        """
+        doc_term_scores = search_cursor.doc_term_scores
+        doc_impact_scores = search_cursor.doc_impact_scores
+        popped_doc_ids: [int] = []
+        try:
+            while len(popped_doc_ids) < k_results:
+                if search_cursor.next_candidate(excluded, popped_doc_ids) is None:
+                    return False
+            kth_score = doc_impact_scores[popped_doc_ids[-1]]
+
+            remaining_term_scores = {term: max(0.0, scored_query[term] * postings_cursor.remaining_max_score())
+                                     for term, postings_cursor in search_cursor.postings_cursors.items()
+                                     if postings_cursor.has_next()}
+            remaining_score = sum(remaining_term_scores.values())
+            if kth_score < remaining_score:  # a doc not read yet could still beat the k-th doc
+                return False
+
+            while True:
+                doc_id = search_cursor.next_candidate(excluded, popped_doc_ids)
+                if doc_id is None or doc_impact_scores[doc_id] + remaining_score <= kth_score:
+                    return True
+                if doc_impact_scores[doc_id] + sum(term_score for term, term_score in remaining_term_scores.items()
+                                                   if term not in doc_term_scores[doc_id]) > kth_score:
+                    return False
+        finally:
+            search_cursor.push_back(popped_doc_ids)
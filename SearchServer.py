@@ -0,0 +1,162 @@
+import argparse
+import gc
+import json
+import os
+import signal
+import sys
+import urllib.parse
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+
+from Indexer.TieredIndex import TieredIndex
+from Scorer import Scorer
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /search?q=query&k=10&page=1&budget_ms=100 answers with the urls of the page of results as JSON,
+    GET /suggest?q=start of a query with the autocomplete suggestions
+    """
+
+    def do_GET(self):
+        request_url = urllib.parse.urlsplit(self.path)
+        parameters = urllib.parse.parse_qs(request_url.query)
+        query = parameters.get("q", [""])[0]
+        try:
+            k_results = int(parameters.get("k", ["10"])[0])
+            page = int(parameters.get("page", ["1"])[0])
+            time_budget_ms = float(parameters["budget_ms"][0]) if "budget_ms" in parameters else None
+        except ValueError:
+            self.send_error(400, "k, page and budget_ms must be numbers")
+            return
+
+        if request_url.path == "/search":
+            response = self.server.search(query, k_results, max(1, page), time_budget_ms)
+        elif request_url.path == "/suggest":
+            response = {"query": query,
+                        "suggestions": self.server.tiered_index.autocomplete.complete(query, k_results)}
+        else:
+            self.send_error(404, "Use /search or /suggest")
+            return
+
+        response_data = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response_data)))
+        self.end_headers()
+        self.wfile.write(response_data)
+
+    def log_message(self, format, *args):
+        pass  # a line per search would slow the workers down
+
+
+class PreForkSearchServer(HTTPServer):
+    """
+    Serves searches of a tiered index from worker_count forked worker processes, so searches run on as many cores.
+    The index is opened and the socket bound before forking, so the workers share the pages of the mapped index
+    files and, copy on write, of the term dictionaries loaded in memory, and the kernel hands each connection to
+    whichever worker is waiting to accept one
+    """
+
+    def __init__(self, tiered_index: TieredIndex, server_address: (str, int), worker_count: int):
+        super().__init__(server_address, SearchRequestHandler)
+        self.tiered_index: TieredIndex = tiered_index
+        self.worker_count: int = worker_count
+        self.worker_pids: {int: int} = {}  # worker number of each worker process
+        self.worker_number: Optional[int] = None  # set in the workers
+        self.scorer: Optional[Scorer] = None  # each worker searches with its own scorer
+
+    def search(self, query: str, k_results: int, page: int, time_budget_ms: Optional[float]) -> {str: object}:
+        """
+        Searches the first page of results, then the next pages until page, like paging through the driver.
+        The response tells whether the first page came from the precomputed head query results, and the phrase
+        postings cache hits and misses of the search, for load tests to report cache hit ratios
+        """
+        head_query_hits = self.scorer.stats["head_query_hits"]
+        phrase_cache_stats = self.tiered_index.phrase_cache_stats()
+        self.scorer.new_search()
+        results = self.scorer.sprint_search(query, k_results, time_budget_ms=time_budget_ms)
+        for _ in range(page - 1):
+            results = self.scorer.complete_search(query, k_results, time_budget_ms=time_budget_ms)
+        phrase_cache_stats = {counter: count - phrase_cache_stats[counter]
+                              for counter, count in self.tiered_index.phrase_cache_stats().items()}
+        return {
+            "query": query,
+            "page": page,
+            "results": list(results),
+            "partial": results.partial,
+            "worker": self.worker_number,
+            "head_query_hit": self.scorer.stats["head_query_hits"] > head_query_hits,
+            "phrase_cache_hits": phrase_cache_stats["hits"],
+            "phrase_cache_misses": phrase_cache_stats["misses"],
+        }
+
+    def serve_workers(self):
+        """Forks the workers and forks a new one whenever a worker exits, until interrupted or terminated"""
+        # objects loaded before forking are only read by the workers, so keep the garbage collector from writing
+        # to them, which would copy their pages into every worker
+        gc.freeze()
+
+        def terminate(signal_number, frame):
+            raise KeyboardInterrupt()
+        signal.signal(signal.SIGTERM, terminate)
+
+        print(f"Serving on http://{self.server_address[0]}:{self.server_address[1]} "
+              f"with {self.worker_count} workers")
+        try:
+            for worker_number in range(self.worker_count):
+                self.__fork_worker(worker_number)
+            while True:
+                pid, status = os.wait()
+                worker_number = self.worker_pids.pop(pid, None)
+                if worker_number is not None:
+                    print(f"Worker {worker_number} exited with status {status}, starting it again")
+                    self.__fork_worker(worker_number)
+        except KeyboardInterrupt:
+            print(f"Stopping {len(self.worker_pids)} workers")
+        finally:
+            for pid in self.worker_pids:
+                os.kill(pid, signal.SIGTERM)
+            for pid in self.worker_pids:
+                os.waitpid(pid, 0)
+            self.worker_pids.clear()
+            self.server_close()
+
+    def __fork_worker(self, worker_number: int):
+        pid = os.fork()
+        if pid != 0:
+            self.worker_pids[pid] = worker_number
+            return
+
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.worker_pids.clear()
+        self.worker_number = worker_number
+        self.scorer = Scorer(self.tiered_index)
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os._exit(0)
+
+
+def main(arguments: [str]):
+    parser = argparse.ArgumentParser(description="Serves searches of the tiered indexes over http")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--max-n-grams", type=int, default=3)
+    parser.add_argument("--page-rank-iterations", type=int, default=5)
+    parser.add_argument("--warm-up-mb", type=int, default=TieredIndex.WARM_UP_BUDGET >> 20,
+                        help="megabytes of the posting lists queried most read into the page cache before serving")
+    args = parser.parse_args(arguments)
+
+    with TieredIndex(args.max_n_grams, args.page_rank_iterations) as tiered_index:
+        # before the workers are forked, which share the page cache of the mapped index files
+        tiered_index.warm_up(args.warm_up_mb << 20)
+        server = PreForkSearchServer(tiered_index, (args.host, args.port), args.workers)
+        server.serve_workers()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
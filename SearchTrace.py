@@ -0,0 +1,172 @@
+import json
+import time
+from typing import Optional
+
+
+class QueryTrace:
+    """
+    Per stage timers and counters for a single search call. A trace is only created when tracing is enabled,
+    the search code checks for None before touching it so an untraced search pays nothing more than that check
+    """
+
+    def __init__(self, query: str, search_type: str):
+        self.query: str = query
+        self.search_type: str = search_type
+        self.start_time: float = time.perf_counter()
+        self.total_seconds: float = 0.0
+        self.partial: bool = False
+        self.results_count: int = 0
+
+        self.stage_seconds: {str: float} = {}  # tokenize, plan, open_postings, read_postings, parse_postings, ...
+        self.counters: {str: int} = {
+            "bytes_read": 0,
+            "blocks_read": 0,
+            "postings_decoded": 0,
+            "posting_lists_opened": 0,
+            "tiers_visited": 0,
+            "docs_scored": 0,
+        }
+        self.tiers: [{str: object}] = []  # what was read from each tier visited, for dumping slow queries
+
+    def add_stage_time(self, stage: str, stage_start_time: float) -> float:
+        """Adds the time since stage_start_time to the stage and returns the time now for the next stage"""
+        now = time.perf_counter()
+        self.stage_seconds.setdefault(stage, 0.0)
+        self.stage_seconds[stage] += now - stage_start_time
+        return now
+
+    def count(self, counter: str, amount: int = 1):
+        self.counters.setdefault(counter, 0)
+        self.counters[counter] += amount
+
+    def visit_tier(self, descriptor: str) -> {str: object}:
+        """Records a visit to a tier, returning the tier's record for the per term counters"""
+        self.count("tiers_visited")
+        tier_record = {"tier": descriptor, "terms": {}}
+        self.tiers.append(tier_record)
+        return tier_record
+
+    def record_term(self, tier_record: {str: object}, term: str, bytes_read: int, blocks_read: int,
+                    postings_read: int, list_length: int):
+        tier_record["terms"][term] = {"bytes_read": bytes_read,
+                                      "blocks_read": blocks_read,
+                                      "postings_read": postings_read,
+                                      "list_length": list_length}
+
+    def finish(self, results_count: int, partial: bool):
+        self.total_seconds = time.perf_counter() - self.start_time
+        self.results_count = results_count
+        self.partial = partial
+
+    @property
+    def total_ms(self) -> float:
+        return self.total_seconds * 1000
+
+    def to_dict(self) -> {str: object}:
+        return {
+            "query": self.query,
+            "search_type": self.search_type,
+            "total_ms": round(self.total_ms, 3),
+            "partial": self.partial,
+            "results": self.results_count,
+            "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in self.stage_seconds.items()},
+            "counters": dict(self.counters),
+            "tiers": self.tiers,
+        }
+
+    def dump(self) -> str:
+        return json.dumps(self.to_dict())
+
+
+class Histogram:
+    """Counts values into fixed buckets, upper bounds in increasing order with a final overflow bucket"""
+
+    def __init__(self, bucket_upper_bounds: [float]):
+        self.bucket_upper_bounds: [float] = bucket_upper_bounds
+        self.bucket_counts: [int] = [0] * (len(bucket_upper_bounds) + 1)
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+
+    def add(self, value: float):
+        bucket = 0
+        while bucket < len(self.bucket_upper_bounds) and value > self.bucket_upper_bounds[bucket]:
+            bucket += 1
+        self.bucket_counts[bucket] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent: float) -> float:
+        """Upper bound of the bucket holding the percentile, the max value seen for the overflow bucket"""
+        if self.count == 0:
+            return 0.0
+        rank = percent / 100 * self.count
+        seen = 0
+        for bucket, bucket_count in enumerate(self.bucket_counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count > 0:
+                if bucket < len(self.bucket_upper_bounds):
+                    return min(self.bucket_upper_bounds[bucket], self.max)
+                return self.max
+        return self.max
+
+    def to_dict(self) -> {str: object}:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count > 0 else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+            "buckets": {f"<={upper_bound}": bucket_count
+                        for upper_bound, bucket_count in zip(self.bucket_upper_bounds, self.bucket_counts)},
+            "overflow": self.bucket_counts[-1],
+        }
+
+
+class TraceAggregator:
+    """
+    Aggregates the traces of many searches into histograms of their stage times and counters, and appends the
+    full trace of every search slower than slow_query_threshold_ms to the slow query log
+    """
+
+    LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000]
+    COUNTER_BUCKETS = [2 ** power for power in range(0, 25, 2)]
+
+    def __init__(self, slow_query_threshold_ms: Optional[float] = 100.0, slow_query_log_file: Optional[str] = None):
+        self.slow_query_threshold_ms: Optional[float] = slow_query_threshold_ms
+        self.slow_query_log_file: Optional[str] = slow_query_log_file
+        self.slow_queries: int = 0
+
+        self.total_ms: {str: Histogram} = {}  # keyed by search type
+        self.stage_ms: {str: Histogram} = {}
+        self.counters: {str: Histogram} = {}
+
+    def record(self, trace: QueryTrace):
+        self.total_ms.setdefault(trace.search_type, Histogram(TraceAggregator.LATENCY_BUCKETS_MS))
+        self.total_ms[trace.search_type].add(trace.total_ms)
+
+        for stage, seconds in trace.stage_seconds.items():
+            self.stage_ms.setdefault(stage, Histogram(TraceAggregator.LATENCY_BUCKETS_MS))
+            self.stage_ms[stage].add(seconds * 1000)
+
+        for counter, value in trace.counters.items():
+            self.counters.setdefault(counter, Histogram(TraceAggregator.COUNTER_BUCKETS))
+            self.counters[counter].add(value)
+
+        if self.slow_query_threshold_ms is not None and trace.total_ms >= self.slow_query_threshold_ms:
+            self.slow_queries += 1
+            if self.slow_query_log_file is not None:
+                with open(self.slow_query_log_file, mode="a") as f:
+                    f.write(f"{trace.dump()}\n")
+            else:
+                print(f"\nSlow query: {trace.dump()}")
+
+    def summary(self) -> {str: object}:
+        return {
+            "slow_queries": self.slow_queries,
+            "total_ms": {search_type: histogram.to_dict() for search_type, histogram in self.total_ms.items()},
+            "stage_ms": {stage: histogram.to_dict() for stage, histogram in self.stage_ms.items()},
+            "counters": {counter: histogram.to_dict() for counter, histogram in self.counters.items()},
+        }
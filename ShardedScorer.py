@@ -0,0 +1,130 @@
+import heapq
+import multiprocessing
+from multiprocessing.connection import Connection
+from typing import Optional
+
+from Indexer.ShardedTieredIndex import ShardedTieredIndex
+from Indexer.TieredIndex import TieredIndex
+from Scorer import Scorer, SearchResults
+
+
+def shard_worker(shard_directory: str,
+                 max_n_grams: int,
+                 page_rank_iterations: int,
+                 document_term_counts: {str: int},
+                 connection: Connection):
+    """
+    Serves the searches of one shard over the connection until it receives None. Each request is a search method
+    name with the query, k_results and time budget, answered with the scored doc ids of the shard and whether the
+    search ran out of its time budget, or new_search, or forget_returned with the doc ids of the shard left out
+    of the merged page
+    """
+    with TieredIndex(max_n_grams, page_rank_iterations, data_directory=shard_directory) as tiered_index:
+        scorer = Scorer(tiered_index, document_term_counts=document_term_counts)
+        connection.send("ready")
+        while True:
+            request = connection.recv()
+            if request is None:
+                break
+            search_method, *arguments = request
+            if search_method == "new_search":
+                scorer.new_search()
+                continue
+            if search_method == "forget_returned":
+                scorer.forget_returned(*arguments)
+                continue
+            query, k_results, time_budget_ms = arguments
+            results = getattr(scorer, search_method)(query, k_results, time_budget_ms=time_budget_ms)
+            connection.send((list(scorer.current_results.items()), results.partial))
+    connection.close()
+
+
+class ShardedScorer:
+    """
+    Searches the shards of a sharded tiered index in parallel, with a worker process per shard reached over a pipe.
+    Each search is scattered to every shard and the top k_results of the shards are merged by score, which compare
+    across shards since the shards were built with the idf and PageRank of the whole collection
+    """
+
+    def __enter__(self):
+        return self
+
+    def __init__(self, sharded_tiered_index: ShardedTieredIndex):
+        self.sharded_tiered_index: ShardedTieredIndex = sharded_tiered_index
+        self.current_results: {int: float} = {}
+        self.stats: {str: int} = {"searches": 0, "budget_exceeded": 0}
+
+        # the query terms are weighted with the doc counts of the whole collection in every shard
+        document_term_counts = sharded_tiered_index.complete_index.document_term_counts
+
+        self.connections: [Connection] = []
+        self.workers: [multiprocessing.Process] = []
+        for shard_directory in sharded_tiered_index.shard_directories:
+            connection, worker_connection = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=shard_worker,
+                                             args=(shard_directory,
+                                                   sharded_tiered_index.max_n_grams,
+                                                   sharded_tiered_index.page_rank_iterations,
+                                                   document_term_counts,
+                                                   worker_connection),
+                                             daemon=True)
+            worker.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.workers.append(worker)
+
+        # wait for every shard to load its indexes so the first search is not timed with the start up
+        for connection in self.connections:
+            connection.recv()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(None)
+            connection.close()
+        for worker in self.workers:
+            worker.join()
+        self.connections.clear()
+        self.workers.clear()
+
+    def sprint_search(self, query: str, k_results, time_budget_ms: Optional[float] = None) -> SearchResults:
+        return self.__scatter_gather("sprint_search", query, k_results, time_budget_ms)
+
+    def complete_search(self, query: str, k_results, time_budget_ms: Optional[float] = None) -> SearchResults:
+        return self.__scatter_gather("complete_search", query, k_results, time_budget_ms)
+
+    def conjunctive_search(self, query: str, k_results, time_budget_ms: Optional[float] = None) -> SearchResults:
+        return self.__scatter_gather("conjunctive_search", query, k_results, time_budget_ms)
+
+    def new_search(self):
+        for connection in self.connections:
+            connection.send(("new_search",))
+
+    def __scatter_gather(self, search_method: str, query: str, k_results, time_budget_ms: Optional[float]):
+        """Sends the search to every shard before waiting on any, then merges the top k_results of all the shards"""
+        for connection in self.connections:
+            connection.send((search_method, query, k_results, time_budget_ms))
+
+        shard_doc_scores: [[(int, float)]] = []
+        partial = False
+        for connection in self.connections:
+            doc_scores, shard_partial = connection.recv()
+            shard_doc_scores.append(doc_scores)
+            partial = partial or shard_partial
+
+        self.current_results = dict(heapq.nlargest(k_results, (doc_score for doc_scores in shard_doc_scores
+                                                               for doc_score in doc_scores), key=lambda x: x[1]))
+
+        # the shards count all their results as returned, so the next pages would skip the ones left out
+        for connection, doc_scores in zip(self.connections, shard_doc_scores):
+            left_out_doc_ids = [doc_id for doc_id, _ in doc_scores if doc_id not in self.current_results]
+            if len(left_out_doc_ids) > 0:
+                connection.send(("forget_returned", left_out_doc_ids))
+        self.stats["searches"] += 1
+        if partial:
+            self.stats["budget_exceeded"] += 1
+        return SearchResults([self.sharded_tiered_index.doc_table.get_url(doc_id) for doc_id in
+                              sorted(self.current_results, key=lambda x: self.current_results[x], reverse=True)],
+                             partial=partial)
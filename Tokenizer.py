@@ -1,4 +1,5 @@
 import re
+import zlib
 
 import bs4
 from bs4 import BeautifulSoup
@@ -15,7 +16,8 @@ stemmer = Stemmer()
 
 def tokenize_html(html_content: str, encoding: str, max_n_gram_size) -> {str: {str: [int]}}:
     """
-    Returns a dict containing stemmed token as key with list of positions
+    Returns a dict containing stemmed token as key with list of positions,
+    and the words of the title and of the rest of the page in order with their stemmed terms for the forward index
     """
     soup = BeautifulSoup(html_content, features="lxml")
     doc_term_dict = {
@@ -23,6 +25,8 @@ def tokenize_html(html_content: str, encoding: str, max_n_gram_size) -> {str: {s
         "header": {},
         "bold": {},
         "text": {},
+        "title_words": [],
+        "words": [],
     }
 
     header_tag_names = {"h1", "h2", "h3", "h4", "h5", "h6"}
@@ -43,6 +47,7 @@ def tokenize_html(html_content: str, encoding: str, max_n_gram_size) -> {str: {s
 
                     if len(term) > 0:
 
+                        doc_term_dict["title_words" if parent_tag.name == "title" else "words"].append((token, term))
                         last_n_terms.insert(0, term)
                         if len(last_n_terms) > max_n_gram_size:
                             del last_n_terms[max_n_gram_size]
@@ -88,7 +93,8 @@ def get_doc_simhash(html_content: str):
                 term_frequency_counts.setdefault(term, 0)
                 term_frequency_counts[term] += 1
 
-    term_hashes = {term: hash(term) for term in term_frequency_counts}
+    # crc32 rather than hash, for the reason of Indexer.Index.stable_hash
+    term_hashes = {term: zlib.crc32(term.encode("utf-8")) for term in term_frequency_counts}
 
     v = [0] * 32
 
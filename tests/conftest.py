@@ -0,0 +1,47 @@
+from pathlib import Path
+
+import pytest
+
+from Benchmark.CorpusGenerator import CorpusGenerator
+from Indexer.TieredIndex import TieredIndex
+
+DOC_COUNT = 150
+
+
+def make_data_directory(path: Path) -> str:
+    """Creates the index directories of a TieredIndex data_directory in path"""
+    for directory_name in ("Tiered_Indexes", "Partial_Tiered_Indexes", "Tiered_Indexes_Settings"):
+        path.joinpath(directory_name).mkdir(parents=True, exist_ok=True)
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def local_store(tmp_path_factory) -> Path:
+    """A small synthetic local store, with a vocabulary small enough for the words to share docs"""
+    local_store_path = tmp_path_factory.mktemp("Local_Store")
+    CorpusGenerator(doc_count=DOC_COUNT, vocabulary_size=400, words_per_doc=120, seed=1).generate(
+        str(local_store_path))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(TieredIndex, "local_store_dir", str(local_store_path))
+        yield local_store_path
+
+
+@pytest.fixture(scope="session")
+def tiered_index(local_store, tmp_path_factory) -> TieredIndex:
+    data_directory = make_data_directory(tmp_path_factory.mktemp("Index"))
+    with TieredIndex(3, 5, data_directory=data_directory) as tiered_index:
+        tiered_index.build_tiered_indexes()
+    with TieredIndex(3, 5, data_directory=data_directory) as tiered_index:
+        yield tiered_index
+
+
+def frequent_words(tiered_index: TieredIndex, count: int) -> [str]:
+    """The single word terms of the complete index found in the most docs"""
+    term_counts = tiered_index.complete_index.document_term_counts
+    return sorted((term for term in term_counts if " " not in term), key=lambda x: (-term_counts[x], x))[:count]
+
+
+def posting_doc_ids(tiered_index: TieredIndex, term: str) -> {int}:
+    """Doc ids of every posting of the term in the complete index, which keeps all of them"""
+    postings_list = tiered_index.complete_index.retrieve_posting_list(term)
+    return {posting.doc_id for posting in postings_list.postings_list} if postings_list is not None else set()
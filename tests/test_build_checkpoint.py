@@ -0,0 +1,75 @@
+import json
+from pathlib import Path
+
+import pytest
+
+import Tokenizer
+from Indexer.Index import Index
+from Indexer.TieredIndex import TieredIndex
+from tests.conftest import make_data_directory
+
+
+class BuildInterrupted(Exception):
+    pass
+
+
+def build(data_directory: str, resume: bool = False):
+    with TieredIndex(3, 5, data_directory=data_directory) as tiered_index:
+        tiered_index.build_tiered_indexes(resume=resume)
+
+
+def index_files(data_directory: str) -> {str: bytes}:
+    index_path = Path(data_directory).joinpath("Tiered_Indexes")
+    return {str(path.relative_to(index_path)): path.read_bytes() for path in sorted(index_path.rglob("*"))
+            if path.is_file() and "build_metrics" not in path.name}
+
+
+@pytest.fixture
+def small_partial_indexes(monkeypatch):
+    # partial indexes spill every few docs and checkpoints are saved every 20 pages, so a build of the test
+    # corpus goes through several of both
+    monkeypatch.setattr(Index, "MAX_PARTIAL_INDEX_POSITIONS", 400)
+    monkeypatch.setattr(TieredIndex, "CHECKPOINT_INTERVAL", 20)
+
+
+def test_resumed_build_matches_uninterrupted_build(local_store, tmp_path, monkeypatch, capsys,
+                                                   small_partial_indexes):
+    expected_directory = make_data_directory(tmp_path.joinpath("expected"))
+    build(expected_directory)
+
+    resumed_directory = make_data_directory(tmp_path.joinpath("resumed"))
+    tokenize_html = Tokenizer.tokenize_html
+    tokenize_calls = [0]
+
+    def interrupted_tokenize_html(*args, **kwargs):
+        tokenize_calls[0] += 1
+        if tokenize_calls[0] > 100:
+            raise BuildInterrupted()
+        return tokenize_html(*args, **kwargs)
+
+    with monkeypatch.context() as interrupted:
+        interrupted.setattr(Tokenizer, "tokenize_html", interrupted_tokenize_html)
+        with pytest.raises(BuildInterrupted):
+            build(resumed_directory)
+
+    checkpoint_path = Path(resumed_directory).joinpath("Tiered_Indexes_Settings", TieredIndex.checkpoint_file_name)
+    with open(checkpoint_path) as f:
+        assert json.load(f)["stage"] == "parse"
+
+    capsys.readouterr()
+    build(resumed_directory, resume=True)
+    resumed_pages = int(capsys.readouterr().out.split("Resuming build from checkpoint at stage parse, ")[1].split()[0])
+    assert 0 < resumed_pages <= 100
+    assert not checkpoint_path.exists()
+
+    assert index_files(resumed_directory) == index_files(expected_directory)
+
+
+def test_resume_without_checkpoint_builds_from_scratch(local_store, tmp_path, small_partial_indexes):
+    expected_directory = make_data_directory(tmp_path.joinpath("expected"))
+    build(expected_directory)
+
+    resumed_directory = make_data_directory(tmp_path.joinpath("resumed"))
+    build(resumed_directory, resume=True)
+
+    assert index_files(resumed_directory) == index_files(expected_directory)
@@ -0,0 +1,41 @@
+import itertools
+
+from Scorer import Scorer
+from tests.conftest import frequent_words, posting_doc_ids
+
+
+def brute_force_and(tiered_index, terms: [str]) -> {int}:
+    return set.intersection(*(posting_doc_ids(tiered_index, term) for term in terms))
+
+
+def test_intersect_matches_brute_force_and(tiered_index):
+    scorer = Scorer(tiered_index)
+    index = tiered_index.complete_index
+    words = frequent_words(tiered_index, 40)
+    # common words, rare words and a mix of both, so some lists are many times longer than others
+    queries = [list(pair) for pair in itertools.combinations(words[:6], 2)] + \
+              [words[:3], words[:4], [words[0], words[-1]], [words[-2], words[-1]], [words[1], words[20], words[-1]]]
+
+    for terms in queries:
+        expected_doc_ids = brute_force_and(tiered_index, terms)
+        results = scorer._intersect(index, terms, {term: 1.0 for term in terms}, 1.0, len(tiered_index.doc_table) + 1)
+        assert set(results) == expected_doc_ids, terms
+
+
+def test_intersect_keeps_top_k(tiered_index):
+    scorer = Scorer(tiered_index)
+    index = tiered_index.complete_index
+    terms = frequent_words(tiered_index, 2)
+    scored_query = {term: 1.0 for term in terms}
+
+    all_results = scorer._intersect(index, terms, scored_query, 1.0, len(tiered_index.doc_table) + 1)
+    top_results = scorer._intersect(index, terms, scored_query, 1.0, 5)
+    assert len(top_results) == min(5, len(all_results))
+    assert set(top_results) <= set(all_results)
+
+
+def test_intersect_term_missing_from_index(tiered_index):
+    scorer = Scorer(tiered_index)
+    terms = frequent_words(tiered_index, 1) + ["qqqqqq"]
+
+    assert scorer._intersect(tiered_index.complete_index, terms, {term: 1.0 for term in terms}, 1.0, 10) == {}
@@ -0,0 +1,100 @@
+from typing import Optional
+
+from QueryPlanner import QueryPlanner
+from Scorer import Scorer
+from tests.conftest import frequent_words
+
+
+class FakeIndex:
+    """A tier with the posting list statistics the planner reads, 100 bytes per posting"""
+
+    def __init__(self, descriptor: str, posting_list_lengths: {str: int},
+                 postings_list_size_limit: Optional[int] = None):
+        self.descriptor: str = descriptor
+        self.document_term_counts: {str: int} = posting_list_lengths
+        self.postings_list_size_limit: Optional[int] = postings_list_size_limit
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.document_term_counts
+
+    def estimate_posting_list_bytes(self, term: str) -> int:
+        return 100 * self.effective_posting_list_length(term)
+
+    def effective_posting_list_length(self, term: str) -> int:
+        length = self.document_term_counts.get(term, 0)
+        return length if self.postings_list_size_limit is None else min(length, self.postings_list_size_limit)
+
+
+class FakeTieredIndex:
+
+    def __init__(self, complete_index: FakeIndex):
+        self.complete_index: FakeIndex = complete_index
+
+
+def sprint_tiers() -> [(FakeIndex, float)]:
+    return [
+        (FakeIndex("title_index", {"sandy": 3}), 8.0),
+        (FakeIndex("anchor_index", {"other": 50}), 7.0),
+        (FakeIndex("header_index", {"sandy": 10}), 5.0),
+        (FakeIndex("limited_index", {"sandy": 100}, postings_list_size_limit=1000), 1.0),
+    ]
+
+
+def descriptors(tier_plans) -> [str]:
+    return [tier_plan.index.descriptor for tier_plan in tier_plans]
+
+
+def planner(cost_budget_bytes: Optional[int]) -> QueryPlanner:
+    return QueryPlanner(FakeTieredIndex(FakeIndex("complete_index", {"sandy": 100})),
+                        cost_budget_bytes=cost_budget_bytes)
+
+
+def test_tiers_chosen_until_enough_docs_expected():
+    # title_index and header_index cost 4396B + 5096B, over the budget, but title_index may only hold 3 of the 5
+    # docs so header_index is still chosen. limited_index is deferred once 13 docs are expected
+    plan = planner(6000).plan_sprint_search(sprint_tiers(), {"sandy": 1.0}, 5)
+
+    assert descriptors(plan.chosen) == ["title_index", "header_index"]
+    assert descriptors(plan.fallback) == ["limited_index"]
+    assert descriptors(plan.tiers_to_search) == ["title_index", "header_index", "limited_index"]
+    assert plan.estimated_cost == 4396 + 5096
+    assert "skipped anchor_index has no query terms" in plan.reason
+    assert "deferred limited_index" in plan.reason
+    assert "? limited_index" in plan.explain()
+
+
+def test_tiers_over_budget_deferred_in_priority_order():
+    plan = planner(5000).plan_sprint_search(sprint_tiers(), {"sandy": 1.0}, 2)
+
+    assert descriptors(plan.chosen) == ["title_index"]
+    assert descriptors(plan.fallback) == ["header_index", "limited_index"]
+
+
+def test_no_budget_chooses_every_tier_with_query_terms():
+    plan = planner(None).plan_sprint_search(sprint_tiers(), {"sandy": 1.0}, 5)
+
+    assert descriptors(plan.chosen) == ["title_index", "header_index", "limited_index"]
+    assert plan.fallback == []
+
+
+def test_query_without_indexed_terms_chooses_no_tiers():
+    plan = planner(None).plan_sprint_search(sprint_tiers(), {"missing": 1.0}, 5)
+
+    assert plan.chosen == []
+    assert plan.fallback == []
+
+
+def test_fallback_tiers_fill_a_short_page(tiered_index):
+    # with a budget of one byte the tiers after those that may hold a page of every doc are deferred, a doc is in
+    # several tiers so the page comes back short and the search finds the same docs as a search without a budget
+    query = frequent_words(tiered_index, 1)[0]
+    k_results = len(tiered_index.doc_table)
+
+    deferred_scorer = Scorer(tiered_index, QueryPlanner(tiered_index, cost_budget_bytes=1))
+    plan = deferred_scorer.query_planner.plan_sprint_search(deferred_scorer.sprint_tiers(), {query: 1.0}, k_results)
+    assert len(plan.fallback) > 0
+
+    deferred_results = deferred_scorer.sprint_search(query, k_results)
+    results = Scorer(tiered_index, QueryPlanner(tiered_index, cost_budget_bytes=None)).sprint_search(query, k_results)
+    assert len(deferred_results) > 0
+    assert list(deferred_results) == list(results)
@@ -0,0 +1,51 @@
+from Scorer import Scorer
+from tests.conftest import frequent_words, posting_doc_ids
+
+
+def complete_search_pages(scorer: Scorer, query: str, k_results: int) -> [[int]]:
+    pages = []
+    while len(pages) < 100:
+        scorer.complete_search(query, k_results)
+        if len(scorer.current_results) == 0:
+            break
+        pages.append(list(scorer.current_results))
+    return pages
+
+
+def test_complete_search_pages_have_no_duplicates(tiered_index):
+    word = frequent_words(tiered_index, 1)[0]
+    scorer = Scorer(tiered_index)
+
+    pages = complete_search_pages(scorer, word, 5)
+    doc_ids = [doc_id for page in pages for doc_id in page]
+    assert len(pages) > 2
+    assert all(len(page) == 5 for page in pages[:-1])
+    assert len(doc_ids) == len(set(doc_ids))
+    assert set(doc_ids) == posting_doc_ids(tiered_index, word)
+
+
+def test_forgotten_docs_are_returned_again(tiered_index):
+    word = frequent_words(tiered_index, 1)[0]
+    scorer = Scorer(tiered_index)
+
+    scorer.complete_search(word, 5)
+    first_page = list(scorer.current_results)
+    scorer.complete_search(word, 5)
+    second_page = list(scorer.current_results)
+    assert set(first_page).isdisjoint(second_page)
+
+    scorer.forget_returned(first_page)
+    scorer.complete_search(word, 5)
+    assert set(scorer.current_results) == set(first_page)
+
+
+def test_new_search_starts_from_the_first_page(tiered_index):
+    word = frequent_words(tiered_index, 1)[0]
+    scorer = Scorer(tiered_index)
+
+    scorer.complete_search(word, 5)
+    first_page = list(scorer.current_results)
+    scorer.complete_search(word, 5)
+    scorer.new_search()
+    scorer.complete_search(word, 5)
+    assert list(scorer.current_results) == first_page